@@ -0,0 +1,30 @@
+# archive_db.py
+import logging
+import sys
+from database import init_db, archive_closed_calls
+
+# Nastavení logování
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+DEFAULT_RETENTION_DAYS = 30  # Shodné s výchozím ARCHIVE_RETENTION_DAYS v config.py
+
+
+if __name__ == "__main__":
+    # Použití: python archive_db.py [počet dní od uzavření]
+    # Vhodné pro spouštění z cronu, nepotřebuje token bota.
+    retention_days = DEFAULT_RETENTION_DAYS
+    if len(sys.argv) > 1:
+        try:
+            retention_days = int(sys.argv[1])
+        except ValueError:
+            logging.error(f"Neplatný počet dní: {sys.argv[1]}")
+            sys.exit(1)
+
+    logging.info(f"Spouštím archivaci výzev uzavřených déle než {retention_days} dní...")
+    init_db()
+    stats = archive_closed_calls(retention_days=retention_days)
+    if stats is None:
+        sys.exit(1)
+    logging.info(f"Archivace dokončena: {stats}")
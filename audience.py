@@ -0,0 +1,262 @@
+# audience.py
+# -*- coding: utf-8 -*-
+"""Index cílových skupin (segmentů) uživatelů pro oznámení výzev.
+
+Segment je bitmapa nad hustým pořadím uživatelů: telegram_id jsou řídká,
+proto každý uživatel při prvním výskytu dostane pořadové číslo a bitmapa
+má jen tolik bitů, kolik je uživatelů. Průnik segmentů je bitový AND
+(Python int) a počet příjemců int.bit_count() - dotaz nad statisíci
+uživatelů trvá jednotky ms místo JOINů přes participations a users.
+
+Drží se bitmapa přihlášených (nezrušená účast) pro každou výzvu, pro každý
+den, kdy uživatel naposledy vyplnil údaje, a uživatelů se zrušenou účastí;
+cenové a názvové segmenty jsou sjednocení bitmap výzev. Index se jednou
+postaví z DB a dál se obnovuje přírůstkově: každá změna účasti posune
+participation_timestamp, před dotazem se tedy přepočítají jen uživatelé
+změnění od posledního obnovení. Zdrojem pravdy je DB, takže to platí i pro
+zápisy jiných workerů. Archivace účasti maže - po ní se index postaví znovu.
+
+Výraz je průnik segmentů oddělených mezerou (vše v rámci jednoho bota):
+    vyzva:<ID>       přihlášení do výzvy
+    cena:<od>-<do>   přihlášení do některé výzvy s cenou v rozsahu (cena:-500, cena:1000-)
+    nazev:<text>     přihlášení do některé výzvy, jejíž název obsahuje text
+    aktivni:<dny>    vyplnili údaje za posledních N dní
+    bez_zruseni      účastníci bez zrušené účasti
+    vsichni          všichni účastníci výzev bota
+"""
+import threading
+import time
+from collections import defaultdict
+from itertools import groupby
+
+from database import get_audience_rows, get_changed_participants
+
+DAY = 86400
+WATERMARK_SLACK = 2  # s - přesah obnovy (zápis se stejnou nebo o chvilku starší časovou značkou)
+REBUILD_FRACTION = 0.2  # Změnilo-li se víc uživatelů, index se postaví znovu (levnější než po jednom)
+COLLECTED = ("data_collected", "confirmed")
+
+
+class SegmentError(ValueError):
+    """Neplatný výraz segmentu (text chyby je pro admina)."""
+
+
+class Bitmap:
+    """Měnitelná bitmapa (bytearray) s líně sestavenou podobou int pro AND/OR."""
+
+    __slots__ = ("_bytes", "_int")
+
+    def __init__(self):
+        self._bytes = bytearray()
+        self._int = 0
+
+    def get(self, ordinal: int) -> bool:
+        index = ordinal >> 3
+        return index < len(self._bytes) and bool(self._bytes[index] >> (ordinal & 7) & 1)
+
+    def set(self, ordinal: int, value: bool = True) -> None:
+        index = ordinal >> 3
+        if index >= len(self._bytes):
+            if not value:
+                return
+            self._bytes.extend(bytes(index + 1 - len(self._bytes)))
+        byte = self._bytes[index] | 1 << (ordinal & 7) if value else self._bytes[index] & ~(1 << (ordinal & 7)) & 0xFF
+        if byte != self._bytes[index]:
+            self._bytes[index] = byte
+            self._int = None  # Nezměněný bit (opakovaná obnova téhož uživatele) cache int nezahodí
+
+    def as_int(self) -> int:
+        if self._int is None:
+            self._int = int.from_bytes(self._bytes, "little")
+        return self._int
+
+
+def parse_expression(expression: str) -> list[tuple[str, object]]:
+    """Rozloží výraz na segmenty [(druh, parametr)]; neplatný vyvolá SegmentError."""
+    terms = []
+    for token in expression.split():
+        kind, _, value = token.partition(":")
+        kind = kind.lower()
+        if kind in ("bez_zruseni", "vsichni") and not value:
+            terms.append((kind, None))
+        elif kind in ("vyzva", "aktivni") and value.isdigit():
+            terms.append((kind, int(value)))
+        elif kind == "nazev" and value:
+            terms.append((kind, value.lower()))
+        elif kind == "cena" and "-" in value:
+            low, _, high = value.partition("-")
+            try:
+                terms.append((kind, (float(low) if low else 0.0, float(high) if high else float("inf"))))
+            except ValueError:
+                raise SegmentError(f"Neplatný rozsah ceny '{value}' (např. cena:100-500).")
+        else:
+            raise SegmentError(f"Neznámý segment '{token}'. Segmenty: vyzva:<ID>, cena:<od>-<do>, nazev:<text>, aktivni:<dny>, bez_zruseni, vsichni.")
+    if not terms:
+        raise SegmentError("Zadej aspoň jeden segment, např. cena:100-500 bez_zruseni.")
+    return terms
+
+
+class AudienceIndex:
+    """Segmenty všech botů procesu; obnova i dotazy pod zámkem (volá se z vláken db_poolu)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built = False
+        self.stats = {"builds": 0, "refreshes": 0, "refreshed_users": 0}
+        self._reset()
+
+    def _reset(self) -> None:
+        self._ordinals: dict[int, int] = {}  # telegram_id -> pořadí bitu
+        self._user_ids: list[int] = []  # pořadí bitu -> telegram_id
+        self._calls: dict[int, Bitmap] = {}  # call_id -> přihlášení
+        self._call_info: dict[int, tuple[str, str, float]] = {}  # call_id -> (tenant, název malými, cena)
+        self._collected_days: defaultdict[str, dict[int, Bitmap]] = defaultdict(dict)  # tenant -> den posledních údajů -> uživatelé
+        self._cancelled: defaultdict[str, Bitmap] = defaultdict(Bitmap)  # tenant -> uživatelé se zrušenou účastí
+        self._watermark = 0
+
+    def __len__(self) -> int:
+        return len(self._user_ids)
+
+    def invalidate(self) -> None:
+        """Příští dotaz index postaví znovu (po archivaci, která účasti maže)."""
+        with self._lock:
+            self._built = False
+
+    # --- Obnova ---
+    def _ordinal(self, user_id: int) -> int:
+        ordinal = self._ordinals.get(user_id)
+        if ordinal is None:
+            ordinal = self._ordinals[user_id] = len(self._user_ids)
+            self._user_ids.append(user_id)
+        return ordinal
+
+    def _apply_user(self, user_id: int, rows: list) -> None:
+        """Přepočítá členství uživatele podle všech jeho účastí (prázdné rows = žádné)."""
+        known = user_id in self._ordinals  # Nový uživatel v žádné bitmapě není, odebírat není co
+        ordinal = self._ordinal(user_id)
+        joined, days, cancelled = set(), {}, set()
+        for row in rows:
+            self._call_info[row["call_id"]] = (row["tenant"], (row["name"] or "").lower(), row["deal_price"] or 0.0)
+            if row["status"] == "cancelled":
+                cancelled.add(row["tenant"])
+                continue
+            joined.add(row["call_id"])
+            if row["status"] in COLLECTED:
+                days[row["tenant"]] = max(days.get(row["tenant"], 0), row["participation_timestamp"] // DAY)
+        if known:
+            for call_id, bitmap in self._calls.items():
+                if bitmap.get(ordinal) and call_id not in joined:
+                    bitmap.set(ordinal, False)
+            for tenant, by_day in self._collected_days.items():
+                for day, bitmap in by_day.items():
+                    if bitmap.get(ordinal) and days.get(tenant) != day:
+                        bitmap.set(ordinal, False)
+            for tenant, bitmap in self._cancelled.items():
+                if bitmap.get(ordinal) and tenant not in cancelled:
+                    bitmap.set(ordinal, False)
+        for call_id in joined:
+            bitmap = self._calls.get(call_id)
+            if bitmap is None:
+                bitmap = self._calls[call_id] = Bitmap()
+            bitmap.set(ordinal)
+        for tenant, day in days.items():
+            self._collected_days[tenant].setdefault(day, Bitmap()).set(ordinal)
+        for tenant in cancelled:
+            self._cancelled[tenant].set(ordinal)
+
+    def _build(self) -> None:
+        rows = get_audience_rows()
+        if rows is None:
+            raise RuntimeError("Účasti pro segmenty se nepodařilo načíst.")
+        self._reset()
+        for user_id, user_rows in groupby(rows, key=lambda row: row["user_id"]):
+            self._apply_user(user_id, list(user_rows))
+        self._watermark = max((row["participation_timestamp"] for row in rows), default=0)
+        self._built = True
+        self.stats["builds"] += 1
+
+    def _refresh(self) -> None:
+        # Volá se pod zámkem
+        if not self._built:
+            self._build()
+            return
+        changed = get_changed_participants(self._watermark - WATERMARK_SLACK)
+        if changed is None:
+            raise RuntimeError("Změny účastí se nepodařilo načíst.")
+        if not changed:
+            return
+        if len(changed) > REBUILD_FRACTION * len(self._user_ids) + 100:
+            self._build()
+            return
+        user_ids = [row["user_id"] for row in changed]
+        rows = get_audience_rows(user_ids)
+        if rows is None:
+            raise RuntimeError("Účasti pro segmenty se nepodařilo načíst.")
+        by_user = {user_id: list(user_rows) for user_id, user_rows in groupby(rows, key=lambda row: row["user_id"])}
+        for user_id in user_ids:
+            self._apply_user(user_id, by_user.get(user_id, []))
+        self._watermark = max(self._watermark, max(row["changed"] for row in changed))
+        self.stats["refreshes"] += 1
+        self.stats["refreshed_users"] += len(user_ids)
+
+    # --- Dotazy ---
+    def _union(self, call_ids) -> int:
+        result = 0
+        for call_id in call_ids:
+            bitmap = self._calls.get(call_id)
+            if bitmap is not None:
+                result |= bitmap.as_int()
+        return result
+
+    def _tenant_calls(self, tenant: str, match=lambda info: True) -> list[int]:
+        return [call_id for call_id, info in self._call_info.items() if info[0] == tenant and match(info)]
+
+    def _segment(self, kind: str, value, tenant: str, now: float) -> int:
+        if kind == "vyzva":
+            return self._union([value]) if self._call_info.get(value, ("",))[0] == tenant else 0
+        if kind == "cena":
+            low, high = value
+            return self._union(self._tenant_calls(tenant, lambda info: low <= info[2] <= high))
+        if kind == "nazev":
+            return self._union(self._tenant_calls(tenant, lambda info: value in info[1]))
+        if kind == "aktivni":
+            first_day = int(now - value * DAY) // DAY
+            result = 0
+            for day, bitmap in self._collected_days.get(tenant, {}).items():
+                if day >= first_day:
+                    result |= bitmap.as_int()
+            return result
+        everyone = self._union(self._tenant_calls(tenant))
+        if kind == "bez_zruseni":
+            cancelled = self._cancelled.get(tenant)
+            return everyone & ~cancelled.as_int() if cancelled is not None else everyone
+        return everyone
+
+    def _evaluate(self, terms: list, tenant: str) -> int:
+        # Volá se pod zámkem
+        self._refresh()
+        now = time.time()
+        result = None
+        for kind, value in terms:
+            segment = self._segment(kind, value, tenant, now)
+            result = segment if result is None else result & segment
+            if not result:
+                break
+        return result
+
+    def count(self, expression: str, tenant: str) -> int:
+        """Počet uživatelů v průniku segmentů výrazu."""
+        terms = parse_expression(expression)
+        with self._lock:
+            return self._evaluate(terms, tenant).bit_count()
+
+    def recipients(self, expression: str, tenant: str) -> list[int]:
+        """telegram_id uživatelů v průniku segmentů výrazu."""
+        terms = parse_expression(expression)
+        with self._lock:
+            bits = self._evaluate(terms, tenant)
+            data = bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+            return [self._user_ids[index << 3 | bit] for index, byte in enumerate(data) if byte for bit in range(8) if byte >> bit & 1]
+
+
+audience_index = AudienceIndex()
@@ -0,0 +1,158 @@
+# backup.py
+# -*- coding: utf-8 -*-
+"""Online zálohy databáze bez zastavení bota.
+
+Záloha používá SQLite online backup API po malých dávkách stránek
+s pauzou mezi nimi - zápisy bota se tak mezi kroky dostanou k zámku
+a nejsou blokovány po celou dobu zálohy. Hotová kopie se ověří přes
+PRAGMA integrity_check, zkomprimuje (gzip) a staré zálohy se rotují.
+
+Použití z příkazové řádky:
+    python backup.py                 # vytvoří zálohu
+    python backup.py verify <soubor> # ověří zálohu
+    python backup.py restore <soubor># obnoví DB ze zálohy (bot musí stát)
+"""
+import asyncio
+import datetime
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+
+import database
+
+logger = logging.getLogger(__name__)
+
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BACKUP_DIR = os.path.join(_BASE_DIR, "backups")
+BACKUP_PREFIX = "database-"
+BACKUP_SUFFIX = ".sqlite3.gz"
+
+
+def _integrity_ok(path: str) -> bool:
+    conn = sqlite3.connect(path)
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        if result != "ok":
+            logger.error(f"Integrity check {path} selhal: {result}")
+        return result == "ok"
+    finally:
+        conn.close()
+
+
+def _rotate(backup_dir: str, keep: int) -> list[str]:
+    """Smaže nejstarší zálohy nad limit `keep`, vrátí smazané soubory."""
+    backups = sorted(
+        name for name in os.listdir(backup_dir)
+        if name.startswith(BACKUP_PREFIX) and name.endswith(BACKUP_SUFFIX)
+    )
+    removed = []
+    for name in backups[:-keep] if keep > 0 else []:
+        os.remove(os.path.join(backup_dir, name))
+        removed.append(name)
+    return removed
+
+
+def create_backup(backup_dir: str = DEFAULT_BACKUP_DIR, keep: int = 7, pages: int = 64, sleep: float = 0.005, source: str | None = None) -> str | None:
+    """Vytvoří ověřenou a zkomprimovanou zálohu; vrací cestu k souboru, nebo None při chybě."""
+    source = source or database.DATABASE_FILE
+    os.makedirs(backup_dir, exist_ok=True)
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    raw_path = os.path.join(backup_dir, f"{BACKUP_PREFIX}{stamp}.sqlite3.tmp")
+    final_path = os.path.join(backup_dir, f"{BACKUP_PREFIX}{stamp}{BACKUP_SUFFIX}")
+    src = dst = None
+    try:
+        src = sqlite3.connect(source)
+        dst = sqlite3.connect(raw_path)
+        # pages = velikost kroku, sleep = pauza mezi kroky (uvolní zámek pro zápisy bota)
+        src.backup(dst, pages=pages, sleep=sleep)
+        dst.close(); dst = None
+        src.close(); src = None
+
+        if not _integrity_ok(raw_path):
+            os.remove(raw_path)
+            return None
+        with open(raw_path, "rb") as f_in, gzip.open(final_path, "wb", compresslevel=6) as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.remove(raw_path)
+
+        removed = _rotate(backup_dir, keep)
+        logger.info(f"Záloha vytvořena: {final_path} ({os.path.getsize(final_path)} B), smazáno starých: {len(removed)}.")
+        return final_path
+    except (sqlite3.Error, OSError) as e:
+        logger.error(f"Chyba při zálohování databáze: {e}")
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+        return None
+    finally:
+        if dst:
+            dst.close()
+        if src:
+            src.close()
+
+
+async def run_backup(**kwargs) -> str | None:
+    """Spustí zálohu ve vlákně, aby neblokovala event loop bota."""
+    return await asyncio.to_thread(create_backup, **kwargs)
+
+
+def _decompress(backup_path: str, target_path: str) -> None:
+    with gzip.open(backup_path, "rb") as f_in, open(target_path, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+
+
+def verify_backup(backup_path: str) -> bool:
+    """Rozbalí zálohu do dočasného souboru a ověří její integritu."""
+    tmp_path = backup_path + ".verify"
+    try:
+        _decompress(backup_path, tmp_path)
+        return _integrity_ok(tmp_path)
+    except (sqlite3.Error, OSError) as e:
+        logger.error(f"Zálohu {backup_path} nelze ověřit: {e}")
+        return False
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def restore_backup(backup_path: str, target: str | None = None) -> bool:
+    """Obnoví databázi ze zálohy po úspěšném integrity checku.
+
+    Stávající databáze se přejmenuje na `<soubor>.before-restore`. Bot při
+    obnově nesmí běžet.
+    """
+    target = target or database.DATABASE_FILE
+    tmp_path = target + ".restore"
+    try:
+        _decompress(backup_path, tmp_path)
+        if not _integrity_ok(tmp_path):
+            logger.error(f"Obnova zrušena, záloha {backup_path} není v pořádku.")
+            os.remove(tmp_path)
+            return False
+        if os.path.exists(target):
+            os.replace(target, target + ".before-restore")
+        os.replace(tmp_path, target)  # Atomická záměna souboru
+        logger.info(f"Databáze {target} obnovena ze zálohy {backup_path}.")
+        return True
+    except (sqlite3.Error, OSError) as e:
+        logger.error(f"Chyba při obnově ze zálohy {backup_path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    command = sys.argv[1] if len(sys.argv) > 1 else "backup"
+    if command == "backup":
+        sys.exit(0 if create_backup() else 1)
+    elif command in ("verify", "restore") and len(sys.argv) > 2:
+        action = verify_backup if command == "verify" else restore_backup
+        ok = action(sys.argv[2])
+        logging.info(f"{command}: {'OK' if ok else 'CHYBA'}")
+        sys.exit(0 if ok else 1)
+    else:
+        logging.error("Použití: python backup.py [backup | verify <soubor> | restore <soubor>]")
+        sys.exit(2)
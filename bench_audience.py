@@ -0,0 +1,137 @@
+# bench_audience.py
+# -*- coding: utf-8 -*-
+"""Benchmark segmentů cílových skupin: bitmapový index (audience.py) proti SQL.
+
+Vygeneruje syntetickou DB (uživatelé, výzvy, účasti s různými stavy a časy),
+změří postavení indexu, dotazy nad ním proti ekvivalentním JOINům přes
+participations a calls (počty se musí shodovat) a přírůstkovou obnovu po
+změně části účastí.
+
+Použití: python bench_audience.py [--users 100000] [--calls 200] [--per-user 4] [--changed 500]
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import database
+from audience import AudienceIndex, DAY
+
+CODES = {name: database.status_code("participation", name) for name in ("interested", "data_collected", "confirmed", "cancelled")}
+NOT_CANCELLED = f"p.status != {CODES['cancelled']}"
+COLLECTED = f"p.status IN ({CODES['data_collected']}, {CODES['confirmed']})"
+
+
+def joined(where: str) -> str:
+    return f"SELECT p.user_id FROM participations p JOIN calls c ON p.call_id = c.call_id WHERE c.tenant = 'default' AND {NOT_CANCELLED} AND {where}"
+
+
+def active_since(first_day: int) -> str:
+    return (f"SELECT p.user_id FROM participations p JOIN calls c ON p.call_id = c.call_id WHERE c.tenant = 'default' AND {COLLECTED} "
+            f"GROUP BY p.user_id HAVING MAX(p.participation_timestamp) >= {first_day * DAY}")
+
+
+def cases(now: float) -> list[tuple[str, str]]:
+    """(výraz segmentu, ekvivalentní SQL počítající stejné uživatele)."""
+    first_day = int(now - 30 * DAY) // DAY
+    by_name = joined("c.name LIKE '%káva%'")
+    cancelled = f"SELECT p.user_id FROM participations p JOIN calls c ON p.call_id = c.call_id WHERE c.tenant = 'default' AND p.status = {CODES['cancelled']}"
+    return [
+        ("vyzva:7", f"SELECT COUNT(*) FROM ({joined('p.call_id = 7')})"),
+        ("cena:100-500", f"SELECT COUNT(DISTINCT user_id) FROM ({joined('c.deal_price BETWEEN 100 AND 500')})"),
+        ("nazev:káva bez_zruseni",
+         f"SELECT COUNT(DISTINCT user_id) FROM ({by_name}) WHERE user_id NOT IN ({cancelled})"),
+        ("aktivni:30", f"SELECT COUNT(*) FROM ({active_since(first_day)})"),
+        ("cena:100-500 aktivni:30 bez_zruseni",
+         f"SELECT COUNT(DISTINCT user_id) FROM ({joined('c.deal_price BETWEEN 100 AND 500')}) "
+         f"WHERE user_id IN ({active_since(first_day)}) AND user_id NOT IN ({cancelled})"),
+    ]
+
+
+def build_db(args) -> None:
+    random.seed(args.seed)
+    database.init_db()
+    now = int(time.time())
+    conn = sqlite3.connect(database.DATABASE_FILE)
+    granted = database.status_code("consent", "granted")
+    conn.executemany("INSERT INTO users (telegram_id, first_name, consent_status) VALUES (?, ?, ?)",
+                     ((100000 + i, f"U{i}", granted) for i in range(args.users)))
+    goods = ("káva", "čaj", "med", "olej", "sýr")
+    conn.executemany("INSERT INTO calls (call_id, name, deal_price, tenant) VALUES (?, ?, ?, 'default')",
+                     ((call_id, f"{goods[call_id % len(goods)].capitalize()} {call_id}", random.randint(50, 2000)) for call_id in range(1, args.calls + 1)))
+    statuses = [CODES["interested"]] * 3 + [CODES["data_collected"]] * 4 + [CODES["confirmed"]] * 2 + [CODES["cancelled"]]
+    conn.executemany(
+        "INSERT INTO participations (user_id, call_id, status, participation_timestamp) VALUES (?, ?, ?, ?)",
+        ((100000 + user, call_id, random.choice(statuses), now - random.randint(0, 180 * DAY))
+         for user in range(args.users) for call_id in random.sample(range(1, args.calls + 1), random.randint(1, 2 * args.per_user - 1))),
+    )
+    conn.commit()
+    conn.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Segmenty cílových skupin: bitmapový index vs. SQL.")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--per-user", type=int, default=4, help="Průměr účastí na uživatele")
+    parser.add_argument("--changed", type=int, default=500, help="Změněných účastí před přírůstkovou obnovou")
+    parser.add_argument("--repeat", type=int, default=5, help="Opakování každého dotazu")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-audience-")
+    try:
+        database.DATABASE_FILE = os.path.join(workdir, "bench.sqlite3")
+        database.ARCHIVE_DATABASE_FILE = os.path.join(workdir, "archive.sqlite3")
+        build_db(args)
+        conn = sqlite3.connect(database.DATABASE_FILE)
+        participations = conn.execute("SELECT COUNT(*) FROM participations").fetchone()[0]
+        print(f"Dataset: {args.users} uživatelů, {args.calls} výzev, {participations} účastí")
+
+        index = AudienceIndex()
+        start = time.perf_counter()
+        index.count("vsichni", "default")
+        print(f"Postavení indexu: {time.perf_counter() - start:.2f} s")
+
+        print(f"\n{'segment':<38}{'uživatelů':>10}{'index ms':>10}{'SQL ms':>10}")
+        mismatches = 0
+        for expression, sql in cases(time.time()):
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                count = index.count(expression, "default")
+            index_ms = (time.perf_counter() - start) / args.repeat * 1000
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                expected = conn.execute(sql).fetchone()[0]
+            sql_ms = (time.perf_counter() - start) / args.repeat * 1000
+            mark = "" if count == expected else f"  NESHODA (SQL {expected})"
+            mismatches += count != expected
+            print(f"{expression:<38}{count:>10}{index_ms:>10.2f}{sql_ms:>10.1f}{mark}")
+
+        start = time.perf_counter()
+        recipients = index.recipients("cena:100-500 aktivni:30 bez_zruseni", "default")
+        print(f"\nSeznam příjemců ({len(recipients)}): {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        # Přírůstková obnova: změní se část účastí (posune se participation_timestamp jako při zápisu bota)
+        rows = conn.execute("SELECT user_id, call_id FROM participations ORDER BY RANDOM() LIMIT ?", (args.changed,)).fetchall()
+        conn.executemany(f"UPDATE participations SET status = {CODES['cancelled']}, participation_timestamp = {database._NOW} WHERE user_id = ? AND call_id = ?", rows)
+        conn.commit()
+        start = time.perf_counter()
+        index.count("vsichni", "default")
+        print(f"Přírůstková obnova po {len(rows)} změnách: {(time.perf_counter() - start) * 1000:.1f} ms (stats {index.stats})")
+        for expression, sql in cases(time.time()):
+            if index.count(expression, "default") != conn.execute(sql).fetchone()[0]:
+                print(f"NESHODA po obnově: {expression}")
+                mismatches += 1
+        conn.close()
+        if mismatches:
+            raise SystemExit(1)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
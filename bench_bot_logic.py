@@ -0,0 +1,86 @@
+# bench_bot_logic.py
+# -*- coding: utf-8 -*-
+"""Benchmark jádra bot_logic bez Telegramu a bez databáze.
+
+Prožene celý tok (katalog → výběr výzvy → sběr údajů → dokončení, /cancel,
+průvodce /addcall) čistě v paměti a vypíše počet operací za sekundu.
+
+Použití: python bench_bot_logic.py [počet iterací]
+"""
+import sys
+import time
+
+import bot_logic
+
+CALLS = [
+    {"call_id": i, "name": f"Výzva {i}", "description": "Popis výzvy", "original_price": 450.0, "deal_price": 310.0,
+     "status": "active", "capacity": None, "data_needed": "adresa doručení, telefonní číslo, počet kusů, email",
+     "final_instructions": "Děkujeme, {user_first_name}! Výzva {call_name}, cena {deal_price} Kč, kusů: {počet kusů}."}
+    for i in range(1, 11)
+]
+ANSWERS = {
+    "adresa doručení": "Dlouhá 12, 110 00 Praha",
+    "telefonní číslo": "+420 123 456 789",
+    "počet kusů": "2",
+    "email": "jan@example.cz",
+}
+WIZARD_INPUTS = ["Nová výzva", "Popis", "450", "310", "100", "email", "Díky {user_first_name}!"]
+
+
+def apply(user_data: dict, result: dict) -> None:
+    """Stejná sémantika jako bot.apply_user_data, jen nad obyčejným slovníkem."""
+    for key in result.get('clear_keys', []):
+        user_data.pop(key, None)
+    if result.get('clear_conversation'):
+        for key in bot_logic.conversation_keys_to_clear(user_data):
+            user_data.pop(key, None)
+    user_data.update(result.get('user_data_updates', {}))
+
+
+def run_checkout(user_id: int) -> int:
+    """Jeden kompletní nákup; vrací počet provedených operací jádra."""
+    ops = 0
+    user_data = {}
+    bot_logic.format_calls_list_message(CALLS); bot_logic.build_calls_buttons(CALLS); ops += 2
+    call = CALLS[user_id % len(CALLS)]
+    result = bot_logic.process_call_selection(call, None, user_id, "Jan"); ops += 1
+    apply(user_data, result)
+    while True:
+        step = bot_logic.next_data_step(user_data); ops += 1
+        if step['status'] == 'complete':
+            bot_logic.complete_data_collection(call, user_id, "Jan", step['collected_data']); ops += 1
+            apply(user_data, {'clear_conversation': True})
+            return ops
+        apply(user_data, step)
+        if user_id % 4 == 0:
+            # Část uživatelů se napoprvé splete
+            bot_logic.process_data_input(user_data, "x"); ops += 1
+        apply(user_data, bot_logic.process_data_input(user_data, ANSWERS[step['user_data_updates']['current_data_key']])); ops += 1
+
+
+def run_wizard() -> int:
+    ops = 0
+    user_data = {}
+    apply(user_data, bot_logic.start_add_call(True)); ops += 1
+    for text in WIZARD_INPUTS:
+        apply(user_data, bot_logic.process_add_call_input(user_data[bot_logic.WIZARD_STATE_KEY], user_data['new_call_data'], text)); ops += 1
+    bot_logic.process_add_call_confirm(bot_logic.CONFIRM_SAVE_CALL, user_data['new_call_data']); ops += 1
+    return ops
+
+
+def main(iterations: int) -> None:
+    ops = 0
+    start = time.perf_counter()
+    for i in range(iterations):
+        ops += run_checkout(i)
+        user_data = {'current_call_id': 1, 'data_needed_list': ['email'], 'data_needed_index': 0}
+        bot_logic.process_cancel_conversation(user_data); bot_logic.process_cancel_selection(f"cancel_{i}"); ops += 2
+        if i % 10 == 0:
+            ops += run_wizard()
+    elapsed = time.perf_counter() - start
+    print(f"Iterací: {iterations}, operací: {ops}, čas: {elapsed:.3f} s")
+    print(f"Propustnost: {ops / elapsed:,.0f} ops/s, {iterations / elapsed:,.0f} nákupů/s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,226 @@
+# bench_storage.py
+# -*- coding: utf-8 -*-
+"""Benchmark úložiště: staré textové schéma proti kompaktnímu (verze 1).
+
+Vygeneruje syntetickou DB ve starém schématu (stavy a časy jako text),
+zkopíruje ji a převede přes database.init_db(). Porovná velikost souboru,
+tabulek a indexů (dbstat) a časy horkých dotazů nad oběma verzemi.
+
+Použití: python bench_storage.py [--users 20000] [--calls 300] [--per-user 5] [--queries 20000]
+"""
+import argparse
+import datetime
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import database
+
+# Schéma verze 0 (před kompaktním kódováním), jen pro vytvoření výchozí DB
+LEGACY_SCHEMA = """
+CREATE TABLE users (
+    telegram_id INTEGER PRIMARY KEY, first_name TEXT, last_name TEXT, username TEXT,
+    consent_status TEXT DEFAULT 'pending', state TEXT DEFAULT 'start',
+    joined_timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE calls (
+    call_id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, description TEXT, original_price REAL,
+    deal_price REAL NOT NULL, status TEXT DEFAULT 'active', data_needed TEXT, image_url TEXT,
+    start_at DATETIME, end_at DATETIME, final_instructions TEXT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    closed_at DATETIME, tenant TEXT NOT NULL DEFAULT 'default'
+);
+CREATE INDEX idx_calls_tenant_status ON calls (tenant, status);
+CREATE TABLE participations (
+    participation_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, call_id INTEGER NOT NULL,
+    status TEXT DEFAULT 'interested', collected_data TEXT, participation_timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users (telegram_id) ON DELETE CASCADE,
+    FOREIGN KEY (call_id) REFERENCES calls (call_id) ON DELETE CASCADE,
+    UNIQUE(user_id, call_id)
+);
+CREATE TABLE notification_outbox (
+    notification_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, call_id INTEGER,
+    kind TEXT NOT NULL, text TEXT NOT NULL, status TEXT DEFAULT 'pending', attempts INTEGER DEFAULT 0,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP, sent_at DATETIME, tenant TEXT NOT NULL DEFAULT 'default',
+    UNIQUE(user_id, call_id, kind)
+);
+CREATE INDEX idx_outbox_status ON notification_outbox (status, notification_id);
+CREATE INDEX idx_outbox_tenant_status ON notification_outbox (tenant, status, notification_id);
+CREATE TABLE bot_state (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE processed_updates (
+    tenant TEXT NOT NULL DEFAULT 'default', update_id INTEGER NOT NULL,
+    processed_at DATETIME DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (tenant, update_id)
+);
+"""
+
+# Horké dotazy: (název, staré SQL, kompaktní SQL, generátor parametrů)
+ACTIVE_PARTICIPATIONS = ", ".join(str(database.status_code("participation", name)) for name in ("interested", "data_collected", "confirmed"))
+DATA_COLLECTED = database.status_code("participation", "data_collected")
+PENDING = database.status_code("outbox", "pending")
+QUERIES = [
+    ("aktivní účasti uživatele",
+     "SELECT p.call_id, p.status, c.name FROM participations p JOIN calls c ON p.call_id = c.call_id "
+     "WHERE p.user_id = ? AND c.tenant = 'default' AND p.status IN ('interested', 'data_collected', 'confirmed') "
+     "ORDER BY p.participation_timestamp DESC",
+     "SELECT p.call_id, p.status, c.name FROM participations p JOIN calls c ON p.call_id = c.call_id "
+     f"WHERE p.user_id = ? AND c.tenant = 'default' AND p.status IN ({ACTIVE_PARTICIPATIONS}) "
+     "ORDER BY p.participation_timestamp DESC",
+     lambda args: (random.randint(1, args.users),)),
+    ("účast (user, výzva)",
+     "SELECT status, collected_data, participation_timestamp FROM participations WHERE user_id = ? AND call_id = ?",
+     "SELECT status, collected_data, participation_timestamp FROM participations WHERE user_id = ? AND call_id = ?",
+     lambda args: (random.randint(1, args.users), random.randint(1, args.calls))),
+    ("souhlas uživatele",
+     "SELECT consent_status FROM users WHERE telegram_id = ?",
+     "SELECT consent_status FROM users WHERE telegram_id = ?",
+     lambda args: (random.randint(1, args.users),)),
+    ("počet 'data_collected' ve výzvě",
+     "SELECT COUNT(*) FROM participations WHERE call_id = ? AND status = 'data_collected'",
+     f"SELECT COUNT(*) FROM participations WHERE call_id = ? AND status = {DATA_COLLECTED}",
+     lambda args: (random.randint(1, args.calls),)),
+    ("dávka čekajících notifikací",
+     "SELECT notification_id, user_id, text FROM notification_outbox WHERE status = 'pending' AND tenant = 'default' "
+     "ORDER BY notification_id LIMIT 100",
+     f"SELECT notification_id, user_id, text FROM notification_outbox WHERE status = {PENDING} AND tenant = 'default' "
+     "ORDER BY notification_id LIMIT 100",
+     lambda args: ()),
+]
+
+
+def timestamp(rng: random.Random, days: int = 365) -> str:
+    moment = datetime.datetime(2025, 1, 1) + datetime.timedelta(seconds=rng.randrange(days * 86400))
+    return moment.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def build_legacy_db(path: str, args) -> None:
+    """Syntetická DB ve starém schématu (deterministická podle --seed)."""
+    rng = random.Random(args.seed)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.executescript(LEGACY_SCHEMA)
+    conn.executemany(
+        "INSERT INTO users VALUES (?, ?, ?, ?, ?, 'start', ?)",
+        ((user_id, f"Jméno{user_id}", "Příjmení", f"user{user_id}",
+          rng.choice(("pending", "granted", "granted", "granted", "denied")), timestamp(rng))
+         for user_id in range(1, args.users + 1)),
+    )
+    conn.executemany(
+        "INSERT INTO calls (call_id, name, description, original_price, deal_price, status, data_needed, "
+        "final_instructions, created_at, closed_at) VALUES (?, ?, 'Popis výzvy', 450.0, 310.0, ?, 'adresa, telefon', "
+        "'Díky {user_first_name}!', ?, ?)",
+        ((call_id, f"Výzva {call_id}", status, timestamp(rng), timestamp(rng) if status == "closed" else None)
+         for call_id in range(1, args.calls + 1)
+         for status in [rng.choice(("active", "active", "closed"))]),
+    )
+    participations = (
+        (user_id, call_id, status,
+         '{"adresa": "Dlouhá 12, Praha", "telefon": "+420 123 456 789"}' if status != "interested" else None,
+         timestamp(rng))
+        for user_id in range(1, args.users + 1)
+        for call_id in rng.sample(range(1, args.calls + 1), min(args.per_user, args.calls))
+        for status in [rng.choice(("interested", "data_collected", "data_collected", "confirmed", "cancelled"))]
+    )
+    conn.executemany(
+        "INSERT INTO participations (user_id, call_id, status, collected_data, participation_timestamp) VALUES (?, ?, ?, ?, ?)",
+        participations,
+    )
+    conn.executemany(
+        "INSERT INTO notification_outbox (user_id, call_id, kind, text, status, created_at, sent_at) "
+        "VALUES (?, ?, 'confirmed', 'Díky za nákup, instrukce...', ?, ?, ?)",
+        ((user_id, call_id, status, created, created if status == "sent" else None)
+         for user_id, call_id in conn.execute(
+             "SELECT user_id, call_id FROM participations WHERE status = 'confirmed'").fetchall()
+         for status in [rng.choice(("sent", "sent", "sent", "pending", "failed"))]
+         for created in [timestamp(rng)]),
+    )
+    conn.executemany(
+        "INSERT INTO processed_updates (update_id, processed_at) VALUES (?, ?)",
+        ((update_id, timestamp(rng, 1)) for update_id in range(1, args.updates + 1)),
+    )
+    conn.execute("INSERT INTO bot_state VALUES ('last_update_id', ?)", (str(args.updates),))
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+
+
+def object_sizes(path: str) -> dict[str, int]:
+    """Bajty stránek podle tabulky/indexu (autoindexy pojmenované podle tabulky)."""
+    conn = sqlite3.connect(path)
+    rows = conn.execute(
+        "SELECT s.name, m.tbl_name, SUM(s.pgsize) FROM dbstat s LEFT JOIN sqlite_master m ON m.name = s.name GROUP BY s.name"
+    ).fetchall()
+    conn.close()
+    sizes = {}
+    for name, table, size in rows:
+        if name.startswith("sqlite_autoindex_"):
+            name = f"{table} (autoindex)"
+        sizes[name] = size
+    return sizes
+
+
+def time_queries(path: str, legacy: bool, args) -> dict[str, float]:
+    """Průměrný čas dotazu v µs (jedno spojení); každý dotaz nejvýše --queries opakování / --seconds."""
+    conn = sqlite3.connect(path)
+    conn.execute(f"PRAGMA cache_size = -{args.cache_kb}")
+    results = {}
+    for name, legacy_sql, compact_sql, params in QUERIES:
+        sql = legacy_sql if legacy else compact_sql
+        random.seed(args.seed)
+        batch = [params(args) for _ in range(args.queries)]
+        start = time.perf_counter()
+        deadline = start + args.seconds
+        for done, values in enumerate(batch, 1):
+            conn.execute(sql, values).fetchall()
+            if time.perf_counter() > deadline:
+                break
+        results[name] = (time.perf_counter() - start) / done * 1e6
+    conn.close()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Velikost a rychlost DB: textové vs. kompaktní schéma.")
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--calls", type=int, default=300)
+    parser.add_argument("--per-user", type=int, default=5, help="Účastí na uživatele")
+    parser.add_argument("--updates", type=int, default=10000, help="Řádků v processed_updates")
+    parser.add_argument("--queries", type=int, default=20000, help="Opakování každého dotazu")
+    parser.add_argument("--seconds", type=float, default=3.0, help="Časový limit na jeden dotaz")
+    parser.add_argument("--cache-kb", type=int, default=2000, help="PRAGMA cache_size v KiB (2000 = výchozí SQLite)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-storage-")
+    try:
+        legacy_path = os.path.join(workdir, "legacy.sqlite3")
+        compact_path = os.path.join(workdir, "compact.sqlite3")
+        build_legacy_db(legacy_path, args)
+        shutil.copyfile(legacy_path, compact_path)
+        database.DATABASE_FILE = compact_path
+        start = time.perf_counter()
+        database.init_db()
+        migration = time.perf_counter() - start
+
+        legacy_size, compact_size = os.path.getsize(legacy_path), os.path.getsize(compact_path)
+        print(f"Dataset: {args.users} uživatelů, {args.calls} výzev, ~{args.users * args.per_user} účastí; migrace {migration:.2f} s")
+        print(f"Soubor DB: {legacy_size / 1024:.0f} KiB -> {compact_size / 1024:.0f} KiB ({compact_size / legacy_size:.0%})")
+
+        before, after = object_sizes(legacy_path), object_sizes(compact_path)
+        print(f"\n{'tabulka / index':<44}{'před KiB':>10}{'po KiB':>10}")
+        for name in sorted(set(before) | set(after)):
+            if name in ("sqlite_schema", "sqlite_sequence", "sqlite_master"):
+                continue
+            print(f"{name:<44}{before.get(name, 0) / 1024:>10.0f}{after.get(name, 0) / 1024:>10.0f}")
+
+        legacy_times, compact_times = time_queries(legacy_path, True, args), time_queries(compact_path, False, args)
+        print(f"\n{'dotaz':<36}{'před µs':>10}{'po µs':>10}")
+        for name, *_ in QUERIES:
+            print(f"{name:<36}{legacy_times[name]:>10.1f}{compact_times[name]:>10.1f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
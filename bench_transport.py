@@ -0,0 +1,92 @@
+# bench_transport.py
+# -*- coding: utf-8 -*-
+"""Benchmark odesílání zpráv při různém nastavení HTTP poolu (transport.py).
+
+Proti lokálnímu FakeBotApi (s umělou latencí jako RTT k api.telegram.org)
+pošle nárazově N zpráv najednou a pro každé nastavení vypíše zprávy/s,
+latenci odeslání, počet selhání (např. Pool timeout) a kolik TCP spojení
+se otevřelo (bez keep-alive roste s každým požadavkem).
+
+Použití: python bench_transport.py [--messages 2000] [--latency 30] [--pools 8,32,64,256]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+from collections import Counter
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:bench")  # Token jde jen na lokální FakeBotApi
+
+from telegram import Bot
+from telegram.error import TelegramError
+from telegram.request import HTTPXRequest
+
+import transport
+from fake_bot_api import FakeBotApi
+from replay import percentiles
+
+TOKEN = "123456:bench"
+
+
+def scenarios(pools: list[int]) -> list[tuple[str, object, int | None]]:
+    """(popis, funkce vracející request, limit souběžných odeslání) pro každé měřené nastavení."""
+    result = [("PTB výchozí (256, pool_timeout 1 s)", lambda: HTTPXRequest(connection_pool_size=256), None)]
+    for pool_size in pools:
+        result.append((f"pool {pool_size}", lambda size=pool_size: transport.send_request(pool_size=size, keepalive=size), None))
+    pool_size = max(pools)
+    result.append((f"pool {pool_size}, bez keep-alive", lambda: transport.send_request(pool_size=pool_size, keepalive=0), None))
+    for pool_size in pools:
+        if pool_size > 1:
+            result.append((f"pool {pool_size}, max {pool_size} odesílání najednou", lambda size=pool_size: transport.send_request(pool_size=size, keepalive=size), pool_size))
+    result.append(("konfigurace (HTTP_*)", transport.send_request, None))
+    return result
+
+
+async def measure(api: FakeBotApi, make_request, messages: int, in_flight: int | None = None) -> dict:
+    bot = Bot(TOKEN, base_url=api.base_url, request=make_request())
+    await bot.initialize()
+    connections_before = api.connections
+    latencies, failures = [], Counter()
+    semaphore = asyncio.Semaphore(in_flight or messages)
+
+    async def send(index: int) -> None:
+        async with semaphore:
+            begin = time.perf_counter()
+            try:
+                await bot.send_message(chat_id=1000 + index % 500, text=f"Zpráva {index}")
+                latencies.append((time.perf_counter() - begin) * 1000)
+            except TelegramError as e:
+                failures[type(e).__name__] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(send(index) for index in range(messages)))
+    elapsed = time.perf_counter() - started
+    await bot.shutdown()
+    return {"sends_per_s": round(len(latencies) / elapsed, 1), "latency_ms": percentiles(latencies),
+            "failed": sum(failures.values()), "errors": dict(failures), "connections": api.connections - connections_before}
+
+
+async def run(messages: int, latency_ms: float, pools: list[int]) -> None:
+    async with FakeBotApi(latency=latency_ms / 1000) as api:
+        print(f"{messages} zpráv najednou, latence API {latency_ms:g} ms, HTTP {transport.resolve_http_version(transport.HTTP_VERSION)}")
+        print(f"{'nastavení':40s} {'zpráv/s':>9s} {'p50 ms':>8s} {'p99 ms':>8s} {'selhalo':>8s} {'spojení':>8s}")
+        for label, make_request, in_flight in scenarios(pools):
+            result = await measure(api, make_request, messages, in_flight)
+            stats = result["latency_ms"]
+            print(f"{label:40s} {result['sends_per_s']:>9} {stats.get('p50', '-'):>8} {stats.get('p99', '-'):>8} "
+                  f"{result['failed']:>8} {result['connections']:>8}  {result['errors'] or ''}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark HTTP poolu pro odesílání zpráv proti FakeBotApi.")
+    parser.add_argument("--messages", type=int, default=2000, help="Kolik zpráv poslat najednou")
+    parser.add_argument("--latency", type=float, default=30.0, help="Umělá latence API v ms (RTT)")
+    parser.add_argument("--pools", default="8,32,64,256", help="Velikosti poolu k porovnání (čárkou oddělené)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(run(args.messages, args.latency, [int(size) for size in args.pools.split(",")]))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,209 +1,444 @@
 # bot.py
 # -*- coding: utf-8 -*-
+import time
+STARTED_AT = time.perf_counter()  # Začátek měření startu (včetně importů), viz startup.py
+import asyncio
+import datetime
 import logging
-import json
-import re
-import sqlite3 # Potřebujeme pro isinstance check v bot_logic
+import signal
+from collections import ChainMap
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, filters, ContextTypes,
     CallbackQueryHandler, ConversationHandler
 )
 from telegram.constants import ParseMode
+from telegram.error import TelegramError
 
 # --- Importy ---
-from config import TELEGRAM_TOKEN, ADMIN_IDS
+from config import (
+    BOT_CONFIGS, ARCHIVE_RETENTION_DAYS, NOTIFY_RATE_PER_SECOND,
+    SESSION_TTL_SECONDS, SESSION_EXPIRY_NOTICE,
+    BACKUP_DIR, BACKUP_KEEP, BACKUP_INTERVAL_HOURS,
+    WORKER_POOL_SIZE, WORKER_POOL_MAX_PENDING, WORKER_PROCESSES,
+    TRAFFIC_RECORD_FILE, TRAFFIC_RECORD_SALT, PREWARM_HTTP_CONNECTIONS,
+    DRAIN_TIMEOUT, HANDOFF_LEASE_SECONDS, DIGEST_HOUR, DIGEST_WEEKDAY, DIGEST_PAGE_SIZE
+)
 from database import (
-    init_db, get_db_connection, get_active_calls, get_call_details,
-    update_user_consent, add_or_update_user, add_or_update_participation,
+    DEFAULT_TENANT, init_db, get_active_calls, get_call_details,
+    update_user_consent, get_user_consent, add_or_update_user, add_or_update_participation,
     get_participation, get_user_active_participations, add_new_call,
-    get_all_calls # <-- Přidán nový import
+    get_all_calls, close_call, archive_closed_calls, confirm_call_participations,
+    save_checkout_sessions, take_checkout_sessions,
+    set_digest_subscription, get_digest_subscription, get_digest_calls, count_digest_subscriptions,
+    enqueue_announcements, reserve_participation, release_reservations, get_stale_reservations
+)
+from notifications import (
+    RateLimiter, render_confirmation_message, deliver_pending_notifications, deliver_digest, digest_markup, stop_delivery
 )
+from tenants import TENANT_KEY, Tenant, tenant_of
+from update_tracking import finishes_update
+from pipeline import WorkerPool, PoolBusy, fast_ack, BUSY_TEXT
+from templates import call_templates
+from user_cache import user_states, is_known
+from deeplinks import parse_call_payload, call_link
+from startup import StartupTimer
+from lifecycle import Handoff, StopRequested
+from audience import audience_index, SegmentError
+import transport
 import bot_logic
+# backup, profiling a traffic_recorder se importují až při použití (rychlejší start)
 
 # --- Logging ---
 logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
 logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
-# --- Stavy konverzace ---
-ASKING_DATA, PROCESSING_DATA = range(2)
-GET_CALL_NAME, GET_CALL_DESC, GET_CALL_ORIG_PRICE, GET_CALL_DEAL_PRICE, \
-GET_CALL_DATA_NEEDED, GET_CALL_FINAL_INST, CONFIRM_ADD_CALL = range(7)
+# --- Stavy konverzace (definované v jádru bot_logic) ---
+from bot_logic import (
+    ASKING_DATA, PROCESSING_DATA, GET_CALL_NAME, GET_CALL_DESC, GET_CALL_ORIG_PRICE,
+    GET_CALL_DEAL_PRICE, GET_CALL_CAPACITY, GET_CALL_DATA_NEEDED, GET_CALL_FINAL_INST, CONFIRM_ADD_CALL
+)
+
+startup_timer = StartupTimer(STARTED_AT)
+
+# Sdílený limiter pro hromadné odesílání zpráv (společný pro všechny boty v procesu)
+outbound_limiter = RateLimiter(NOTIFY_RATE_PER_SECOND)
+
+SESSION_SWEEP_INTERVAL = 60  # Jak často (s) hledat vypršelé nákupy
+
+# Blokující DB práce z callbacků běží ve vláknech s omezenou frontou (sdílené všemi boty)
+db_pool = WorkerPool(max_workers=WORKER_POOL_SIZE, max_pending=WORKER_POOL_MAX_PENDING)
+
+# Lease na polling a signál k ukončení (restart s předáním záložní instanci, viz lifecycle.py)
+handoff = Handoff(HANDOFF_LEASE_SECONDS)
+
+# Rozpracované nákupy, deduplikace updatů, flood guard a klíč deep-linků má každý bot
+# vlastní - viz tenants.Tenant, v handlerech přes tenant_of(context)
 
 # --- Administrátorský check ---
-def is_admin(user_id: int) -> bool:
-    return user_id in ADMIN_IDS
+def is_admin(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> bool:
+    return tenant_of(context).is_admin(user_id)
+
+# --- Provedení výsledků z bot_logic ---
+def apply_user_data(context: ContextTypes.DEFAULT_TYPE, result: dict) -> None:
+    """Promítne 'user_data_updates' / 'clear_keys' / 'clear_conversation' do context.user_data."""
+    user_data = context.user_data
+    for key in result.get('clear_keys', []):
+        user_data.pop(key, None)
+    if result.get('clear_conversation'):
+        for key in bot_logic.conversation_keys_to_clear(user_data):
+            user_data.pop(key, None)
+    user_data.update(result.get('user_data_updates', {}))
+
+def save_participation(user_id: int, call_id: int, result: dict) -> bool:
+    """Uloží účast podle 'save_participation' z výsledku (pokud ho obsahuje).
+
+    S 'quantity' zároveň rezervuje kusy výzvy; když nezbývají, doplní do výsledku
+    chybovou zprávu a další stav z bot_logic.process_stock_shortage a vrátí False.
+    """
+    to_save = result.get('save_participation')
+    if not to_save:
+        return True
+    if to_save.get('quantity') is None:
+        saved = add_or_update_participation(user_id=user_id, call_id=call_id, status=to_save['status'], collected_data=to_save['collected_data'])
+    else:
+        reservation = reserve_participation(user_id, call_id, to_save['status'], to_save['collected_data'], to_save['quantity'])
+        saved = bool(reservation and reservation['reserved'])
+        if reservation and not saved:
+            result.update(bot_logic.process_stock_shortage(reservation['remaining'], result.get('retry_quantity', False)))
+    user_states.invalidate_participations(user_id)
+    return saved
+
+def load_call_selection(user_id: int, call_id: int):
+    """DB část výběru výzvy (běží ve vlákně přes db_pool)."""
+    return get_call_details(call_id), get_participation(user_id, call_id)
+
+def store_user(user_id: int, first_name: str, last_name: str, username: str) -> bool:
+    """Uloží profil uživatele, jen pokud se od posledního uložení změnil."""
+    if user_states.profile_unchanged(user_id, first_name, last_name, username):
+        return True
+    if not add_or_update_user(user_id, first_name, last_name, username):
+        return False
+    user_states.set_profile(user_id, first_name, last_name, username)
+    return True
+
+def load_consent(user_id: int) -> str | None:
+    """consent_status z cache, nebo z DB."""
+    consent = user_states.get_consent(user_id)
+    if not is_known(consent):
+        consent = get_user_consent(user_id)
+        if consent is not None:
+            user_states.set_consent(user_id, consent)
+    return consent
+
+def store_consent(user_id: int, consent_status: str) -> bool:
+    """Uloží souhlas, jen pokud se liší od známého."""
+    if user_states.consent_unchanged(user_id, consent_status):
+        return True
+    if not update_user_consent(user_id, consent_status):
+        return False
+    user_states.set_consent(user_id, consent_status)
+    return True
+
+def load_active_participations(user_id: int, tenant: str) -> list:
+    """Aktivní účasti z cache, nebo z DB (a uloží je do cache)."""
+    participations = user_states.get_participations(user_id, tenant)
+    if not is_known(participations):
+        generation = user_states.generation
+        participations = get_user_active_participations(user_id, tenant)
+        user_states.set_participations(user_id, tenant, participations, generation)
+    return participations
+
+def register_user_consent(user_id: int, first_name: str, last_name: str, username: str) -> str | None:
+    """Uloží uživatele a vrátí jeho consent_status (běží ve vlákně přes db_pool)."""
+    if not store_user(user_id, first_name, last_name, username):
+        return None
+    return load_consent(user_id)
+
+def load_catalogue(tenant_name: str) -> list:
+    """Aktivní výzvy bota z cache katalogu, nebo z DB (a uloží je do cache)."""
+    calls = call_templates.catalogue(tenant_name)
+    if calls is None:
+        calls = get_active_calls(tenant_name)
+        call_templates.set_catalogue(tenant_name, calls)
+    return calls
+
+async def load_call(call_id: int):
+    """Výzva z cache šablon, nebo z DB (a uloží ji do cache); tenant kontroluje volající."""
+    cached = call_templates.get(call_id)
+    if cached is None:
+        call = await db_pool.submit(get_call_details, call_id)
+        cached = call_templates.put(call) if call else None
+    return cached
+
+def result_markup(result: dict):
+    """Odpovědní klávesnice podle výsledku z bot_logic."""
+    if result.get('reply_keyboard'):
+        keyboard = [[KeyboardButton(text) for text in row] for row in result['reply_keyboard']]
+        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
+    if result.get('remove_keyboard'):
+        return ReplyKeyboardRemove()
+    return None
 
 # --- Běžné Handlery ---
-# (Funkce start, help_command, handle_consent_response, list_calls zůstávají stejné)
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user = update.effective_user; user_id = user.id; first_name = user.first_name or "Uživateli"; username = user.username; last_name = user.last_name; logger.info(f"User {user_id} ({username or 'bez @'}) spustil /start.")
-    if not add_or_update_user(user_id, first_name, last_name, username): await update.message.reply_text("Omlouvám se, nastala interní chyba."); return ConversationHandler.END
-    welcome_message = (f"Ahoj {first_name}! Vítej v DealUpBotu.\n\n" + "Pomáhám lidem spojit se pro kolektivní nákupy ('Výzvy') a získat tak lepší ceny.\n\n" + "Než začneme, potřebuji tvůj **souhlas se zpracováním údajů** (Telegram ID, jméno) " + "a **zasíláním nabídek** ('Výzev'). Souhlasíš?")
-    reply_keyboard = [[KeyboardButton("Ano, souhlasím 👍")], [KeyboardButton("Ne, děkuji")]]; markup = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True, one_time_keyboard=True)
+    if not store_user(user_id, first_name, last_name, username): await update.message.reply_text("Omlouvám se, nastala interní chyba."); return ConversationHandler.END
+    welcome_message = bot_logic.format_welcome_message(first_name)
+    reply_keyboard = [[KeyboardButton(bot_logic.CONSENT_YES)], [KeyboardButton(bot_logic.CONSENT_NO)]]; markup = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True, one_time_keyboard=True)
     await update.message.reply_text(welcome_message, reply_markup=markup, parse_mode=ParseMode.MARKDOWN); return ConversationHandler.END
 
+async def start_deep_link(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """/start <payload> z odkazu na výzvu: souhlas a výběr výzvy v jedné výměně zpráv."""
+    user = update.effective_user; user_id = user.id; first_name = user.first_name or "Uživateli"
+    payload = context.args[0]; call_id = parse_call_payload(payload, tenant_of(context).deeplink_key)
+    if call_id is None:
+        logger.warning(f"User {user_id} přišel s neplatným deep-linkem: {payload}")
+        return await start(update, context)
+    logger.info(f"User {user_id} ({user.username or 'bez @'}) spustil /start z odkazu na výzvu {call_id}.")
+    try:
+        consent = await db_pool.submit(register_user_consent, user_id, first_name, user.last_name, user.username)
+        if consent is None: await update.message.reply_text("Omlouvám se, nastala interní chyba."); return ConversationHandler.END
+        if consent == 'granted':
+            return await begin_checkout(update, context, call_id, update.message.reply_text)
+        cached = await load_call(call_id)
+    except PoolBusy:
+        await update.message.reply_text(BUSY_TEXT); return ConversationHandler.END
+    if cached is None or cached.call['status'] != 'active' or cached.call['tenant'] != tenant_of(context).name:
+        # Výzva už neexistuje nebo skončila - běžné uvítání bez přímého vstupu
+        return await start(update, context)
+    keyboard = [[InlineKeyboardButton(text, callback_data=data)] for text, data in bot_logic.build_deep_link_buttons(payload)]
+    await update.message.reply_text(bot_logic.format_deep_link_welcome(first_name, cached.call), reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.MARKDOWN)
+    return ConversationHandler.END
+
+async def handle_deep_link_consent(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Souhlas z uvítání deep-linku: uloží souhlas a rovnou pokračuje výběrem výzvy."""
+    query = update.callback_query; user_id = update.effective_user.id
+    result = bot_logic.process_deep_link_consent(query.data)
+    call_id = parse_call_payload(result['payload'], tenant_of(context).deeplink_key) if result['payload'] else None
+    if result['consent_status'] == 'granted' and call_id is None:
+        logger.warning(f"User {user_id} poslal neplatný deep-link callback: {query.data}")
+        await query.answer(); await query.edit_message_text("Odkaz na výzvu je neplatný. Aktuální nabídku najdeš přes /vyzvy.", reply_markup=None)
+        return ConversationHandler.END
+    await fast_ack(query)
+    try:
+        if not await db_pool.submit(store_consent, user_id, result['consent_status']):
+            await query.edit_message_text("Chyba při ukládání volby.", reply_markup=None); return ConversationHandler.END
+    except PoolBusy:
+        await query.edit_message_text(BUSY_TEXT, reply_markup=None); return ConversationHandler.END
+    logger.info(f"User {user_id} odpověděl na souhlas z deep-linku: {result['consent_status']}")
+    if call_id is None:
+        await query.edit_message_text(result['message'], reply_markup=None); return ConversationHandler.END
+    return await begin_checkout(update, context, call_id, query.edit_message_text)
+
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    help_text = ("Jsem DealUpBot a pomohu ti s kolektivními nákupy ('Výzvami').\n\n" + "Základní příkazy:\n" + "/start - Úvod a udělení souhlasu.\n" + "/vyzvy - Zobrazí aktuální aktivní Výzvy.\n" + "/zrusit_ucast - Umožní zrušit tvou účast v aktivní Výzvě.\n" + "/moje_ucasti - Zobrazí tvé aktivní účasti.\n" + "/help - Zobrazí tuto nápovědu.\n" + "/cancel - Zruší aktuálně probíhající akci.\n\n" + "**Admin příkazy:**\n" + "/addcall - Spustí proces přidání nové výzvy.\n" + "/listcalls_admin - Vypíše všechny výzvy v DB.\n") # Přidán nový příkaz
+    help_text = ("Jsem DealUpBot a pomohu ti s kolektivními nákupy ('Výzvami').\n\n" + "Základní příkazy:\n" + "/start - Úvod a udělení souhlasu.\n" + "/vyzvy - Zobrazí aktuální aktivní Výzvy.\n" + "/zrusit_ucast - Umožní zrušit tvou účast v aktivní Výzvě.\n" + "/moje_ucasti - Zobrazí tvé aktivní účasti.\n" + "/souhrn - Souhrn nových Výzev denně nebo týdně.\n" + "/help - Zobrazí tuto nápovědu.\n" + "/cancel - Zruší aktuálně probíhající akci.\n\n" + "**Admin příkazy:**\n" + "/addcall - Spustí proces přidání nové výzvy.\n" + "/listcalls_admin - Vypíše všechny výzvy v DB (včetně archivu).\n" + "/closecall <ID> - Uzavře výzvu.\n" + "/archivecalls [dny] - Přesune dávno uzavřené výzvy do archivu.\n" + "/deeplink <ID> - Vytvoří podepsaný odkaz přímo do výzvy.\n" + "/audience <segmenty> - Velikost cílové skupiny (např. cena:100-500 aktivni:30 bez_zruseni).\n" + "/announce <ID> <segmenty> - Oznámí aktivní výzvu cílové skupině.\n" + "/confirmcall <ID> - Potvrdí všechny účasti s vyplněnými údaji a pošle instrukce.\n" + "/backup - Vytvoří zálohu databáze za běhu.\n" + "/stats - Provozní čítače bota.\n" + "/profile [s] - Vzorkovací profiler na N sekund (výsledek jako soubor).\n" + "/memsnap [stop] - Snapshot paměti (tracemalloc) a rozdíl proti předchozímu.\n" + "/tasks - Výpis běžících asyncio úloh.\n")
     await update.message.reply_text(help_text)
 
 async def handle_consent_response(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id; response = update.message.text; logger.info(f"User {user_id} odpověděl na souhlas: {response}")
-    new_consent_status = 'pending'; reply_text = ""; show_calls_after = False
-    if "Ano, souhlasím" in response: new_consent_status = 'granted'; reply_text = "Děkuji za souhlas! 🎉"; show_calls_after = True
-    elif "Ne, děkuji" in response: new_consent_status = 'denied'; reply_text = "Rozumím. Nebudu ti zasílat nabídky."
-    if update_user_consent(user_id, new_consent_status): await update.message.reply_text(reply_text, reply_markup=ReplyKeyboardRemove()); await list_calls(update, context) if show_calls_after else None
+    result = bot_logic.process_consent_response(response)
+    if store_consent(user_id, result['consent_status']):
+        await update.message.reply_text(result['message'], reply_markup=ReplyKeyboardRemove())
+        if result['show_calls']: await list_calls(update, context)
     else: await update.message.reply_text("Chyba při ukládání volby.", reply_markup=ReplyKeyboardRemove())
 
 async def list_calls(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id; chat_id = update.effective_chat.id; logger.info(f"User {user_id} spouští zobrazení výzev.")
-    active_calls = get_active_calls(); message_text = bot_logic.format_calls_list_message(active_calls)
-    keyboard = []; reply_markup = None
-    if active_calls:
-        for call in active_calls:
-            try: button = InlineKeyboardButton(f"Mám zájem: {call['name']} ({call['deal_price']} Kč)", callback_data=f"call_{call['call_id']}"); keyboard.append([button])
-            except Exception as e: logger.error(f"Chyba tvorby tlačítka pro list_calls: {e}")
-        if keyboard: reply_markup = InlineKeyboardMarkup(keyboard)
+    active_calls = load_catalogue(tenant_of(context).name); message_text = bot_logic.format_calls_list_message(active_calls)
+    keyboard = [[InlineKeyboardButton(text, callback_data=data)] for text, data in bot_logic.build_calls_buttons(active_calls)]
+    reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
     try: await context.bot.send_message(chat_id=chat_id, text=message_text, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
     except Exception as e: logger.warning(f"Nepodařilo se poslat list_calls s Markdown: {e}. Posílám plain text."); plain_text = message_text.replace('*','').replace('~','').replace(r'\.','.'); await context.bot.send_message(chat_id=chat_id, text=plain_text, reply_markup=reply_markup)
 
 # --- ConversationHandler pro sběr dat (ÚČAST) ---
-# (Funkce handle_call_selection, ask_next_data, process_data_input zůstávají stejné)
 async def handle_call_selection(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int | None:
-    query = update.callback_query; await query.answer(); callback_data = query.data; user = update.effective_user; user_id = user.id; first_name = user.first_name or "Uživateli"; logger.info(f"HANDLER: User {user_id} stiskl tlačítko: {callback_data}")
-    if not callback_data.startswith("call_"): logger.warning(f"HANDLER: User {user_id} poslal neočekávaný callback (ne call_): {callback_data}"); return None
-    next_state = ConversationHandler.END
+    query = update.callback_query; callback_data = query.data; user_id = update.effective_user.id; logger.info(f"HANDLER: User {user_id} stiskl tlačítko: {callback_data}")
+    call_id = bot_logic.parse_callback_id(callback_data, "call")
+    if call_id is None:
+        await query.answer()
+        logger.warning(f"HANDLER: Neplatný call_ callback od user {user_id}: {callback_data}")
+        await context.bot.send_message(chat_id=query.message.chat_id, text="Chyba při zpracování volby.")
+        return ConversationHandler.END
+    # Nejdřív odezva uživateli, teprve potom DB
+    ack_ms = await fast_ack(query); logger.debug(f"HANDLER: call_{call_id} potvrzen za {ack_ms:.0f} ms")
+    return await begin_checkout(update, context, call_id, query.edit_message_text)
+
+async def begin_checkout(update: Update, context: ContextTypes.DEFAULT_TYPE, call_id: int, show) -> int:
+    """Společný vstup do výzvy (tlačítko i deep-link); `show` zobrazí odpověď (edit nebo reply)."""
+    user = update.effective_user; user_id = user.id; first_name = user.first_name or "Uživateli"; chat_id = update.effective_chat.id
+    tenant = tenant_of(context)
     try:
-        call_id = int(callback_data.split("_")[1]); result = bot_logic.process_call_selection(user_id, call_id, first_name)
-        if result['status'] == 'error' or result['status'] == 'info': await query.edit_message_text(text=result['message'], reply_markup=None)
-        elif result['status'] == 'ok':
-            final_message = result['message']; state_code = result.get('next_state'); use_markdown = (state_code == ASKING_DATA)
-            await query.edit_message_text(text=final_message, reply_markup=None, parse_mode=ParseMode.MARKDOWN if use_markdown else None)
-            if 'user_data_updates' in result: context.user_data.update(result['user_data_updates'])
-            if state_code == ASKING_DATA: return await ask_next_data(update, context)
-            else: next_state = ConversationHandler.END;
-                  for key in list(context.user_data.keys()):
-                      if key.startswith('current_') or key in ['data_needed_list', 'data_needed_index', 'collected_data_so_far']: context.user_data.pop(key, None)
-        else: logger.error(f"Neznámý status '{result.get('status')}' vrácen z process_call_selection."); await query.edit_message_text("Nastala neočekávaná chyba.")
-        return next_state
-    except (IndexError, ValueError) as e: logger.error(f"HANDLER: Neplatný formát call_ callback_data: {callback_data} pro user {user_id}. Chyba: {e}"); await context.bot.send_message(chat_id=query.message.chat_id, text="Chyba při zpracování volby."); return ConversationHandler.END
-    except Exception as e: logger.error(f"HANDLER: Neočekávaná chyba při handle_call_selection {callback_data} pro user {user_id}: {e}");
-                         try: await context.bot.send_message(chat_id=query.message.chat_id, text="Neočekávaná chyba při zpracování vaší volby.")
-                         except Exception as send_e: logger.error(f"HANDLER: Nepodařilo se odeslat ani chybovou zprávu uživateli {user_id}: {send_e}")
-                         return ConversationHandler.END
+        # Výzva i zkompilovaná šablona z cache; z DB jen účast (a výzva při prvním použití)
+        cached = call_templates.get(call_id)
+        if cached is None:
+            call, participation = await db_pool.submit(load_call_selection, user_id, call_id)
+            cached = call_templates.put(call) if call else None
+        else:
+            participation = await db_pool.submit(get_participation, user_id, call_id)
+        if cached is not None and cached.call['tenant'] != tenant.name:
+            cached = None  # Výzva jiného bota se tváří jako neexistující
+        result = bot_logic.process_call_selection(cached.call if cached else None, participation, user_id, first_name, cached.compiled if cached else None)
+        if result['status'] != 'ok':
+            await show(text=result['message'], reply_markup=None)
+            return ConversationHandler.END
+        previous = tenant.sessions.get(user_id)
+        if previous is not None and previous.get('current_call_capacity') is not None and previous['current_call_id'] != call_id:
+            await db_pool.run(release_reservations, [(user_id, previous['current_call_id'])])  # Rozpracovaný nákup jiné výzvy končí
+        if not await db_pool.run(save_participation, user_id, call_id, result):
+            await show(text=result.get('error_message', bot_logic.SAVE_ERROR_MESSAGE), reply_markup=None)
+            return ConversationHandler.END
+        await show(text=result['message'], reply_markup=None, parse_mode=ParseMode.MARKDOWN if result.get('markdown') else None)
+        if result['next_state'] == ASKING_DATA:
+            tenant.sessions.start(user_id, chat_id).apply(result)
+            return await ask_next_data(update, context)
+        tenant.sessions.drop(user_id)
+        return ConversationHandler.END
+    except PoolBusy:
+        logger.warning(f"HANDLER: Pool je plný, výzva {call_id} od user {user_id} odmítnuta.")
+        await show(text=BUSY_TEXT, reply_markup=None)
+        return ConversationHandler.END
+    except Exception as e:
+        logger.error(f"HANDLER: Neočekávaná chyba při výběru výzvy {call_id} pro user {user_id}: {e}")
+        try: await context.bot.send_message(chat_id=chat_id, text="Neočekávaná chyba při zpracování vaší volby.")
+        except Exception as send_e: logger.error(f"HANDLER: Nepodařilo se odeslat ani chybovou zprávu uživateli {user_id}: {send_e}")
+        return ConversationHandler.END
 
 async def ask_next_data(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user_data = context.user_data; needed_list = user_data.get('data_needed_list', []); current_index = user_data.get('data_needed_index', 0)
     chat_id = update.effective_chat.id if update.effective_chat else (update.callback_query.message.chat_id if update.callback_query else None)
     if not chat_id: logger.error("Nemohu získat chat_id v ask_next_data"); return ConversationHandler.END
-    if current_index >= len(needed_list):
-        user = update.effective_user; user_id = user.id; first_name = user.first_name or "Uživateli"; call_id = user_data.get('current_call_id'); logger.info(f"User {user_id}: Všechna data pro call {call_id} shromážděna."); collected_data = user_data.get('collected_data_so_far', {})
-        call_details = get_call_details(call_id); instruction_template = "Další instrukce brzy."; call_name = f"Výzva ID {call_id}"; deal_price = "N/A"
-        if call_details:
-            try: call_name = call_details['name'] or call_name; except IndexError: pass
-            try: deal_price = call_details['deal_price']; except IndexError: pass
-            try: instruction_template = call_details['final_instructions'] or instruction_template; except IndexError: logger.warning(f"Chybí 'final_instructions' pro call {call_id}.")
-        if add_or_update_participation(user_id=user_id, call_id=call_id, status='data_collected', collected_data=collected_data):
-            format_data = {"user_first_name": first_name, "user_id": user_id, "call_name": call_name, "deal_price": deal_price, "call_id": call_id}; format_data.update(collected_data)
-            try: formatted_instructions = instruction_template.format(**format_data)
-            except Exception as e: logger.error(f"Chyba formátování final_instructions: {e}"); formatted_instructions = instruction_template
-            confirmation_message = "Děkuji! Všechny potřebné údaje byly zaznamenány.\n\n**Shrnutí:**\n";
-            for key, value in collected_data.items(): confirmation_message += f"- {key.replace('_', ' ').capitalize()}: {value}\n"
-            confirmation_message += f"\n**Další kroky:**\n{formatted_instructions}"
-            try: await context.bot.send_message(chat_id=chat_id, text=confirmation_message, parse_mode=ParseMode.MARKDOWN)
-            except Exception as e: logger.warning(f"Nepodařilo se poslat final confirmation s Markdown: {e}. Posílám plain."); plain_text = confirmation_message.replace('**',''); await context.bot.send_message(chat_id=chat_id, text=plain_text)
-        else: await context.bot.send_message(chat_id=chat_id, text="Chyba při ukládání údajů.")
-        for key in list(user_data.keys()):
-            if key.startswith('current_') or key in ['data_needed_list', 'data_needed_index', 'collected_data_so_far']: user_data.pop(key, None)
-        return ConversationHandler.END
-    else:
-        data_key = needed_list[current_index].strip(); user_data['current_data_key'] = data_key
-        questions = {"adresa doručení": "Prosím, zadej **adresu doručení** (ulice, č.p., město, PSČ):", "telefonní číslo": "Prosím, zadej své **telefonní číslo**:", "počet kusů": "Prosím, zadej požadovaný **počet kusů**:", "email": "Prosím, zadej svou **emailovou adresu**:",}
-        question_text = questions.get(data_key.lower(), f"Prosím, zadej údaj pro: **{data_key}**")
-        await context.bot.send_message(chat_id=chat_id, text=question_text, parse_mode=ParseMode.MARKDOWN)
-        return PROCESSING_DATA
+    user = update.effective_user; user_id = user.id; first_name = user.first_name or "Uživateli"
+    session = tenant_of(context).sessions.get(user_id)
+    if session is None: await context.bot.send_message(chat_id=chat_id, text=bot_logic.CHECKOUT_EXPIRED_MESSAGE); return ConversationHandler.END
+    step = bot_logic.next_data_step(session)
+    if step['status'] == 'ask':
+        session.apply(step)
+        await context.bot.send_message(chat_id=chat_id, text=step['message'], parse_mode=ParseMode.MARKDOWN)
+        return step['next_state']
+
+    call_id = step['call_id']
+    logger.info(f"User {user_id}: Všechna data pro call {call_id} shromážděna.")
+    cached = call_templates.get(call_id)
+    if cached is None:
+        call_details = await db_pool.run(get_call_details, call_id)
+        cached = call_templates.put(call_details) if call_details else None
+    call = cached.call if cached else {'call_id': call_id, 'name': None, 'deal_price': "N/A", 'final_instructions': None, 'capacity': None}
+    result = bot_logic.complete_data_collection(call, user_id, first_name, step['collected_data'], cached.compiled if cached else None)
+    if await db_pool.run(save_participation, user_id, call_id, result):
+        try: await context.bot.send_message(chat_id=chat_id, text=result['message'], parse_mode=ParseMode.MARKDOWN)
+        except Exception as e: logger.warning(f"Nepodařilo se poslat final confirmation s Markdown: {e}. Posílám plain."); plain_text = result['message'].replace('**',''); await context.bot.send_message(chat_id=chat_id, text=plain_text)
+    else: await context.bot.send_message(chat_id=chat_id, text=result['error_message'])
+    tenant_of(context).sessions.drop(user_id)
+    return ConversationHandler.END
 
 async def process_data_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user_data = context.user_data; user_input = update.message.text; user_id = update.effective_user.id; current_key = user_data.get('current_data_key')
-    if not current_key: logger.warning(f"User {user_id} poslal '{user_input}', ale nečekal se údaj."); return PROCESSING_DATA
-    logger.info(f"User {user_id} zadal údaj '{user_input}' pro '{current_key}'")
-    is_valid = True; error_message = ""; processed_input = user_input.strip(); key_lower = current_key.lower()
-    if key_lower == 'počet kusů':
-        if not processed_input.isdigit() or int(processed_input) <= 0: is_valid = False; error_message = "Toto není kladné číslo. Zadej počet kusů (např. 1):"
-        else: processed_input = int(processed_input)
-    elif key_lower == 'email':
-        if not re.match(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$', processed_input): is_valid = False; error_message = "Toto není platný email. Zadej ho znovu (např. jmeno@domena.cz):"
-    elif key_lower == 'telefonní číslo':
-        cleaned_phone = re.sub(r'[\s()-]+', '', processed_input)
-        if not re.match(r'^\+?\d{9,15}$', cleaned_phone): is_valid = False; error_message = "Toto není platný telefon. Zadej ho znovu (např. +420123456789):"
-        else: processed_input = cleaned_phone
-    elif key_lower == 'adresa doručení':
-        if len(processed_input) < 10: is_valid = False; error_message = "Adresa je příliš krátká. Zadej ji prosím znovu:"
-    if not is_valid: await update.message.reply_text(error_message); return PROCESSING_DATA
-    user_data.setdefault('collected_data_so_far', {})[current_key] = processed_input
-    user_data['data_needed_index'] = user_data.get('data_needed_index', 0) + 1
-    user_data.pop('current_data_key', None)
+    user_input = update.message.text; user_id = update.effective_user.id
+    session = tenant_of(context).sessions.get(user_id)
+    if session is None:
+        # Nákup mezitím vypršel, konverzaci ukončíme i v ConversationHandleru
+        logger.info(f"User {user_id} poslal údaj do vypršelého nákupu.")
+        await update.message.reply_text(bot_logic.CHECKOUT_EXPIRED_MESSAGE); return ConversationHandler.END
+    result = bot_logic.process_data_input(session, user_input)
+    if result['status'] == 'ignored': logger.warning(f"User {user_id} poslal '{user_input}', ale nečekal se údaj."); return result['next_state']
+    logger.info(f"User {user_id} zadal údaj '{user_input}' pro '{session.get('current_data_key')}'")
+    if result['status'] == 'invalid': await update.message.reply_text(result['message']); return result['next_state']
+    if result.get('save_participation'):
+        # Zadaný počet kusů výzvy s kapacitou se rezervuje hned; při nedostatku se ptáme znovu
+        if not await db_pool.run(save_participation, user_id, session['current_call_id'], result):
+            await update.message.reply_text(result.get('error_message', bot_logic.SAVE_ERROR_MESSAGE))
+            if result.get('next_state') == ConversationHandler.END: tenant_of(context).sessions.drop(user_id)
+            return result.get('next_state', PROCESSING_DATA)
+    session.apply(result)
     return await ask_next_data(update, context)
 
 async def cancel_all_conversations(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user = update.effective_user; user_data = context.user_data; call_id = user_data.get('current_call_id'); adding_call_data = user_data.get('new_call_data')
-    if call_id: logger.info(f"User {user.id} zrušil sběr dat pro call {call_id}."); add_or_update_participation(user_id=user.id, call_id=call_id, status='cancelled')
-    elif adding_call_data is not None: logger.info(f"Admin {user.id} zrušil přidávání nové výzvy.")
+    user = update.effective_user; user_data = context.user_data
+    session = tenant_of(context).sessions.drop(user.id)
+    result = bot_logic.process_cancel_conversation(ChainMap(session or {}, user_data))
+    if 'call_id' in result: logger.info(f"User {user.id} zrušil sběr dat pro call {result['call_id']}."); await db_pool.run(save_participation, user.id, result['call_id'], result)
+    elif 'new_call_data' in user_data: logger.info(f"Admin {user.id} zrušil přidávání nové výzvy.")
     else: logger.info(f"User {user.id} použil /cancel mimo konverzaci.")
-    await update.message.reply_text("Aktuální akce byla zrušena.", reply_markup=ReplyKeyboardRemove())
-    keys_to_clear = ['current_call_id', 'data_needed_list', 'data_needed_index', 'collected_data_so_far', 'current_data_key', 'new_call_data']
-    for key in list(user_data.keys()):
-        if key in keys_to_clear: user_data.pop(key, None)
+    await update.message.reply_text(result['message'], reply_markup=ReplyKeyboardRemove())
+    apply_user_data(context, result)
     return ConversationHandler.END
 
 # --- Handlery pro /zrusit_ucast ---
 async def cancel_participation_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    user_id = update.effective_user.id; logger.info(f"User {user_id} spustil /zrusit_ucast"); active_participations = get_user_active_participations(user_id)
+    user_id = update.effective_user.id; logger.info(f"User {user_id} spustil /zrusit_ucast"); active_participations = load_active_participations(user_id, tenant_of(context).name)
     if not active_participations: await update.message.reply_text("Nemáš žádné aktivní účasti."); return
-    message_text = "Tvé aktivní účasti. Vyber, kterou chceš zrušit:\n"; keyboard = []
-    for part in active_participations: button_text = f"Zrušit: {part['call_name']} (Stav: {part['status']})"; callback_data = f"cancel_{part['call_id']}"; keyboard.append([InlineKeyboardButton(button_text, callback_data=callback_data)])
-    keyboard.append([InlineKeyboardButton("Zpět", callback_data="cancel_abort")]); reply_markup = InlineKeyboardMarkup(keyboard); await update.message.reply_text(message_text, reply_markup=reply_markup)
+    message_text = "Tvé aktivní účasti. Vyber, kterou chceš zrušit:\n"
+    keyboard = [[InlineKeyboardButton(text, callback_data=data)] for text, data in bot_logic.build_cancel_buttons(active_participations)]
+    await update.message.reply_text(message_text, reply_markup=InlineKeyboardMarkup(keyboard))
 
 async def handle_cancel_selection(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    query = update.callback_query; await query.answer(); callback_data = query.data; user_id = query.from_user.id; logger.info(f"User {user_id} stiskl tlačítko zrušení: {callback_data}")
-    if callback_data == "cancel_abort": await query.edit_message_text("Akce zrušena.", reply_markup=None); return
-    if callback_data.startswith("cancel_"):
-        try:
-            call_id_to_cancel = int(callback_data.split("_")[1])
-            if add_or_update_participation(user_id, call_id_to_cancel, status='cancelled', collected_data=None): call_details = get_call_details(call_id_to_cancel); call_name = call_details['name'] if call_details else f"ID {call_id_to_cancel}"; await query.edit_message_text(f"Účast ve Výzvě '{call_name}' zrušena.", reply_markup=None); logger.info(f"User {user_id} zrušil účast ve výzvě {call_id_to_cancel}.")
-            else: await query.edit_message_text("Chyba při rušení účasti.", reply_markup=None)
-        except (IndexError, ValueError): logger.error(f"Neplatný cancel callback_data: {callback_data} pro user {user_id}"); await query.edit_message_text("Chyba při zpracování volby.", reply_markup=None)
-        except Exception as e: logger.error(f"Neočekávaná chyba handle_cancel_selection {callback_data} user {user_id}: {e}"); await query.message.reply_text("Neočekávaná chyba při rušení.")
-    else: logger.warning(f"User {user_id} poslal neznámý cancel callback: {callback_data}"); await query.edit_message_text("Neznámá akce.", reply_markup=None)
+    query = update.callback_query; callback_data = query.data; user_id = query.from_user.id; logger.info(f"User {user_id} stiskl tlačítko zrušení: {callback_data}")
+    result = bot_logic.process_cancel_selection(callback_data)
+    if result['status'] != 'ok':
+        if result['status'] == 'error': logger.error(f"Neplatný cancel callback_data: {callback_data} pro user {user_id}")
+        await query.answer(); await query.edit_message_text(result['message'], reply_markup=None); return
+    call_id = result['call_id']
+    await fast_ack(query)
+    try:
+        if await db_pool.submit(save_participation, user_id, call_id, result):
+            call = call_templates.get(call_id)
+            call = call.call if call else await db_pool.run(get_call_details, call_id)
+            await query.edit_message_text(bot_logic.format_cancel_result(call, call_id), reply_markup=None); logger.info(f"User {user_id} zrušil účast ve výzvě {call_id}.")
+        else: await query.edit_message_text(result['error_message'], reply_markup=None)
+    except PoolBusy: await query.edit_message_text(BUSY_TEXT, reply_markup=None)
+    except Exception as e: logger.error(f"Neočekávaná chyba handle_cancel_selection {callback_data} user {user_id}: {e}"); await query.message.reply_text("Neočekávaná chyba při rušení.")
 
 # --- Handler pro /moje_ucasti ---
 async def my_participations_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id; logger.info(f"User {user_id} spustil /moje_ucasti")
-    active_participations = get_user_active_participations(user_id)
-    if not active_participations: await update.message.reply_text("Nemáš aktuálně žádné aktivní účasti ve Výzvách."); return
-    message_parts = ["Tvé aktuální aktivní účasti:\n"]; status_translation = { 'interested': 'Projeven zájem', 'data_collected': 'Údaje poskytnuty', 'confirmed': 'Potvrzeno' }
-    for part in active_participations:
-        try: call_name = part['call_name']
-        except (IndexError, KeyError): call_name = f"Výzva ID {part['call_id'] if 'call_id' in part else '?'}" ; logger.warning(f"Chybí 'call_name' v účasti pro user {user_id}")
-        try: status = part['status']
-        except (IndexError, KeyError): status = 'Neznámý'; logger.warning(f"Chybí 'status' v účasti pro user {user_id}")
-        status_cz = status_translation.get(status, status)
-        message_parts.append(f"\n- *{call_name}*"); message_parts.append(f"  Stav: {status_cz}")
-    try: await update.message.reply_text("\n".join(message_parts), parse_mode=ParseMode.MARKDOWN)
-    except Exception as e: logger.warning(f"Nepodařilo se poslat moje_ucasti s Markdown: {e}. Posílám jako prostý text."); plain_text = "\n".join(message_parts).replace('*',''); await update.message.reply_text(plain_text)
+    message_text = bot_logic.format_participations_message(load_active_participations(user_id, tenant_of(context).name))
+    try: await update.message.reply_text(message_text, parse_mode=ParseMode.MARKDOWN)
+    except Exception as e: logger.warning(f"Nepodařilo se poslat moje_ucasti s Markdown: {e}. Posílám jako prostý text."); await update.message.reply_text(message_text.replace('*',''))
+
+# --- Handlery pro /souhrn (souhrny nových výzev) ---
+async def digest_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    user_id = update.effective_user.id; tenant = tenant_of(context)
+    if context.args:
+        result = bot_logic.process_digest_choice(context.args[0], load_consent(user_id))
+        await update.message.reply_text(await save_digest_choice(user_id, tenant.name, result)); return
+    message_text, buttons = bot_logic.format_digest_menu(get_digest_subscription(user_id, tenant.name))
+    await update.message.reply_text(message_text, reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(text, callback_data=data)] for text, data in buttons]))
+
+async def handle_digest_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query; user_id = query.from_user.id
+    await query.answer()
+    result = bot_logic.process_digest_choice(query.data[len(bot_logic.DIGEST_CHOICE_PREFIX):], load_consent(user_id))
+    await query.edit_message_text(await save_digest_choice(user_id, tenant_of(context).name, result), reply_markup=None)
+
+async def save_digest_choice(user_id: int, tenant_name: str, result: dict) -> str:
+    """Uloží platnou volbu odběru a vrátí text odpovědi."""
+    if result['status'] != 'ok': return result['message']
+    if not await db_pool.run(set_digest_subscription, user_id, result['period'], tenant_name): return "Chyba při ukládání volby."
+    logger.info(f"User {user_id} nastavil souhrn: {result['period'] or 'vypnuto'}"); return result['message']
+
+async def handle_digest_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Listování v souhrnu - stránka se sestaví znovu z výzev jeho období."""
+    query = update.callback_query; parsed = bot_logic.parse_digest_callback(query.data)
+    await query.answer()
+    if parsed is None: logger.warning(f"Neplatný digest callback: {query.data}"); return
+    since, cutoff, page = parsed
+    try: calls = await db_pool.submit(get_digest_calls, since, cutoff, tenant_of(context).name)
+    except PoolBusy: logger.warning(f"Pool je plný, stránka souhrnu pro user {query.from_user.id} odmítnuta."); return
+    message_text, rows = bot_logic.format_digest_page(calls, page, DIGEST_PAGE_SIZE, since, cutoff)
+    try: await query.edit_message_text(message_text, reply_markup=digest_markup(rows), parse_mode=ParseMode.MARKDOWN)
+    except TelegramError as e: logger.warning(f"Nepodařilo se zobrazit stránku souhrnu s Markdown: {e}. Posílám plain."); await query.edit_message_text(message_text.replace('*','').replace('~',''), reply_markup=digest_markup(rows))
 
 # --- NOVÝ HANDLER pro /listcalls_admin ---
 async def list_all_calls_admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """(Admin Only) Zobrazí všechny výzvy v DB s jejich ID a statusem."""
     user_id = update.effective_user.id
-    if not is_admin(user_id):
+    if not is_admin(context, user_id):
         logger.warning(f"Neoprávněný pokus o /listcalls_admin od user {user_id}")
         await update.message.reply_text("Tento příkaz může použít pouze administrátor.")
         return
 
     logger.info(f"Admin {user_id} spustil /listcalls_admin")
-    all_calls = get_all_calls() # Získáme všechny výzvy
+    all_calls = get_all_calls(include_archive=True, tenant=tenant_of(context).name) # Získáme všechny výzvy bota včetně archivovaných
 
     if not all_calls:
         await update.message.reply_text("V databázi nejsou zatím žádné výzvy.")
@@ -215,6 +450,8 @@ async def list_all_calls_admin(update: Update, context: ContextTypes.DEFAULT_TYP
             call_id = call['call_id']
             name = call['name'] or "Bez názvu"
             status = call['status'] or "Neznámý"
+            if call['archived']:
+                status = f"{status}, archiv"
             # Použijeme zpětné apostrofy pro monospace ID a status
             message_parts.append(f"- ID: `{call_id}` | Stav: `{status}` | Název: {name}")
         except (IndexError, KeyError):
@@ -231,111 +468,547 @@ async def list_all_calls_admin(update: Update, context: ContextTypes.DEFAULT_TYP
         plain_text = final_message.replace('`', '')
         await update.message.reply_text(plain_text)
 
+# --- Admin handlery pro uzavírání a archivaci výzev ---
+async def close_call_admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """(Admin Only) Uzavře výzvu podle ID: /closecall <ID>."""
+    user_id = update.effective_user.id
+    if not is_admin(context, user_id):
+        logger.warning(f"Neoprávněný pokus o /closecall od user {user_id}")
+        await update.message.reply_text("Tento příkaz může použít pouze administrátor.")
+        return
+
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text("Použití: /closecall <ID výzvy>")
+        return
+
+    call_id = int(context.args[0])
+    call = get_call_details(call_id)
+    if not call or call['tenant'] != tenant_of(context).name:
+        await update.message.reply_text(f"Výzva ID {call_id} nebyla nalezena.")
+        return
+    if await db_pool.run(close_call, call_id):
+        call_templates.invalidate(call_id)
+        logger.info(f"Admin {user_id} uzavřel výzvu {call_id}")
+        await update.message.reply_text(f"Výzva ID {call_id} byla uzavřena.")
+    else:
+        await update.message.reply_text(f"Výzvu ID {call_id} se nepodařilo uzavřít (neexistuje nebo už je uzavřená).")
+
+async def archive_calls_admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """(Admin Only) Přesune uzavřené výzvy starší než retence do archivní DB."""
+    user_id = update.effective_user.id
+    if not is_admin(context, user_id):
+        logger.warning(f"Neoprávněný pokus o /archivecalls od user {user_id}")
+        await update.message.reply_text("Tento příkaz může použít pouze administrátor.")
+        return
+
+    retention_days = ARCHIVE_RETENTION_DAYS
+    if context.args:
+        if not context.args[0].isdigit():
+            await update.message.reply_text("Použití: /archivecalls [počet dní od uzavření]")
+            return
+        retention_days = int(context.args[0])
+
+    logger.info(f"Admin {user_id} spustil /archivecalls (retence {retention_days} dní)")
+    stats = await db_pool.run(archive_closed_calls, retention_days=retention_days)  # Přesun do archivní DB a VACUUM trvají
+    call_templates.clear()  # Archivované výzvy už v cache nemají co dělat
+    user_states.invalidate_participations()  # Ani účasti v nich
+    audience_index.invalidate()  # Archivace účasti maže, segmenty se postaví znovu
+    if stats is None:
+        await update.message.reply_text("Chyba při archivaci výzev.")
+        return
+    await update.message.reply_text(
+        f"Archivováno výzev: {stats['calls']}, účastí: {stats['participations']}.\n"
+        f"Uvolněno stránek DB: {stats['freed_pages']}."
+    )
+
+async def confirm_call_admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """(Admin Only) Hromadně potvrdí účasti 'data_collected' ve výzvě a rozešle instrukce."""
+    user_id = update.effective_user.id
+    if not is_admin(context, user_id):
+        logger.warning(f"Neoprávněný pokus o /confirmcall od user {user_id}")
+        await update.message.reply_text("Tento příkaz může použít pouze administrátor.")
+        return
+
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text("Použití: /confirmcall <ID výzvy>")
+        return
+
+    call_id = int(context.args[0])
+    call = get_call_details(call_id)
+    if not call or call['tenant'] != tenant_of(context).name:
+        await update.message.reply_text(f"Výzva ID {call_id} nebyla nalezena.")
+        return
+    logger.info(f"Admin {user_id} spustil /confirmcall pro výzvu {call_id}")
+    confirmed = await db_pool.run(confirm_call_participations, call_id, render_confirmation_message)  # Transakce s vykreslením zpráv pro všechny účastníky
+    user_states.invalidate_participations()  # Hromadně změněné stavy účastí
+    if confirmed is None:
+        await update.message.reply_text(f"Chyba při potvrzování účastí ve výzvě ID {call_id}.")
+        return
+    await update.message.reply_text(f"Potvrzeno účastí: {confirmed}. Rozesílám instrukce na pozadí.")
+    # Rozesílka běží mimo handler, aby ho neblokovala po dobu tisíců odeslání
+    context.application.create_task(deliver_pending_notifications(context.bot, outbound_limiter, tenant=tenant_of(context).name), update=update)
+
+async def deep_link_admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """(Admin Only) Vytvoří podepsaný odkaz, který uživatele dovede přímo do výzvy."""
+    user_id = update.effective_user.id
+    if not is_admin(context, user_id):
+        logger.warning(f"Neoprávněný pokus o /deeplink od user {user_id}")
+        await update.message.reply_text("Tento příkaz může použít pouze administrátor.")
+        return
+
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text("Použití: /deeplink <ID výzvy>")
+        return
+
+    call_id = int(context.args[0])
+    call = get_call_details(call_id)
+    if not call or call['tenant'] != tenant_of(context).name:
+        await update.message.reply_text(f"Výzva ID {call_id} nebyla nalezena.")
+        return
+    link = call_link(context.bot.username, call_id, tenant_of(context).deeplink_key)
+    await update.message.reply_text(f"Odkaz na výzvu '{call['name']}' (stav {call['status']}):\n{link}")
+
+async def audience_admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """(Admin Only) Spočítá cílovou skupinu: /audience <segmenty> (průnik, viz audience.py)."""
+    user_id = update.effective_user.id
+    if not is_admin(context, user_id):
+        logger.warning(f"Neoprávněný pokus o /audience od user {user_id}")
+        await update.message.reply_text("Tento příkaz může použít pouze administrátor.")
+        return
+
+    expression = " ".join(context.args or [])
+    started = time.perf_counter()
+    try:
+        count = await db_pool.run(audience_index.count, expression, tenant_of(context).name)
+    except SegmentError as e:
+        await update.message.reply_text(f"{e}\nPoužití: /audience <segmenty>"); return
+    except RuntimeError as e:
+        await update.message.reply_text(f"Chyba při výpočtu segmentu: {e}"); return
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    await update.message.reply_text(f"Segment '{expression}': {count} uživatelů ({elapsed_ms:.1f} ms).")
+
+async def announce_admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """(Admin Only) Oznámí aktivní výzvu cílové skupině: /announce <ID výzvy> <segmenty>."""
+    user_id = update.effective_user.id
+    if not is_admin(context, user_id):
+        logger.warning(f"Neoprávněný pokus o /announce od user {user_id}")
+        await update.message.reply_text("Tento příkaz může použít pouze administrátor.")
+        return
+
+    if not context.args or not context.args[0].isdigit() or len(context.args) < 2:
+        await update.message.reply_text("Použití: /announce <ID výzvy> <segmenty>"); return
+    call_id = int(context.args[0])
+    expression = " ".join(context.args[1:])
+    tenant = tenant_of(context)
+    call = get_call_details(call_id)
+    if not call or call['tenant'] != tenant.name or call['status'] != 'active':
+        await update.message.reply_text(f"Aktivní výzva ID {call_id} nebyla nalezena."); return
+    try:
+        recipients = await db_pool.run(audience_index.recipients, expression, tenant.name)
+    except SegmentError as e:
+        await update.message.reply_text(f"{e}\nPoužití: /announce <ID výzvy> <segmenty>"); return
+    except RuntimeError as e:
+        await update.message.reply_text(f"Chyba při výpočtu segmentu: {e}"); return
+    logger.info(f"Admin {user_id} spustil /announce výzvy {call_id} pro segment '{expression}' ({len(recipients)} uživatelů)")
+    text = bot_logic.format_call_announcement(call, call_link(context.bot.username, call_id, tenant.deeplink_key))
+    queued = await db_pool.run(enqueue_announcements, call_id, recipients, text, tenant.name)
+    if queued is None:
+        await update.message.reply_text(f"Chyba při zařazování oznámení výzvy ID {call_id}."); return
+    await update.message.reply_text(f"Segment: {len(recipients)} uživatelů, nově zařazeno oznámení: {queued}. Rozesílám na pozadí.")
+    context.application.create_task(deliver_pending_notifications(context.bot, outbound_limiter, tenant=tenant.name), update=update)
+
+async def backup_admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """(Admin Only) Vytvoří online zálohu databáze na pozadí."""
+    user_id = update.effective_user.id
+    if not is_admin(context, user_id):
+        logger.warning(f"Neoprávněný pokus o /backup od user {user_id}")
+        await update.message.reply_text("Tento příkaz může použít pouze administrátor.")
+        return
+
+    logger.info(f"Admin {user_id} spustil /backup")
+    await update.message.reply_text("Zálohuji databázi na pozadí...")
+    import backup
+    path = await backup.run_backup(**backup_options())
+    if path: await update.message.reply_text(f"Záloha hotová: {path}")
+    else: await update.message.reply_text("Záloha selhala, podrobnosti jsou v logu.")
+
+async def stats_admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """(Admin Only) Vypíše provozní čítače (flood guard, sessions, deduplikace)."""
+    user_id = update.effective_user.id
+    if not is_admin(context, user_id):
+        logger.warning(f"Neoprávněný pokus o /stats od user {user_id}")
+        await update.message.reply_text("Tento příkaz může použít pouze administrátor.")
+        return
+
+    tenant = tenant_of(context)
+    lines = [f"Provozní čítače (bot {tenant.name}):"]
+    lines += [f"- flood.{name}: {value}" for name, value in tenant.flood_guard.stats.items()]
+    lines += [f"- sessions.{name}: {value}" for name, value in tenant.sessions.stats.items()]
+    lines.append(f"- sessions.active: {len(tenant.sessions)}")
+    lines.append(f"- updates.duplicates: {tenant.update_tracker.duplicates}")
+    lines.append(f"- templates.cached: {len(call_templates)}")
+    lines += [f"- user_cache.{name}: {value}" for name, value in user_states.stats.items()]
+    lines.append(f"- user_cache.users: {len(user_states)}")
+    lines += [f"- db_pool.{name}: {value}" for name, value in db_pool.stats.items()]
+    lines.append(f"- db_pool.pending: {db_pool.pending}")
+    lines += [f"- startup.{phase}_ms: {seconds * 1000:.0f}" for phase, seconds in startup_timer.phases.items()]
+    lines += [f"- digest.{period}: {count}" for period, count in count_digest_subscriptions(tenant.name).items()]
+    lines += [f"- audience.{name}: {value}" for name, value in audience_index.stats.items()]
+    lines.append(f"- audience.users: {len(audience_index)}")
+    if handoff.enabled: lines.append(f"- handoff.lease: {handoff.owner if handoff.held else 'nedrží'}")
+    await update.message.reply_text("\n".join(lines))
+
+# --- Admin diagnostika (profiler, paměť, asyncio úlohy) ---
+PROFILE_DEFAULT_SECONDS = 10
+PROFILE_MAX_SECONDS = 120
+
+async def send_report(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, name: str) -> None:
+    """Pošle textový report jako dokument (do zprávy by se nevešel)."""
+    filename = f"{name}-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.txt"
+    await context.bot.send_document(chat_id=update.effective_chat.id, document=text.encode("utf-8"), filename=filename)
+
+async def profile_admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """(Admin Only) Vzorkovací profiler na N sekund: /profile [sekundy]."""
+    user_id = update.effective_user.id
+    if not is_admin(context, user_id):
+        logger.warning(f"Neoprávněný pokus o /profile od user {user_id}")
+        await update.message.reply_text("Tento příkaz může použít pouze administrátor.")
+        return
+
+    if context.args and not context.args[0].isdigit():
+        await update.message.reply_text(f"Použití: /profile [sekundy, max {PROFILE_MAX_SECONDS}]")
+        return
+    seconds = min(max(int(context.args[0]) if context.args else PROFILE_DEFAULT_SECONDS, 1), PROFILE_MAX_SECONDS)
+    import profiling
+    if profiling.profiler.running:
+        await update.message.reply_text("Profiler už běží, počkej na jeho výsledek.")
+        return
+    logger.info(f"Admin {user_id} spustil /profile na {seconds} s")
+    await update.message.reply_text(f"Profiluji {seconds} s...")
+    try:
+        report = await profiling.profiler.profile_async(seconds)
+    except profiling.ProfilerBusy:
+        await update.message.reply_text("Profiler už běží, počkej na jeho výsledek.")
+        return
+    await send_report(update, context, report, "profile")
+
+async def memsnap_admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """(Admin Only) tracemalloc snapshot a rozdíl proti předchozímu: /memsnap [stop]."""
+    user_id = update.effective_user.id
+    if not is_admin(context, user_id):
+        logger.warning(f"Neoprávněný pokus o /memsnap od user {user_id}")
+        await update.message.reply_text("Tento příkaz může použít pouze administrátor.")
+        return
+
+    import profiling
+    if context.args and context.args[0] == "stop":
+        profiling.memory_tracker.stop()
+        logger.info(f"Admin {user_id} vypnul tracemalloc")
+        await update.message.reply_text("tracemalloc vypnut.")
+        return
+    logger.info(f"Admin {user_id} spustil /memsnap")
+    was_active = profiling.memory_tracker.active
+    report = await asyncio.to_thread(profiling.memory_tracker.snapshot)
+    if was_active: await send_report(update, context, report, "memsnap")
+    else: await update.message.reply_text(report)
+
+async def tasks_admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """(Admin Only) Vypíše běžící asyncio úlohy se zásobníky."""
+    user_id = update.effective_user.id
+    if not is_admin(context, user_id):
+        logger.warning(f"Neoprávněný pokus o /tasks od user {user_id}")
+        await update.message.reply_text("Tento příkaz může použít pouze administrátor.")
+        return
+
+    logger.info(f"Admin {user_id} spustil /tasks")
+    import profiling
+    await send_report(update, context, profiling.format_asyncio_tasks(), "tasks")
+
 # --- Handler pro neznámé zprávy ---
 async def handle_unknown_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     text = update.message.text; user_id = update.effective_user.id
-    if 'current_data_key' in context.user_data or 'new_call_data' in context.user_data: logger.info(f"User {user_id} poslal '{text}' během konverzace."); await update.message.reply_text("Probíhá jiná akce. Dokonči ji prosím, nebo ji zruš pomocí /cancel.")
-    else: logger.warning(f"Received unknown text message from {user_id} mimo konverzaci: {text}"); await update.message.reply_text(f"Promiň, na zprávu '{text}' neumím reagovat. Zkus /help.")
+    session = tenant_of(context).sessions.get(user_id)
+    if session is not None and 'current_data_key' in session:
+        # Nákup převzatý od předchozí instance - ConversationHandler o něm neví, údaj zpracujeme přímo
+        await process_data_input(update, context); return
+    in_conversation = session is not None or 'new_call_data' in context.user_data
+    if in_conversation: logger.info(f"User {user_id} poslal '{text}' během konverzace.")
+    else: logger.warning(f"Received unknown text message from {user_id} mimo konverzaci: {text}")
+    await update.message.reply_text(bot_logic.format_unknown_message(text, in_conversation))
 
 # ==== TESTOVACÍ FUNKCE ====
 async def test_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.info("Test command triggered!"); await update.message.reply_text("Testovací příkaz funguje!")
 
 # ==== FUNKCE PRO /addcall ====
-# (Funkce add_call_start, get_call_name, ..., confirm_add_call, skip_optional zůstávají stejné)
+async def reply_wizard_step(update: Update, context: ContextTypes.DEFAULT_TYPE, result: dict) -> int:
+    """Odešle odpověď kroku průvodce /addcall a vrátí další stav."""
+    apply_user_data(context, result)
+    await update.message.reply_text(result['message'], reply_markup=result_markup(result), parse_mode=ParseMode.MARKDOWN if result.get('markdown') else None)
+    return result['next_state']
+
 async def add_call_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = update.effective_user.id
-    if not is_admin(user_id): logger.warning(f"Neoprávněný pokus o /addcall od user {user_id}"); await update.message.reply_text("Tento příkaz může použít pouze administrátor."); return ConversationHandler.END
-    logger.info(f"Admin {user_id} spustil /addcall"); context.user_data['new_call_data'] = {}; await update.message.reply_text("Začínáme přidávat novou výzvu.\nZadej **Název výzvy**:", parse_mode=ParseMode.MARKDOWN); return GET_CALL_NAME
-
-async def get_call_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user_id = update.effective_user.id; call_name = update.message.text.strip()
-    if not call_name: await update.message.reply_text("Název nemůže být prázdný. Zadej znovu:"); return GET_CALL_NAME
-    context.user_data['new_call_data']['name'] = call_name; logger.info(f"Admin {user_id} zadal název: {call_name}")
-    await update.message.reply_text("Název uložen. Zadej **Popis výzvy** (/skip):", parse_mode=ParseMode.MARKDOWN); return GET_CALL_DESC
-
-async def get_call_desc(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user_id = update.effective_user.id; description = update.message.text.strip()
-    context.user_data['new_call_data']['description'] = description; logger.info(f"Admin {user_id} zadal popis: {description}")
-    await update.message.reply_text("Popis uložen. Zadej **Původní cenu** (číslo nebo /skip):", parse_mode=ParseMode.MARKDOWN); return GET_CALL_ORIG_PRICE
-
-async def get_call_orig_price(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user_id = update.effective_user.id; price_input = update.message.text.strip(); original_price = None
-    try: original_price = float(price_input.replace(',', '.'));
-         if original_price < 0: raise ValueError("Cena nemůže být záporná.")
-         context.user_data['new_call_data']['original_price'] = original_price; logger.info(f"Admin {user_id} zadal pův. cenu: {original_price}")
-    except ValueError: await update.message.reply_text("Neplatný formát. Zadej kladné číslo (např. 450.0) nebo /skip:"); return GET_CALL_ORIG_PRICE
-    await update.message.reply_text("Pův. cena uložena. Zadej **Cenu po slevě** (povinné, číslo):", parse_mode=ParseMode.MARKDOWN); return GET_CALL_DEAL_PRICE
-
-async def get_call_deal_price(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user_id = update.effective_user.id; price_input = update.message.text.strip()
-    try: deal_price = float(price_input.replace(',', '.'));
-         if deal_price <= 0: raise ValueError("Cena po slevě musí být kladná.")
-         context.user_data['new_call_data']['deal_price'] = deal_price; logger.info(f"Admin {user_id} zadal cenu po slevě: {deal_price}")
-    except ValueError: await update.message.reply_text("Neplatný formát/hodnota. Zadej kladné číslo:"); return GET_CALL_DEAL_PRICE
-    await update.message.reply_text("Cena po slevě uložena. Zadej **Potřebná data** (čárkou oddělená, nebo /skip):", parse_mode=ParseMode.MARKDOWN); return GET_CALL_DATA_NEEDED
-
-async def get_call_data_needed(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user_id = update.effective_user.id; data_needed = update.message.text.strip()
-    context.user_data['new_call_data']['data_needed'] = data_needed if data_needed else None; logger.info(f"Admin {user_id} zadal potřebná data: {data_needed if data_needed else 'Žádná'}")
-    await update.message.reply_text("Potř. data uložena. Zadej **Finální instrukce** (použij {placeholdery}):", parse_mode=ParseMode.MARKDOWN); return GET_CALL_FINAL_INST
-
-async def get_call_final_inst(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user_id = update.effective_user.id; final_instructions = update.message.text.strip()
-    if not final_instructions: await update.message.reply_text("Finální instrukce nesmí být prázdné:"); return GET_CALL_FINAL_INST
-    context.user_data['new_call_data']['final_instructions'] = final_instructions; logger.info(f"Admin {user_id} zadal finální instrukce.")
-    call_data = context.user_data['new_call_data']; summary = "**Shrnutí nové výzvy:**\n\n"; summary += f"*Název:* {call_data.get('name')}\n"; summary += f"*Popis:* {call_data.get('description') or '-'}\n"; summary += f"*Pův. cena:* {call_data.get('original_price', '-')} Kč\n"; summary += f"*Cena po slevě:* {call_data.get('deal_price')} Kč\n"; summary += f"*Potř. data:* {call_data.get('data_needed') or '-'}\n"; summary += f"*Finální instrukce:* _{call_data.get('final_instructions')}_\n"; summary += "\n**Chceš tuto výzvu uložit?**"
-    reply_keyboard = [[KeyboardButton("Ano, uložit výzvu ✅")], [KeyboardButton("Ne, zrušit")]]; markup = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True, one_time_keyboard=True)
-    await update.message.reply_text(summary, reply_markup=markup, parse_mode=ParseMode.MARKDOWN); return CONFIRM_ADD_CALL
+    result = bot_logic.start_add_call(is_admin(context, user_id))
+    if result['status'] == 'error': logger.warning(f"Neoprávněný pokus o /addcall od user {user_id}")
+    else: logger.info(f"Admin {user_id} spustil /addcall")
+    return await reply_wizard_step(update, context, result)
+
+async def add_call_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Společný handler textových kroků průvodce (název, popis, ceny, data, instrukce)."""
+    user_id = update.effective_user.id; current_state = context.user_data.get(bot_logic.WIZARD_STATE_KEY)
+    result = bot_logic.process_add_call_input(current_state, context.user_data.get('new_call_data'), update.message.text)
+    if result['status'] == 'ok': logger.info(f"Admin {user_id} vyplnil krok {current_state} průvodce /addcall.")
+    return await reply_wizard_step(update, context, result)
 
 async def confirm_add_call(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user_id = update.effective_user.id; response = update.message.text
-    if "Ano, uložit výzvu" in response:
-        call_data = context.user_data.get('new_call_data')
-        if not call_data: await update.message.reply_text("Chyba: data nenalezena.", reply_markup=ReplyKeyboardRemove()); return ConversationHandler.END
-        new_id = add_new_call(name=call_data['name'], description=call_data.get('description'), original_price=call_data.get('original_price'), deal_price=call_data['deal_price'], status='active', data_needed=call_data.get('data_needed'), final_instructions=call_data.get('final_instructions'))
-        if new_id: await update.message.reply_text(f"Výzva '{call_data['name']}' uložena (ID {new_id})!", reply_markup=ReplyKeyboardRemove()); logger.info(f"Admin {user_id} uložil výzvu ID: {new_id}")
-        else: await update.message.reply_text("Chyba: Uložení do DB selhalo.", reply_markup=ReplyKeyboardRemove())
-    elif "Ne, zrušit" in response: await update.message.reply_text("Přidání zrušeno.", reply_markup=ReplyKeyboardRemove()); logger.info(f"Admin {user_id} zrušil přidání.")
-    else: await update.message.reply_text("Vyber 'Ano' nebo 'Ne'."); return CONFIRM_ADD_CALL
-    context.user_data.pop('new_call_data', None); return ConversationHandler.END
+    user_id = update.effective_user.id
+    result = bot_logic.process_add_call_confirm(update.message.text, context.user_data.get('new_call_data'))
+    if result['status'] == 'save':
+        call_data = result['call_data']
+        new_id = add_new_call(name=call_data['name'], description=call_data.get('description'), original_price=call_data.get('original_price'), deal_price=call_data['deal_price'], status='active', data_needed=call_data.get('data_needed'), final_instructions=call_data.get('final_instructions'), tenant=tenant_of(context).name, capacity=call_data.get('capacity'))
+        if new_id: call_templates.invalidate(new_id); result['message'] = bot_logic.format_call_saved(call_data, new_id); logger.info(f"Admin {user_id} uložil výzvu ID: {new_id}")
+        else: result['message'] = result['error_message']
+    elif result['status'] == 'info': logger.info(f"Admin {user_id} zrušil přidání.")
+    apply_user_data(context, result)
+    await update.message.reply_text(result['message'], reply_markup=result_markup(result))
+    return result['next_state']
 
 async def skip_optional(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    current_state = context.user_data.get(ConversationHandler.STATE); user_id = update.effective_user.id
+    current_state = context.user_data.get(bot_logic.WIZARD_STATE_KEY); user_id = update.effective_user.id
     logger.info(f"Admin {user_id} použil /skip ve stavu {current_state}")
-    next_state = current_state
-    if current_state == GET_CALL_DESC: context.user_data['new_call_data']['description'] = None; await update.message.reply_text("Popis přeskočen. Zadej **Původní cenu** (číslo nebo /skip):", parse_mode=ParseMode.MARKDOWN); next_state = GET_CALL_ORIG_PRICE
-    elif current_state == GET_CALL_ORIG_PRICE: context.user_data['new_call_data']['original_price'] = None; await update.message.reply_text("Pův. cena přeskočena. Zadej **Cenu po slevě** (povinné, číslo):", parse_mode=ParseMode.MARKDOWN); next_state = GET_CALL_DEAL_PRICE
-    elif current_state == GET_CALL_DATA_NEEDED: context.user_data['new_call_data']['data_needed'] = None; await update.message.reply_text("Potř. data přeskočena. Zadej **Finální instrukce**:", parse_mode=ParseMode.MARKDOWN); next_state = GET_CALL_FINAL_INST
-    else: await update.message.reply_text("Tento krok nelze přeskočit příkazem /skip.")
-    return next_state
+    result = bot_logic.process_add_call_skip(current_state, context.user_data.get('new_call_data'))
+    return await reply_wizard_step(update, context, result)
 
 # --- Hlavní funkce ---
+async def expire_checkout_sessions(application: Application, shard: int = 0, shards: int = 1) -> None:
+    """Periodicky uklízí vypršelé nákupy bota a volitelně o tom uživatele informuje."""
+    sessions = tenant_of(application).sessions
+    while True:
+        await asyncio.sleep(SESSION_SWEEP_INTERVAL)
+        expired = sessions.evict_expired()
+        # Rezervace vypršelých nákupů vrátí kusy do skladu; starší rezervace bez session (pád instance) taky
+        reserved = [(session.user_id, session['current_call_id']) for session in expired if session.get('current_call_capacity') is not None]
+        stale = await db_pool.run(get_stale_reservations, 2 * SESSION_TTL_SECONDS, tenant_of(application).name, shard, shards) or []
+        # Čas účasti posouvá jen zadání počtu kusů - pomalý, ale živý nákup si rezervaci nechává
+        reserved += [(user_id, call_id) for user_id, call_id in stale if (sessions.peek(user_id) or {}).get('current_call_id') != call_id]
+        if reserved: await db_pool.run(release_reservations, reserved)
+        if not expired: continue
+        logger.info(f"Vypršelo {len(expired)} rozpracovaných nákupů, aktivních zůstává {len(sessions)}.")
+        if not SESSION_EXPIRY_NOTICE: continue
+        for session in expired:
+            if not session.chat_id: continue
+            await outbound_limiter.acquire()
+            try: await application.bot.send_message(chat_id=session.chat_id, text=bot_logic.CHECKOUT_EXPIRED_MESSAGE)
+            except TelegramError as e: logger.warning(f"Nepodařilo se oznámit vypršení nákupu user {session.user_id}: {e}")
+
+def backup_options() -> dict:
+    options = {"keep": BACKUP_KEEP}
+    if BACKUP_DIR: options["backup_dir"] = BACKUP_DIR
+    return options
+
+async def periodic_backups() -> None:
+    """Pravidelné zálohy podle BACKUP_INTERVAL_HOURS (záloha běží ve vlákně)."""
+    import backup
+    while True:
+        await asyncio.sleep(BACKUP_INTERVAL_HOURS * 3600)
+        await backup.run_backup(**backup_options())
+
+async def digest_schedule(application: Application, shard: int = 0, shards: int = 1) -> None:
+    """Souhrny nových výzev každý den v DIGEST_HOUR (týdenní v DIGEST_WEEKDAY).
+
+    Hned po startu dožene zmeškanou nebo přerušenou rozesílku posledního termínu
+    (kdo souhrn už dostal, toho deliver_digest přeskočí). Workery obsluhují každý své uživatele.
+    """
+    tenant = tenant_of(application)
+    while True:
+        now = datetime.datetime.now()
+        for period in bot_logic.DIGEST_PERIODS:
+            cutoff = int(bot_logic.digest_slot(period, now, DIGEST_HOUR, DIGEST_WEEKDAY).timestamp())
+            await deliver_digest(application.bot, outbound_limiter, period, cutoff, DIGEST_PAGE_SIZE, tenant=tenant.name, shard=shard, shards=shards)
+        next_slot = bot_logic.digest_slot('daily', now, DIGEST_HOUR, DIGEST_WEEKDAY) + datetime.timedelta(days=1)
+        await asyncio.sleep(max(1.0, (next_slot - datetime.datetime.now()).total_seconds()))
+
+def start_background_tasks(application: Application, deliver_pending: bool = True, shard: int = 0, shards: int = 1) -> None:
+    """Úlohy na pozadí bota: dokončení přerušené rozesílky, souhrny, úklid sessions a zálohy."""
+    tenant = tenant_of(application)
+    if deliver_pending: application.create_task(deliver_pending_notifications(application.bot, outbound_limiter, tenant=tenant.name))
+    if 0 <= DIGEST_HOUR <= 23: application.create_task(digest_schedule(application, shard, shards))
+    application.create_task(expire_checkout_sessions(application, shard, shards))
+    # Zálohy jsou jedny za celý proces (DB je společná), spouští je jen primární bot
+    if BACKUP_INTERVAL_HOURS > 0 and tenant.primary: application.create_task(periodic_backups())
+
+def load_catalogue_calls(tenant_name: str) -> tuple[list, list]:
+    """Katalog aktivních výzev a jejich detaily (běží ve vlákně přes db_pool)."""
+    calls = get_active_calls(tenant_name)
+    return calls, [details for call in calls if (details := get_call_details(call['call_id']))]
+
+def warm_db_thread() -> None:
+    """Rozběhne vlákno poolu a načte schéma DB (první dotaz v novém vlákně je nejpomalejší)."""
+    get_call_details(0)
+
+async def prewarm(application: Application) -> None:
+    """Před přijímáním updatů souběžně naplní cache a otevře spojení.
+
+    Katalog aktivních výzev a jejich zkompilované šablony (cache šablon),
+    vlákna db_poolu a PREWARM_HTTP_CONNECTIONS spojení s Bot API - první
+    nápor po restartu tak nenarazí na studené cache.
+    """
+    tenant = tenant_of(application)
+    results = await asyncio.gather(
+        db_pool.run(load_catalogue_calls, tenant.name),
+        *(db_pool.run(warm_db_thread) for _ in range(db_pool.max_workers - 1)),
+        *(application.bot.get_me() for _ in range(PREWARM_HTTP_CONNECTIONS - 1)),  # Jedno spojení otevřel initialize()
+        return_exceptions=True,
+    )
+    failures = [result for result in results if isinstance(result, Exception)]
+    if failures: logger.warning(f"Předehřátí bota {tenant.name}: {len(failures)} kroků selhalo ({failures[0]!r}).")
+    if not isinstance(results[0], Exception):
+        calls, details = results[0]
+        call_templates.set_catalogue(tenant.name, calls)
+        for call in details: call_templates.put(call)
+        logger.info(f"Předehřátí bota {tenant.name}: {len(calls)} aktivních výzev, {len(details)} šablon.")
+
+async def activate(application: Application, deliver_pending: bool = True, shard: int = 0, shards: int = 1) -> None:
+    """Převzetí provozu: načte okno zpracovaných updatů, obnoví nákupy předané předchozí instancí
+    a spustí úlohy na pozadí.
+
+    Okno se načítá až tady - záloha čekající na lease by jinak měla stav z doby svého startu.
+    V režimu více procesů si každý worker vezme jen nákupy svých uživatelů (`shard` z `shards`).
+    """
+    tenant = tenant_of(application)
+    await db_pool.run(tenant.update_tracker.load)
+    saved = await db_pool.run(take_checkout_sessions, tenant.name, shard, shards)
+    if saved: logger.info(f"Bot {tenant.name}: převzato {tenant.sessions.restore(saved)} z {len(saved)} rozpracovaných nákupů.")
+    start_background_tasks(application, deliver_pending, shard, shards)
+
+async def post_init(application: Application) -> None:
+    """Po startu předehřeje cache, počká na lease (záloha), potvrdí zpracované updaty a převezme provoz."""
+    startup_timer.mark("initialize")
+    await prewarm(application)
+    startup_timer.mark("předehřátí")
+    await handoff.acquire()  # Záloha tu čeká, až aktivní instance uvolní polling
+    startup_timer.mark("lease")
+    await asyncio.gather(tenant_of(application).update_tracker.acknowledge_processed(application.bot), activate(application))
+    logger.info(f"Bot {tenant_of(application).name} připraven za {startup_timer.report()}")
+
+async def flush_sessions(applications: list[Application]) -> None:
+    """Uloží živé rozpracované nákupy do DB, aby na ně navázala další instance."""
+    for application in applications:
+        tenant = tenant_of(application)
+        sessions = tenant.sessions.export()
+        if sessions and await db_pool.run(save_checkout_sessions, sessions, tenant.name):
+            logger.info(f"Bot {tenant.name}: uloženo {len(sessions)} rozpracovaných nákupů pro další instanci.")
+
+async def drain(applications: list[Application], timeout: float = DRAIN_TIMEOUT) -> None:
+    """Dokončí rozpracovanou práci (polling už stojí): rozesílku, updaty ve frontě, handlery a úlohy.
+
+    Co nedoběhne do `timeout`, se zruší; nakonec se uloží rozpracované nákupy.
+    """
+    started = time.perf_counter()
+    running = [application for application in applications if application.running]
+    try:
+        await asyncio.wait_for(asyncio.gather(stop_delivery(), *(application.stop() for application in running)), timeout)
+        logger.info(f"Drain: rozpracovaná práce dokončena za {(time.perf_counter() - started) * 1000:.0f} ms.")
+    except TimeoutError:
+        logger.warning(f"Drain: práce nedoběhla do {timeout:.0f} s, zbytek se ruší.")
+    await flush_sessions(applications)
+
+def build_application(tenant: Tenant, base_url: str | None = None) -> Application:
+    """Sestaví Application jednoho bota s jeho tenantem a všemi handlery (sdílí main() i replay.py)."""
+    builder = transport.configure(Application.builder().token(tenant.token).post_init(post_init))
+    if base_url: builder = builder.base_url(base_url)
+    application = builder.build()
+    application.bot_data[TENANT_KEY] = tenant
+    if TRAFFIC_RECORD_FILE:
+        # Záznam provozu pro replay (anonymizovaný), jako úplně první handler; každý bot do svého souboru
+        from traffic_recorder import TrafficRecorder
+        path = TRAFFIC_RECORD_FILE if tenant.name == DEFAULT_TENANT else f"{TRAFFIC_RECORD_FILE}.{tenant.name}"
+        TrafficRecorder(path, admin_ids=tenant.admin_ids, salt=TRAFFIC_RECORD_SALT).register(application)
+    tenant.flood_guard.register(application)  # Jako úplně první - zahazuje nadlimitní události
+    tenant.update_tracker.register(application)  # Deduplikace před a záznam po ostatních handlerech
+    register_handlers(application)
+    return application
+
+async def run_fleet(applications: list[Application]) -> None:
+    """Běh botů v jednom event loopu s řízeným ukončením a předáním (viz lifecycle.py).
+
+    Místo run_polling (zvládne jen jednu Application a na handlery při ukončení čeká bez limitu).
+    """
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, handoff.request_stop)
+    started = []
+    try:
+        for application in applications:
+            await application.initialize()
+            await post_init(application)  # Stejné pořadí jako run_polling (nekonečné úlohy z post_init stop nečeká)
+            await application.start()
+            await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+            started.append(application)
+            logger.info(f"Bot {tenant_of(application).name} (@{application.bot.username}) běží.")
+        await handoff.stop_requested.wait()
+    except StopRequested:
+        logger.info("Ukončeno dřív, než instance převzala provoz.")
+    finally:
+        logger.info("Zastavuji boty...")
+        # Nejdřív polling (potvrdí stažené updaty), pak dozpracování, nakonec předání zálohy
+        for application in started:
+            await application.updater.stop()
+        await drain(started)
+        await handoff.release()
+        for application in reversed(applications):
+            await application.shutdown()
+
 def main() -> None:
-    """Spustí bota."""
+    """Spustí bota (nebo všechny boty z BOTS)."""
+    startup_timer.mark("importy")
     try: init_db()
     except Exception as e: logger.critical(f"Kritická chyba DB: {e}. Bot stop."); return
+    startup_timer.mark("init_db")
+    if WORKER_PROCESSES > 1:
+        # Supervisor jen stahuje updaty a zapisuje do DB, handlery běží ve workerech
+        import workers
+        logger.info(f"Spouštím supervisor s {WORKER_PROCESSES} workery...")
+        asyncio.run(workers.run_supervisor(BOT_CONFIGS, WORKER_PROCESSES))
+        return
+    tenants = [Tenant(config['tenant'], config['token'], config['admin_ids'], primary=index == 0) for index, config in enumerate(BOT_CONFIGS)]
+    applications = [build_application(tenant) for tenant in tenants]
+    startup_timer.mark("sestavení")
 
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    logger.info(f"Spouštím {len(applications)} bot(ů) v jednom procesu (polling)...")
+    asyncio.run(run_fleet(applications))
 
+def register_handlers(application: Application) -> None:
+    """Zaregistruje handlery bota (guardy tenantu přidává build_application)."""
     # ConversationHandler pro sběr dat účasti
     participation_conv_handler = ConversationHandler(
-        entry_points=[CallbackQueryHandler(handle_call_selection, pattern="^call_")],
+        # block=False: ConversationHandler počká na výsledek úlohy, ostatní updaty mezitím běží dál;
+        # finishes_update: update je zpracovaný až po doběhnutí úlohy, ne po skupině handlerů
+        entry_points=[
+            CallbackQueryHandler(finishes_update(handle_call_selection), pattern="^call_", block=False),
+            # /start s payloadem z odkazu na výzvu; samotné /start obslouží běžný handler níže
+            CommandHandler("start", start_deep_link, has_args=True),
+            CallbackQueryHandler(finishes_update(handle_deep_link_consent), pattern=f"^{bot_logic.DEEPLINK_CALLBACK_PREFIX}", block=False),
+        ],
         states={ PROCESSING_DATA: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_data_input)], },
         fallbacks=[CommandHandler("cancel", cancel_all_conversations)], name="call_data_collection",
+        # Bez JobQueue timeout nefunguje - stav pak ukončí až další zpráva (session už bude pryč)
+        conversation_timeout=SESSION_TTL_SECONDS if application.job_queue else None,
     )
 
     # ConversationHandler pro přidání výzvy adminem
     add_call_conv_handler = ConversationHandler(
         entry_points=[CommandHandler("addcall", add_call_start)],
         states={
-            GET_CALL_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_call_name)],
-            GET_CALL_DESC: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_call_desc), CommandHandler("skip", skip_optional)],
-            GET_CALL_ORIG_PRICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_call_orig_price), CommandHandler("skip", skip_optional)],
-            GET_CALL_DEAL_PRICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_call_deal_price)],
-            GET_CALL_DATA_NEEDED: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_call_data_needed), CommandHandler("skip", skip_optional)],
-            GET_CALL_FINAL_INST: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_call_final_inst)],
-            CONFIRM_ADD_CALL: [MessageHandler(filters.Regex("^(Ano, uložit výzvu ✅|Ne, zrušit)$"), confirm_add_call)],
+            GET_CALL_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_call_input)],
+            GET_CALL_DESC: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_call_input), CommandHandler("skip", skip_optional)],
+            GET_CALL_ORIG_PRICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_call_input), CommandHandler("skip", skip_optional)],
+            GET_CALL_DEAL_PRICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_call_input)],
+            GET_CALL_CAPACITY: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_call_input), CommandHandler("skip", skip_optional)],
+            GET_CALL_DATA_NEEDED: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_call_input), CommandHandler("skip", skip_optional)],
+            GET_CALL_FINAL_INST: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_call_input)],
+            CONFIRM_ADD_CALL: [MessageHandler(filters.Regex(f"^({bot_logic.CONFIRM_SAVE_CALL}|{bot_logic.CONFIRM_DISCARD_CALL})$"), confirm_add_call)],
         },
         fallbacks=[CommandHandler("cancel", cancel_all_conversations)],
         name="add_call_flow",
@@ -346,30 +1019,32 @@ def main() -> None:
     application.add_handler(add_call_conv_handler)
 
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("cancel", cancel_all_conversations))  # I mimo konverzaci (převzatý nákup)
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("vyzvy", list_calls))
     application.add_handler(CommandHandler("zrusit_ucast", cancel_participation_start))
     application.add_handler(CommandHandler("moje_ucasti", my_participations_command))
+    application.add_handler(CommandHandler("souhrn", digest_command))
     application.add_handler(CommandHandler("test", test_command))
     # !! PŘIDÁNO ZDE !!
     application.add_handler(CommandHandler("listcalls_admin", list_all_calls_admin))
+    application.add_handler(CommandHandler("closecall", close_call_admin))
+    application.add_handler(CommandHandler("archivecalls", archive_calls_admin))
+    application.add_handler(CommandHandler("confirmcall", confirm_call_admin))
+    application.add_handler(CommandHandler("deeplink", deep_link_admin))
+    application.add_handler(CommandHandler("audience", audience_admin))
+    application.add_handler(CommandHandler("announce", announce_admin))
+    application.add_handler(CommandHandler("backup", backup_admin, block=False))  # Neblokuje ostatní updaty
+    application.add_handler(CommandHandler("stats", stats_admin))
+    application.add_handler(CommandHandler("profile", profile_admin, block=False))  # Měření běží, zatímco bot obsluhuje updaty
+    application.add_handler(CommandHandler("memsnap", memsnap_admin))
+    application.add_handler(CommandHandler("tasks", tasks_admin))
 
-    application.add_handler(MessageHandler(filters.Regex("^(Ano, souhlasím 👍|Ne, děkuji)$"), handle_consent_response))
-    application.add_handler(CallbackQueryHandler(handle_cancel_selection, pattern="^cancel_"))
+    application.add_handler(MessageHandler(filters.Regex(f"^({bot_logic.CONSENT_YES}|{bot_logic.CONSENT_NO})$"), handle_consent_response))
+    application.add_handler(CallbackQueryHandler(finishes_update(handle_cancel_selection), pattern="^cancel_", block=False))
+    application.add_handler(CallbackQueryHandler(handle_digest_choice, pattern=f"^{bot_logic.DIGEST_CHOICE_PREFIX}"))
+    application.add_handler(CallbackQueryHandler(finishes_update(handle_digest_page), pattern=f"^{bot_logic.DIGEST_CALLBACK_PREFIX}", block=False))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_unknown_message))
 
-    logger.info("Spouštím bota (polling)...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
-
 if __name__ == "__main__":
     main()
-```
-
-**Co bylo přidáno/změněno:**
-
-1.  **Import:** Přidán `get_all_calls` do importů z `database.py`.
-2.  **Nová funkce:** `async def list_all_calls_admin(...)` byla přidána. Ověřuje admin práva, volá `get_all_calls`, formátuje výstup (používá zpětné apostrofy ` pro monospace ID a status) a odesílá ho adminovi (snaží se použít MarkdownV2, ale má fallback na prostý text).
-3.  **Registrace handleru:** V `main()` byl přidán řádek `application.add_handler(CommandHandler("listcalls_admin", list_all_calls_admin))` pro zaregistrování nového příkazu.
-4.  **Nápověda:** Text v `help_command` byl aktualizován, aby zahrnoval nový příkaz `/listcalls_admin`.
-
-Nyní můžete tento kód nahrát a otestov
@@ -1,343 +1,555 @@
-# bot.py
+# bot_logic.py
 # -*- coding: utf-8 -*-
+"""Jádro bota nezávislé na Telegramu.
+
+Funkce zde nepracují s Telegram objekty ani s databází - dostanou prostá data
+(řádky výzev/účastí jako slovníky nebo sqlite3.Row, text zprávy, user_data)
+a vrátí výsledek ve tvaru slovníku, který handlery v bot.py jen provedou:
+
+- 'status': 'ok' | 'info' | 'error' (+ specifické stavy jednotlivých kroků)
+- 'message': text odpovědi, 'markdown': zda poslat s ParseMode.MARKDOWN
+- 'next_state': další stav konverzace (END ukončí konverzaci)
+- 'user_data_updates': klíče k nastavení v context.user_data
+- 'clear_keys': klíče k odstranění z context.user_data
+- 'save_participation': {'status': ..., 'collected_data': ...} k uložení do DB
+  (+ 'quantity' = počet kusů k rezervaci u výzvy s kapacitou)
+- 'reply_keyboard' / 'remove_keyboard': odpovědní klávesnice
+"""
+import datetime
 import logging
-import json
 import re
-from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardRemove
-from telegram.ext import (
-    Application, CommandHandler, MessageHandler, filters, ContextTypes,
-    CallbackQueryHandler, ConversationHandler
-)
-from telegram.constants import ParseMode
-
-# --- Importy ---
-from config import TELEGRAM_TOKEN, ADMIN_IDS
-from database import (
-    init_db, get_db_connection, get_active_calls, get_call_details,
-    update_user_consent, add_or_update_user, add_or_update_participation,
-    get_participation, get_user_active_participations, add_new_call,
-    get_all_calls # <-- Přidán nový import
-)
-import bot_logic
-
-# --- Logging ---
-logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
-logging.getLogger("httpx").setLevel(logging.WARNING)
+
+from templates import CompiledTemplate, allowed_placeholders, validate_template
+
 logger = logging.getLogger(__name__)
 
 # --- Stavy konverzace ---
+END = -1  # Odpovídá ConversationHandler.END
 ASKING_DATA, PROCESSING_DATA = range(2)
-GET_CALL_NAME, GET_CALL_DESC, GET_CALL_ORIG_PRICE, GET_CALL_DEAL_PRICE, \
-GET_CALL_DATA_NEEDED, GET_CALL_FINAL_INST, CONFIRM_ADD_CALL = range(7)
-
-# --- Administrátorský check ---
-def is_admin(user_id: int) -> bool:
-    return user_id in ADMIN_IDS
-
-# --- Běžné Handlery ---
-# (Funkce start, help_command, handle_consent_response, list_calls zůstávají stejné)
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user = update.effective_user; user_id = user.id; first_name = user.first_name or "Uživateli"; username = user.username; last_name = user.last_name; logger.info(f"User {user_id} ({username or 'bez @'}) spustil /start.")
-    if not add_or_update_user(user_id, first_name, last_name, username): await update.message.reply_text("Omlouvám se, nastala interní chyba."); return ConversationHandler.END
-    welcome_message = (f"Ahoj {first_name}! Vítej v DealUpBotu.\n\n" + "Pomáhám lidem spojit se pro kolektivní nákupy ('Výzvy') a získat tak lepší ceny.\n\n" + "Než začneme, potřebuji tvůj **souhlas se zpracováním údajů** (Telegram ID, jméno) " + "a **zasíláním nabídek** ('Výzev'). Souhlasíš?")
-    reply_keyboard = [[KeyboardButton("Ano, souhlasím 👍")], [KeyboardButton("Ne, děkuji")]]; markup = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True, one_time_keyboard=True)
-    await update.message.reply_text(welcome_message, reply_markup=markup, parse_mode=ParseMode.MARKDOWN); return ConversationHandler.END
-
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    help_text = ("Jsem DealUpBot a pomohu ti s kolektivními nákupy ('Výzvami').\n\n" + "Základní příkazy:\n" + "/start - Úvod a udělení souhlasu.\n" + "/vyzvy - Zobrazí aktuální aktivní Výzvy.\n" + "/zrusit_ucast - Umožní zrušit tvou účast v aktivní Výzvě.\n" + "/moje_ucasti - Zobrazí tvé aktivní účasti.\n" + "/help - Zobrazí tuto nápovědu.\n" + "/cancel - Zruší aktuálně probíhající akci.\n\n" + "**Admin příkazy:**\n" + "/addcall - Spustí proces přidání nové výzvy.\n" + "/listcalls_admin - Vypíše všechny výzvy v DB.\n") # Přidán nový příkaz
-    await update.message.reply_text(help_text)
-
-async def handle_consent_response(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    user_id = update.effective_user.id; response = update.message.text; logger.info(f"User {user_id} odpověděl na souhlas: {response}")
-    new_consent_status = 'pending'; reply_text = ""; show_calls_after = False
-    if "Ano, souhlasím" in response: new_consent_status = 'granted'; reply_text = "Děkuji za souhlas! 🎉"; show_calls_after = True
-    elif "Ne, děkuji" in response: new_consent_status = 'denied'; reply_text = "Rozumím. Nebudu ti zasílat nabídky."
-    if update_user_consent(user_id, new_consent_status): await update.message.reply_text(reply_text, reply_markup=ReplyKeyboardRemove()); await list_calls(update, context) if show_calls_after else None
-    else: await update.message.reply_text("Chyba při ukládání volby.", reply_markup=ReplyKeyboardRemove())
-
-async def list_calls(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    user_id = update.effective_user.id; chat_id = update.effective_chat.id; logger.info(f"User {user_id} spouští zobrazení výzev.")
-    active_calls = get_active_calls(); message_text = bot_logic.format_calls_list_message(active_calls)
-    keyboard = []; reply_markup = None
-    if active_calls:
-        for call in active_calls:
-            try: button = InlineKeyboardButton(f"Mám zájem: {call['name']} ({call['deal_price']} Kč)", callback_data=f"call_{call['call_id']}"); keyboard.append([button])
-            except Exception as e: logger.error(f"Chyba tvorby tlačítka pro list_calls: {e}")
-        if keyboard: reply_markup = InlineKeyboardMarkup(keyboard)
-    try: await context.bot.send_message(chat_id=chat_id, text=message_text, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
-    except Exception as e: logger.warning(f"Nepodařilo se poslat list_calls s Markdown: {e}. Posílám plain text."); plain_text = message_text.replace('*','').replace('~','').replace(r'\.','.'); await context.bot.send_message(chat_id=chat_id, text=plain_text, reply_markup=reply_markup)
-
-# --- ConversationHandler pro sběr dat (ÚČAST) ---
-# (Funkce handle_call_selection, ask_next_data, process_data_input zůstávají stejné)
-async def handle_call_selection(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int | None:
-    query = update.callback_query; await query.answer(); callback_data = query.data; user = update.effective_user; user_id = user.id; first_name = user.first_name or "Uživateli"; logger.info(f"HANDLER: User {user_id} stiskl tlačítko: {callback_data}")
-    if not callback_data.startswith("call_"): logger.warning(f"HANDLER: User {user_id} poslal neočekávaný callback (ne call_): {callback_data}"); return None
-    next_state = ConversationHandler.END
+GET_CALL_NAME, GET_CALL_DESC, GET_CALL_ORIG_PRICE, GET_CALL_DEAL_PRICE, GET_CALL_CAPACITY, \
+GET_CALL_DATA_NEEDED, GET_CALL_FINAL_INST, CONFIRM_ADD_CALL = range(8)
+
+# Aktuální krok průvodce /addcall (ConversationHandler svůj stav do user_data neukládá)
+WIZARD_STATE_KEY = 'add_call_state'
+WIZARD_KEYS = ('new_call_data', WIZARD_STATE_KEY)
+
+# Klíče user_data, které patří rozpracovanému sběru údajů
+CONVERSATION_KEYS = ('data_needed_list', 'data_needed_index', 'collected_data_so_far')
+
+QUANTITY_KEY = "počet kusů"  # Údaj, podle kterého se u výzvy s kapacitou rezervují kusy
+
+DATA_QUESTIONS = {
+    "adresa doručení": "Prosím, zadej **adresu doručení** (ulice, č.p., město, PSČ):",
+    "telefonní číslo": "Prosím, zadej své **telefonní číslo**:",
+    "počet kusů": "Prosím, zadej požadovaný **počet kusů**:",
+    "email": "Prosím, zadej svou **emailovou adresu**:",
+}
+
+STATUS_TRANSLATION = {'interested': 'Projeven zájem', 'data_collected': 'Údaje poskytnuty', 'confirmed': 'Potvrzeno'}
+
+SAVE_ERROR_MESSAGE = "Chyba při ukládání údajů."
+SOLD_OUT_MESSAGE = "Bohužel, tato Výzva je už vyprodaná. 😔 Další najdeš v /vyzvy."
+CHECKOUT_EXPIRED_MESSAGE = "Tvůj rozpracovaný nákup vypršel. Pokud máš stále zájem, vyber Výzvu znovu přes /vyzvy."
+DEFAULT_INSTRUCTIONS = "Další instrukce brzy."
+
+CONSENT_YES = "Ano, souhlasím 👍"
+CONSENT_NO = "Ne, děkuji"
+CONFIRM_SAVE_CALL = "Ano, uložit výzvu ✅"
+CONFIRM_DISCARD_CALL = "Ne, zrušit"
+DEEPLINK_CALLBACK_PREFIX = "dl_"  # Souhlas z deep-linku: dl_<podepsaný payload>
+DEEPLINK_DECLINE = "dl_no"
+DIGEST_CALLBACK_PREFIX = "digest_"  # Stránka souhrnu: digest_<since>_<cutoff>_<stránka>
+DIGEST_CHOICE_PREFIX = "souhrn_"  # Volba odběru: souhrn_daily / souhrn_weekly / souhrn_off
+DIGEST_PERIODS = {'daily': "denně", 'weekly': "jednou týdně"}
+DIGEST_ARGS = {'denne': 'daily', 'tydne': 'weekly', 'vypnout': 'off'}  # /souhrn <volba>
+
+_EMAIL_RE = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+_PHONE_RE = re.compile(r'^\+?\d{9,15}$')
+_PHONE_CLEANUP_RE = re.compile(r'[\s()-]+')
+
+
+# --- Úvod a souhlas ---
+def format_welcome_message(first_name: str) -> str:
+    """Uvítací zpráva pro /start s žádostí o souhlas."""
+    return (f"Ahoj {first_name}! Vítej v DealUpBotu.\n\n" + "Pomáhám lidem spojit se pro kolektivní nákupy ('Výzvy') a získat tak lepší ceny.\n\n" + "Než začneme, potřebuji tvůj **souhlas se zpracováním údajů** (Telegram ID, jméno) " + "a **zasíláním nabídek** ('Výzev'). Souhlasíš?")
+
+
+def process_consent_response(response: str) -> dict:
+    """Vyhodnotí odpověď na žádost o souhlas."""
+    if "Ano, souhlasím" in response:
+        return {'status': 'ok', 'consent_status': 'granted', 'message': "Děkuji za souhlas! 🎉", 'show_calls': True}
+    if CONSENT_NO in response:
+        return {'status': 'ok', 'consent_status': 'denied', 'message': "Rozumím. Nebudu ti zasílat nabídky.", 'show_calls': False}
+    return {'status': 'ok', 'consent_status': 'pending', 'message': "", 'show_calls': False}
+
+
+def format_deep_link_welcome(first_name: str, call) -> str:
+    """Uvítání pro /start z odkazu na výzvu: souhlas a vstup do výzvy v jednom kroku."""
+    return (f"Ahoj {first_name}! Vítej v DealUpBotu.\n\n" + f"Přicházíš kvůli Výzvě **{call['name']}** za **{call['deal_price']} Kč**.\n\n"
+            + "Abych tě mohl/a přihlásit, potřebuji tvůj **souhlas se zpracováním údajů** (Telegram ID, jméno) " + "a **zasíláním nabídek** ('Výzev'). Souhlasíš?")
+
+
+def build_deep_link_buttons(payload: str) -> list[tuple[str, str]]:
+    """Tlačítka souhlasu pro deep-link; kladná odpověď nese podepsaný payload výzvy."""
+    return [(f"{CONSENT_YES} a chci se přidat", f"{DEEPLINK_CALLBACK_PREFIX}{payload}"), (CONSENT_NO, DEEPLINK_DECLINE)]
+
+
+def process_deep_link_consent(callback_data: str) -> dict:
+    """Vyhodnotí stisk tlačítka souhlasu z deep-linku (payload ověřuje volající)."""
+    if callback_data == DEEPLINK_DECLINE:
+        return {'status': 'ok', 'consent_status': 'denied', 'message': "Rozumím. Nebudu ti zasílat nabídky.", 'payload': None}
+    return {'status': 'ok', 'consent_status': 'granted', 'message': "Děkuji za souhlas! 🎉", 'payload': callback_data[len(DEEPLINK_CALLBACK_PREFIX):]}
+
+
+# --- Katalog výzev ---
+def format_calls_list_message(active_calls) -> str:
+    """Sestaví text (Markdown) se seznamem aktivních výzev."""
+    if not active_calls:
+        return "Momentálně nejsou k dispozici žádné aktivní Výzvy. Zkus to později."
+    return "\n".join(["*Aktuální Výzvy:*"] + _format_call_lines(active_calls))
+
+
+def _format_call_lines(calls) -> list[str]:
+    """Řádky (Markdown) s názvem, popisem a cenou výzev - katalog i souhrn."""
+    parts = []
+    for call in calls:
+        parts.append(f"\n*{call['name']}*")
+        if call['description']:
+            parts.append(call['description'])
+        if call['original_price']:
+            parts.append(f"Cena: ~{call['original_price']} Kč~ → *{call['deal_price']} Kč*")
+        else:
+            parts.append(f"Cena: *{call['deal_price']} Kč*")
+    return parts
+
+
+def format_call_announcement(call, link: str) -> str:
+    """Prostý text oznámení výzvy pro cílovou skupinu (/announce) s odkazem do výzvy."""
+    price = f"{call['original_price']} Kč → {call['deal_price']} Kč" if call['original_price'] else f"{call['deal_price']} Kč"
+    parts = [f"Nová Výzva: {call['name']}"]
+    if call['description']:
+        parts.append(call['description'])
+    parts += [f"Cena: {price}", "", f"Přidat se můžeš tady: {link}"]
+    return "\n".join(parts)
+
+
+def build_calls_buttons(active_calls) -> list[tuple[str, str]]:
+    """Vrátí dvojice (text tlačítka, callback_data) pro katalog výzev."""
+    return [(f"Mám zájem: {call['name']} ({call['deal_price']} Kč)", f"call_{call['call_id']}") for call in active_calls or []]
+
+
+def parse_callback_id(callback_data: str, prefix: str) -> int | None:
+    """Z callback_data typu '<prefix>_<id>' vrátí ID, nebo None při neplatném formátu."""
+    if not callback_data.startswith(f"{prefix}_"):
+        return None
+    value = callback_data[len(prefix) + 1:]
+    return int(value) if value.isdigit() else None
+
+
+# --- Výběr výzvy a sběr údajů ---
+def parse_data_needed(data_needed: str | None) -> list[str]:
+    """Rozdělí čárkou oddělený seznam potřebných údajů."""
+    if not data_needed:
+        return []
+    return [item.strip() for item in data_needed.split(",") if item.strip()]
+
+
+def render_final_instructions(call, user_id: int, first_name: str, collected_data: dict, compiled: CompiledTemplate | None = None) -> str:
+    """Doplní do final_instructions výzvy údaje uživatele; při chybě vrátí šablonu beze změny.
+
+    S předkompilovanou šablonou (`compiled`) se text jen poskládá, bez dalšího parsování.
+    """
+    call_id = call['call_id']
+    instruction_template = call['final_instructions'] or DEFAULT_INSTRUCTIONS
+    format_data = {"user_first_name": first_name, "user_id": user_id, "call_name": call['name'] or f"Výzva ID {call_id}", "deal_price": call['deal_price'], "call_id": call_id}
+    format_data.update(collected_data)
+    if compiled is not None:
+        try:
+            return compiled.render(format_data)
+        except (KeyError, ValueError, TypeError) as e:
+            logger.error(f"Chyba vykreslení šablony pro call {call_id}: {e}")
+            return instruction_template
     try:
-        call_id = int(callback_data.split("_")[1]); result = bot_logic.process_call_selection(user_id, call_id, first_name)
-        if result['status'] == 'error' or result['status'] == 'info': await query.edit_message_text(text=result['message'], reply_markup=None)
-        elif result['status'] == 'ok':
-            final_message = result['message']; state_code = result.get('next_state'); use_markdown = (state_code == ASKING_DATA)
-            await query.edit_message_text(text=final_message, reply_markup=None, parse_mode=ParseMode.MARKDOWN if use_markdown else None)
-            if 'user_data_updates' in result: context.user_data.update(result['user_data_updates'])
-            if state_code == ASKING_DATA: return await ask_next_data(update, context)
-            else: next_state = ConversationHandler.END;
-                  for key in list(context.user_data.keys()):
-                      if key.startswith('current_') or key in ['data_needed_list', 'data_needed_index', 'collected_data_so_far']: context.user_data.pop(key, None)
-        else: logger.error(f"Neznámý status '{result.get('status')}' vrácen z process_call_selection."); await query.edit_message_text("Nastala neočekávaná chyba.")
-        return next_state
-    except (IndexError, ValueError) as e: logger.error(f"HANDLER: Neplatný formát call_ callback_data: {callback_data} pro user {user_id}. Chyba: {e}"); await context.bot.send_message(chat_id=query.message.chat_id, text="Chyba při zpracování volby."); return ConversationHandler.END
-    except Exception as e: logger.error(f"HANDLER: Neočekávaná chyba při handle_call_selection {callback_data} pro user {user_id}: {e}");
-                         try: await context.bot.send_message(chat_id=query.message.chat_id, text="Neočekávaná chyba při zpracování vaší volby.")
-                         except Exception as send_e: logger.error(f"HANDLER: Nepodařilo se odeslat ani chybovou zprávu uživateli {user_id}: {send_e}")
-                         return ConversationHandler.END
-
-async def ask_next_data(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user_data = context.user_data; needed_list = user_data.get('data_needed_list', []); current_index = user_data.get('data_needed_index', 0)
-    chat_id = update.effective_chat.id if update.effective_chat else (update.callback_query.message.chat_id if update.callback_query else None)
-    if not chat_id: logger.error("Nemohu získat chat_id v ask_next_data"); return ConversationHandler.END
-    if current_index >= len(needed_list):
-        user = update.effective_user; user_id = user.id; first_name = user.first_name or "Uživateli"; call_id = user_data.get('current_call_id'); logger.info(f"User {user_id}: Všechna data pro call {call_id} shromážděna."); collected_data = user_data.get('collected_data_so_far', {})
-        call_details = get_call_details(call_id); instruction_template = "Další instrukce brzy."; call_name = f"Výzva ID {call_id}"; deal_price = "N/A"
-        if call_details:
-            try: call_name = call_details['name'] or call_name; except IndexError: pass
-            try: deal_price = call_details['deal_price']; except IndexError: pass
-            try: instruction_template = call_details['final_instructions'] or instruction_template; except IndexError: logger.warning(f"Chybí 'final_instructions' pro call {call_id}.")
-        if add_or_update_participation(user_id=user_id, call_id=call_id, status='data_collected', collected_data=collected_data):
-            format_data = {"user_first_name": first_name, "user_id": user_id, "call_name": call_name, "deal_price": deal_price, "call_id": call_id}; format_data.update(collected_data)
-            try: formatted_instructions = instruction_template.format(**format_data)
-            except Exception as e: logger.error(f"Chyba formátování final_instructions: {e}"); formatted_instructions = instruction_template
-            confirmation_message = "Děkuji! Všechny potřebné údaje byly zaznamenány.\n\n**Shrnutí:**\n";
-            for key, value in collected_data.items(): confirmation_message += f"- {key.replace('_', ' ').capitalize()}: {value}\n"
-            confirmation_message += f"\n**Další kroky:**\n{formatted_instructions}"
-            try: await context.bot.send_message(chat_id=chat_id, text=confirmation_message, parse_mode=ParseMode.MARKDOWN)
-            except Exception as md_error: logger.warning(f"Nepodařilo se poslat final confirmation s Markdown: {md_error}. Posílám jako prostý text."); plain_text = confirmation_message.replace('**',''); await context.bot.send_message(chat_id=chat_id, text=plain_text)
-        else: await context.bot.send_message(chat_id=chat_id, text="Chyba při ukládání údajů.")
-        for key in list(user_data.keys()):
-            if key.startswith('current_') or key in ['data_needed_list', 'data_needed_index', 'collected_data_so_far']: user_data.pop(key, None)
-        return ConversationHandler.END
+        return instruction_template.format(**format_data)
+    except (KeyError, IndexError, ValueError, AttributeError) as e:
+        logger.error(f"Chyba formátování final_instructions pro call {call_id}: {e}")
+        return instruction_template
+
+
+def _requested_quantity(collected_data: dict) -> int:
+    """Počet kusů z vyplněných údajů (klíč bez ohledu na velikost písmen), jinak 1."""
+    for key, value in collected_data.items():
+        if key.lower() == QUANTITY_KEY:
+            return value
+    return 1
+
+
+def complete_data_collection(call, user_id: int, first_name: str, collected_data: dict, compiled: CompiledTemplate | None = None) -> dict:
+    """Závěr sběru údajů: uložení účasti a shrnutí s finálními instrukcemi.
+
+    U výzvy s kapacitou se rezervace znovu potvrdí (beze změny počtu se sklad nehne).
+    """
+    formatted_instructions = render_final_instructions(call, user_id, first_name, collected_data, compiled)
+    if collected_data:
+        confirmation_message = "Děkuji! Všechny potřebné údaje byly zaznamenány.\n\n**Shrnutí:**\n"
+        for key, value in collected_data.items():
+            confirmation_message += f"- {key.replace('_', ' ').capitalize()}: {value}\n"
     else:
-        data_key = needed_list[current_index].strip(); user_data['current_data_key'] = data_key
-        questions = {"adresa doručení": "Prosím, zadej **adresu doručení** (ulice, č.p., město, PSČ):", "telefonní číslo": "Prosím, zadej své **telefonní číslo**:", "počet kusů": "Prosím, zadej požadovaný **počet kusů**:", "email": "Prosím, zadej svou **emailovou adresu**:",}
-        question_text = questions.get(data_key.lower(), f"Prosím, zadej údaj pro: **{data_key}**")
-        await context.bot.send_message(chat_id=chat_id, text=question_text, parse_mode=ParseMode.MARKDOWN)
-        return PROCESSING_DATA
-
-async def process_data_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user_data = context.user_data; user_input = update.message.text; user_id = update.effective_user.id; current_key = user_data.get('current_data_key')
-    if not current_key: logger.warning(f"User {user_id} poslal '{user_input}', ale nečekal se údaj."); return PROCESSING_DATA
-    logger.info(f"User {user_id} zadal údaj '{user_input}' pro '{current_key}'")
-    is_valid = True; error_message = ""; processed_input = user_input.strip(); key_lower = current_key.lower()
-    if key_lower == 'počet kusů':
-        if not processed_input.isdigit() or int(processed_input) <= 0: is_valid = False; error_message = "Toto není kladné číslo. Zadej počet kusů (např. 1):"
-        else: processed_input = int(processed_input)
-    elif key_lower == 'email':
-        if not re.match(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$', processed_input): is_valid = False; error_message = "Toto není platný email. Zadej ho znovu (např. jmeno@domena.cz):"
+        # Výzva nepotřebuje žádné údaje - stačil projevený zájem
+        confirmation_message = f"Skvělé, tvůj zájem o **{call['name']}** je zaznamenán.\n"
+    confirmation_message += f"\n**Další kroky:**\n{formatted_instructions}"
+    to_save = {'status': 'data_collected', 'collected_data': collected_data}
+    if call['capacity'] is not None:
+        to_save['quantity'] = _requested_quantity(collected_data)
+    return {
+        'status': 'ok',
+        'message': confirmation_message,
+        'markdown': True,
+        'next_state': END,
+        'save_participation': to_save,
+        'error_message': SAVE_ERROR_MESSAGE,
+        'clear_conversation': True,
+    }
+
+
+def process_call_selection(call, participation, user_id: int, first_name: str, compiled: CompiledTemplate | None = None) -> dict:
+    """Vyhodnotí stisk tlačítka 'Mám zájem' pro danou výzvu.
+
+    `call` je řádek výzvy (nebo None), `participation` dosavadní účast uživatele (nebo None),
+    `compiled` případná předkompilovaná šablona final_instructions.
+    """
+    if call is None:
+        return {'status': 'error', 'message': "Tato výzva nebyla nalezena."}
+    if call['status'] != 'active':
+        return {'status': 'info', 'message': f"Výzva '{call['name']}' už není aktivní."}
+    if participation and participation['status'] in ('data_collected', 'confirmed'):
+        return {'status': 'info', 'message': f"Ve Výzvě '{call['name']}' už jsi přihlášen/a. Přehled najdeš v /moje_ucasti."}
+
+    needed = parse_data_needed(call['data_needed'])
+    if not needed:
+        return complete_data_collection(call, user_id, first_name, {}, compiled)
+    to_save = {'status': 'interested', 'collected_data': None}
+    if call['capacity'] is not None and QUANTITY_KEY not in (item.lower() for item in needed):
+        to_save['quantity'] = 1  # Počet kusů se neptáme - kus se drží hned od projeveného zájmu
+    return {
+        'status': 'ok',
+        'message': f"Skvělé, máš zájem o **{call['name']}**! Potřebuji od tebe ještě pár údajů.",
+        'markdown': True,
+        'next_state': ASKING_DATA,
+        'save_participation': to_save,
+        'user_data_updates': {'current_call_id': call['call_id'], 'current_call_capacity': call['capacity'], 'data_needed_list': needed, 'data_needed_index': 0, 'collected_data_so_far': {}},
+    }
+
+
+def next_data_step(user_data: dict) -> dict:
+    """Vrátí další otázku sběru údajů, nebo status 'complete', když je vše zadáno."""
+    needed_list = user_data.get('data_needed_list', [])
+    current_index = user_data.get('data_needed_index', 0)
+    if current_index >= len(needed_list):
+        return {'status': 'complete', 'call_id': user_data.get('current_call_id'), 'collected_data': user_data.get('collected_data_so_far', {})}
+    data_key = needed_list[current_index].strip()
+    return {
+        'status': 'ask',
+        'message': DATA_QUESTIONS.get(data_key.lower(), f"Prosím, zadej údaj pro: **{data_key}**"),
+        'markdown': True,
+        'next_state': PROCESSING_DATA,
+        'user_data_updates': {'current_data_key': data_key},
+    }
+
+
+def validate_data_input(data_key: str, user_input: str) -> tuple[bool, object]:
+    """Ověří zadaný údaj. Vrací (True, normalizovaná hodnota) nebo (False, chybová zpráva)."""
+    processed_input = user_input.strip()
+    key_lower = data_key.lower()
+    if key_lower == QUANTITY_KEY:
+        if not processed_input.isdigit() or int(processed_input) <= 0:
+            return False, "Toto není kladné číslo. Zadej počet kusů (např. 1):"
+        return True, int(processed_input)
+    if key_lower == 'email':
+        if not _EMAIL_RE.match(processed_input):
+            return False, "Toto není platný email. Zadej ho znovu (např. jmeno@domena.cz):"
     elif key_lower == 'telefonní číslo':
-        cleaned_phone = re.sub(r'[\s()-]+', '', processed_input)
-        if not re.match(r'^\+?\d{9,15}$', cleaned_phone): is_valid = False; error_message = "Toto není platný telefon. Zadej ho znovu (např. +420123456789):"
-        else: processed_input = cleaned_phone
+        cleaned_phone = _PHONE_CLEANUP_RE.sub('', processed_input)
+        if not _PHONE_RE.match(cleaned_phone):
+            return False, "Toto není platný telefon. Zadej ho znovu (např. +420123456789):"
+        return True, cleaned_phone
     elif key_lower == 'adresa doručení':
-        if len(processed_input) < 10: is_valid = False; error_message = "Adresa je příliš krátká. Zadej ji prosím znovu:"
-    if not is_valid: await update.message.reply_text(error_message); return PROCESSING_DATA
-    user_data.setdefault('collected_data_so_far', {})[current_key] = processed_input
-    user_data['data_needed_index'] = user_data.get('data_needed_index', 0) + 1
-    user_data.pop('current_data_key', None)
-    return await ask_next_data(update, context)
-
-async def cancel_all_conversations(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user = update.effective_user; user_data = context.user_data; call_id = user_data.get('current_call_id'); adding_call_data = user_data.get('new_call_data')
-    if call_id: logger.info(f"User {user.id} zrušil sběr dat pro call {call_id}."); add_or_update_participation(user_id=user.id, call_id=call_id, status='cancelled')
-    elif adding_call_data is not None: logger.info(f"Admin {user.id} zrušil přidávání nové výzvy.")
-    else: logger.info(f"User {user.id} použil /cancel mimo konverzaci.")
-    await update.message.reply_text("Aktuální akce byla zrušena.", reply_markup=ReplyKeyboardRemove())
-    keys_to_clear = ['current_call_id', 'data_needed_list', 'data_needed_index', 'collected_data_so_far', 'current_data_key', 'new_call_data']
-    for key in list(user_data.keys()):
-        if key in keys_to_clear: user_data.pop(key, None)
-    return ConversationHandler.END
-
-# --- Handlery pro /zrusit_ucast ---
-# (cancel_participation_start a handle_cancel_selection zůstávají stejné)
-async def cancel_participation_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    user_id = update.effective_user.id; logger.info(f"User {user_id} spustil /zrusit_ucast"); active_participations = get_user_active_participations(user_id)
-    if not active_participations: await update.message.reply_text("Nemáš žádné aktivní účasti."); return
-    message_text = "Tvé aktivní účasti. Vyber, kterou chceš zrušit:\n"; keyboard = []
-    for part in active_participations: button_text = f"Zrušit: {part['call_name']} (Stav: {part['status']})"; callback_data = f"cancel_{part['call_id']}"; keyboard.append([InlineKeyboardButton(button_text, callback_data=callback_data)])
-    keyboard.append([InlineKeyboardButton("Zpět", callback_data="cancel_abort")]); reply_markup = InlineKeyboardMarkup(keyboard); await update.message.reply_text(message_text, reply_markup=reply_markup)
-
-async def handle_cancel_selection(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    query = update.callback_query; await query.answer(); callback_data = query.data; user_id = query.from_user.id; logger.info(f"User {user_id} stiskl tlačítko zrušení: {callback_data}")
-    if callback_data == "cancel_abort": await query.edit_message_text("Akce zrušena.", reply_markup=None); return
-    if callback_data.startswith("cancel_"):
-        try:
-            call_id_to_cancel = int(callback_data.split("_")[1])
-            if add_or_update_participation(user_id, call_id_to_cancel, status='cancelled', collected_data=None): call_details = get_call_details(call_id_to_cancel); call_name = call_details['name'] if call_details else f"ID {call_id_to_cancel}"; await query.edit_message_text(f"Účast ve Výzvě '{call_name}' zrušena.", reply_markup=None); logger.info(f"User {user_id} zrušil účast ve výzvě {call_id_to_cancel}.")
-            else: await query.edit_message_text("Chyba při rušení účasti.", reply_markup=None)
-        except (IndexError, ValueError): logger.error(f"Neplatný cancel callback_data: {callback_data} pro user {user_id}"); await query.edit_message_text("Chyba při zpracování volby.", reply_markup=None)
-        except Exception as e: logger.error(f"Neočekávaná chyba handle_cancel_selection {callback_data} user {user_id}: {e}"); await query.message.reply_text("Neočekávaná chyba při rušení.")
-    else: logger.warning(f"User {user_id} poslal neznámý cancel callback: {callback_data}"); await query.edit_message_text("Neznámá akce.", reply_markup=None)
-
-# --- Handler pro /moje_ucasti ---
-async def my_participations_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    # (kód my_participations_command s opravou AttributeError)
-    user_id = update.effective_user.id; logger.info(f"User {user_id} spustil /moje_ucasti")
-    active_participations = get_user_active_participations(user_id)
-    if not active_participations: await update.message.reply_text("Nemáš aktuálně žádné aktivní účasti ve Výzvách."); return
-    message_parts = ["Tvé aktuální aktivní účasti:\n"]; status_translation = { 'interested': 'Projeven zájem', 'data_collected': 'Údaje poskytnuty', 'confirmed': 'Potvrzeno' }
+        if len(processed_input) < 10:
+            return False, "Adresa je příliš krátká. Zadej ji prosím znovu:"
+    return True, processed_input
+
+
+def process_data_input(user_data: dict, user_input: str) -> dict:
+    """Zpracuje odpověď uživatele na aktuální otázku sběru údajů."""
+    current_key = user_data.get('current_data_key')
+    if not current_key:
+        return {'status': 'ignored', 'next_state': PROCESSING_DATA}
+    is_valid, value = validate_data_input(current_key, user_input)
+    if not is_valid:
+        return {'status': 'invalid', 'message': value, 'next_state': PROCESSING_DATA}
+    collected_data = dict(user_data.get('collected_data_so_far', {}))
+    collected_data[current_key] = value
+    result = {
+        'status': 'ok',
+        'user_data_updates': {'collected_data_so_far': collected_data, 'data_needed_index': user_data.get('data_needed_index', 0) + 1},
+        'clear_keys': ['current_data_key'],
+    }
+    capacity = user_data.get('current_call_capacity')
+    if capacity is not None and current_key.lower() == QUANTITY_KEY:
+        if value > capacity:
+            return {'status': 'invalid', 'message': f"Výzva má celkem jen {capacity} ks. Zadej menší počet kusů:", 'next_state': PROCESSING_DATA}
+        # Kusy se rezervují hned, ať uživatel nevyplňuje zbytek údajů zbytečně
+        result['save_participation'] = {'status': 'interested', 'collected_data': None, 'quantity': value}
+        result['retry_quantity'] = True
+    return result
+
+
+def process_stock_shortage(remaining: int, retry_quantity: bool = False) -> dict:
+    """Rezervace neprošla: na požadovaný počet kusů už nezbývá (při zadávání počtu lze zadat menší)."""
+    if remaining <= 0:
+        return {'status': 'sold_out', 'error_message': SOLD_OUT_MESSAGE, 'next_state': END, 'clear_conversation': True}
+    if retry_quantity:
+        return {'status': 'shortage', 'error_message': f"Bohužel zbývá už jen {remaining} ks. Zadej menší počet kusů:", 'next_state': PROCESSING_DATA}
+    return {'status': 'shortage', 'error_message': f"Bohužel zbývá už jen {remaining} ks. Vyber Výzvu znovu přes /vyzvy a zadej menší počet.", 'next_state': END, 'clear_conversation': True}
+
+
+def conversation_keys_to_clear(user_data: dict) -> list[str]:
+    """Klíče user_data rozpracovaného sběru údajů (current_* a seznamy)."""
+    return [key for key in user_data if key.startswith('current_') or key in CONVERSATION_KEYS]
+
+
+# --- Rušení ---
+def process_cancel_conversation(user_data: dict) -> dict:
+    """Zpracuje /cancel uprostřed sběru údajů nebo přidávání výzvy."""
+    call_id = user_data.get('current_call_id')
+    result = {
+        'status': 'ok',
+        'message': "Aktuální akce byla zrušena.",
+        'remove_keyboard': True,
+        'next_state': END,
+        'clear_keys': conversation_keys_to_clear(user_data) + list(WIZARD_KEYS),
+    }
+    if call_id:
+        result['call_id'] = call_id
+        result['save_participation'] = {'status': 'cancelled', 'collected_data': None}
+    return result
+
+
+def process_cancel_selection(callback_data: str) -> dict:
+    """Vyhodnotí tlačítko z /zrusit_ucast ('cancel_<id>' nebo 'cancel_abort')."""
+    if callback_data == "cancel_abort":
+        return {'status': 'info', 'message': "Akce zrušena."}
+    call_id = parse_callback_id(callback_data, "cancel")
+    if call_id is None:
+        return {'status': 'error', 'message': "Chyba při zpracování volby."}
+    return {'status': 'ok', 'call_id': call_id, 'save_participation': {'status': 'cancelled', 'collected_data': None}, 'error_message': "Chyba při rušení účasti."}
+
+
+def format_cancel_result(call, call_id: int) -> str:
+    """Zpráva po úspěšném zrušení účasti."""
+    call_name = call['name'] if call else f"ID {call_id}"
+    return f"Účast ve Výzvě '{call_name}' zrušena."
+
+
+def build_cancel_buttons(active_participations) -> list[tuple[str, str]]:
+    """Tlačítka pro /zrusit_ucast včetně tlačítka Zpět."""
+    buttons = [(f"Zrušit: {part['call_name']} (Stav: {part['status']})", f"cancel_{part['call_id']}") for part in active_participations]
+    buttons.append(("Zpět", "cancel_abort"))
+    return buttons
+
+
+def format_participations_message(active_participations) -> str:
+    """Text (Markdown) pro /moje_ucasti."""
+    if not active_participations:
+        return "Nemáš aktuálně žádné aktivní účasti ve Výzvách."
+    message_parts = ["Tvé aktuální aktivní účasti:\n"]
     for part in active_participations:
-        try: call_name = part['call_name']
-        except (IndexError, KeyError): call_name = f"Výzva ID {part['call_id'] if 'call_id' in part else '?'}" ; logger.warning(f"Chybí 'call_name' v účasti pro user {user_id}")
-        try: status = part['status']
-        except (IndexError, KeyError): status = 'Neznámý'; logger.warning(f"Chybí 'status' v účasti pro user {user_id}")
-        status_cz = status_translation.get(status, status)
-        message_parts.append(f"\n- *{call_name}*"); message_parts.append(f"  Stav: {status_cz}")
-    try: await update.message.reply_text("\n".join(message_parts), parse_mode=ParseMode.MARKDOWN)
-    except Exception as e: logger.warning(f"Nepodařilo se poslat moje_ucasti s Markdown: {e}. Posílám jako prostý text."); plain_text = "\n".join(message_parts).replace('*',''); await update.message.reply_text(plain_text)
-
-# --- Handler pro neznámé zprávy ---
-async def handle_unknown_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    text = update.message.text; user_id = update.effective_user.id
-    if 'current_data_key' in context.user_data or 'new_call_data' in context.user_data: logger.info(f"User {user_id} poslal '{text}' během konverzace."); await update.message.reply_text("Probíhá jiná akce. Dokonči ji prosím, nebo ji zruš pomocí /cancel.")
-    else: logger.warning(f"Received unknown text message from {user_id} mimo konverzaci: {text}"); await update.message.reply_text(f"Promiň, na zprávu '{text}' neumím reagovat. Zkus /help.")
-
-# ==== TESTOVACÍ FUNKCE ====
-async def test_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    logger.info("Test command triggered!"); await update.message.reply_text("Testovací příkaz funguje!")
-
-# ==== FUNKCE PRO /addcall ====
-async def add_call_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user_id = update.effective_user.id
-    if not is_admin(user_id): logger.warning(f"Neoprávněný pokus o /addcall od user {user_id}"); await update.message.reply_text("Tento příkaz může použít pouze administrátor."); return ConversationHandler.END
-    logger.info(f"Admin {user_id} spustil /addcall"); context.user_data['new_call_data'] = {}; await update.message.reply_text("Začínáme přidávat novou výzvu.\nZadej **Název výzvy**:", parse_mode=ParseMode.MARKDOWN); return GET_CALL_NAME
-
-async def get_call_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user_id = update.effective_user.id; call_name = update.message.text.strip()
-    if not call_name: await update.message.reply_text("Název nemůže být prázdný. Zadej znovu:"); return GET_CALL_NAME
-    context.user_data['new_call_data']['name'] = call_name; logger.info(f"Admin {user_id} zadal název: {call_name}")
-    await update.message.reply_text("Název uložen. Zadej **Popis výzvy** (/skip):", parse_mode=ParseMode.MARKDOWN); return GET_CALL_DESC
-
-async def get_call_desc(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user_id = update.effective_user.id; description = update.message.text.strip()
-    context.user_data['new_call_data']['description'] = description; logger.info(f"Admin {user_id} zadal popis: {description}")
-    await update.message.reply_text("Popis uložen. Zadej **Původní cenu** (číslo nebo /skip):", parse_mode=ParseMode.MARKDOWN); return GET_CALL_ORIG_PRICE
-
-async def get_call_orig_price(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Zpracuje původní cenu (nebo /skip) a zeptá se na cenu po slevě."""
-    user_id = update.effective_user.id; price_input = update.message.text.strip(); original_price = None
+        status_cz = STATUS_TRANSLATION.get(part['status'], part['status'])
+        message_parts.append(f"\n- *{part['call_name']}*")
+        message_parts.append(f"  Stav: {status_cz}")
+    return "\n".join(message_parts)
+
+
+# --- Souhrny nových výzev (/souhrn) ---
+def format_digest_menu(current: str | None) -> tuple[str, list[tuple[str, str]]]:
+    """Text a tlačítka pro /souhrn bez argumentu podle aktuálního odběru."""
+    state = f"Teď dostáváš souhrn {DIGEST_PERIODS[current]}." if current in DIGEST_PERIODS else "Souhrny teď nedostáváš."
+    message = (f"Souhrn nových Výzev ti pošlu jednou zprávou místo jednotlivých oznámení. {state}\n"
+               "Vyber, jak často ho chceš dostávat (nebo /souhrn denne | tydne | vypnout):")
+    buttons = [(f"Souhrn {label}", f"{DIGEST_CHOICE_PREFIX}{period}") for period, label in DIGEST_PERIODS.items()]
+    buttons.append(("Nechci souhrny", f"{DIGEST_CHOICE_PREFIX}off"))
+    return message, buttons
+
+
+def process_digest_choice(choice: str, consent_status: str | None) -> dict:
+    """Vyhodnotí volbu odběru ('daily'/'weekly'/'off' nebo argument /souhrn)."""
+    period = DIGEST_ARGS.get(choice.lower(), choice)
+    if period != 'off' and period not in DIGEST_PERIODS:
+        return {'status': 'error', 'message': "Použití: /souhrn [denne | tydne | vypnout]"}
+    if period == 'off':
+        return {'status': 'ok', 'period': None, 'message': "Souhrny nových Výzev ti už posílat nebudu."}
+    if consent_status != 'granted':
+        return {'status': 'info', 'message': "Souhrny posílám jen se souhlasem se zpracováním údajů - udělíš ho přes /start."}
+    return {'status': 'ok', 'period': period,
+            'message': f"Hotovo, souhrn nových Výzev ti pošlu {DIGEST_PERIODS[period]}. Změníš to přes /souhrn."}
+
+
+def digest_slot(period: str, now: datetime.datetime, hour: int, weekday: int) -> datetime.datetime:
+    """Poslední plánovaný čas rozesílky souhrnu `period` nejpozději v `now` (místní čas)."""
+    slot = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+    if slot > now:
+        slot -= datetime.timedelta(days=1)
+    if period == 'weekly':
+        slot -= datetime.timedelta(days=(slot.weekday() - weekday) % 7)
+    return slot
+
+
+def digest_callback(since: int, cutoff: int, page: int) -> str:
+    return f"{DIGEST_CALLBACK_PREFIX}{since}_{cutoff}_{page}"
+
+
+def parse_digest_callback(callback_data: str) -> tuple[int, int, int] | None:
+    """Z 'digest_<since>_<cutoff>_<stránka>' vrátí trojici čísel, nebo None."""
+    parts = callback_data[len(DIGEST_CALLBACK_PREFIX):].split("_") if callback_data.startswith(DIGEST_CALLBACK_PREFIX) else []
+    if len(parts) != 3 or not all(part.isdigit() for part in parts):
+        return None
+    since, cutoff, page = map(int, parts)
+    return since, cutoff, page
+
+
+def format_digest_page(calls, page: int, page_size: int, since: int, cutoff: int) -> tuple[str, list[list[tuple[str, str]]]]:
+    """Jedna stránka souhrnu (Markdown) a řádky tlačítek: 'Mám zájem' pro výzvy stránky a listování."""
+    if not calls:
+        return "Výzvy z tohoto souhrnu už nejsou aktivní. Aktuální nabídku najdeš v /vyzvy.", []
+    pages = (len(calls) + page_size - 1) // page_size
+    page = min(max(page, 0), pages - 1)
+    shown = calls[page * page_size:(page + 1) * page_size]
+    parts = [f"*Nové Výzvy od minulého souhrnu* ({len(calls)}):"] + _format_call_lines(shown)
+    if pages > 1:
+        parts.append(f"\nStrana {page + 1}/{pages}")
+    rows = [[button] for button in build_calls_buttons(shown)]
+    navigation = []
+    if page > 0:
+        navigation.append(("◀ Předchozí", digest_callback(since, cutoff, page - 1)))
+    if page < pages - 1:
+        navigation.append(("Další ▶", digest_callback(since, cutoff, page + 1)))
+    if navigation:
+        rows.append(navigation)
+    return "\n".join(parts), rows
+
+
+# --- Průvodce přidáním výzvy (/addcall) ---
+def _parse_price(text: str) -> float | None:
     try:
-        original_price = float(price_input.replace(',', '.'))
-        if original_price < 0: raise ValueError("Cena nemůže být záporná.")
-        context.user_data['new_call_data']['original_price'] = original_price
-        logger.info(f"Admin {user_id} zadal pův. cenu: {original_price}")
+        return float(text.replace(',', '.'))
     except ValueError:
-        await update.message.reply_text("Neplatný formát. Zadej kladné číslo (např. 450.0) nebo /skip:")
-        return GET_CALL_ORIG_PRICE
-    await update.message.reply_text("Pův. cena uložena. Zadej **Cenu po slevě** (povinné, číslo):", parse_mode=ParseMode.MARKDOWN)
-    return GET_CALL_DEAL_PRICE
-
-async def get_call_deal_price(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user_id = update.effective_user.id; price_input = update.message.text.strip()
-    try: deal_price = float(price_input.replace(',', '.'));
-         if deal_price <= 0: raise ValueError("Cena po slevě musí být kladná.")
-         context.user_data['new_call_data']['deal_price'] = deal_price; logger.info(f"Admin {user_id} zadal cenu po slevě: {deal_price}")
-    except ValueError: await update.message.reply_text("Neplatný formát/hodnota. Zadej kladné číslo:"); return GET_CALL_DEAL_PRICE
-    await update.message.reply_text("Cena po slevě uložena. Zadej **Potřebná data** (čárkou oddělená, nebo /skip):", parse_mode=ParseMode.MARKDOWN); return GET_CALL_DATA_NEEDED
-
-async def get_call_data_needed(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user_id = update.effective_user.id; data_needed = update.message.text.strip()
-    context.user_data['new_call_data']['data_needed'] = data_needed if data_needed else None; logger.info(f"Admin {user_id} zadal potřebná data: {data_needed if data_needed else 'Žádná'}")
-    await update.message.reply_text("Potř. data uložena. Zadej **Finální instrukce** (použij {placeholdery}):", parse_mode=ParseMode.MARKDOWN); return GET_CALL_FINAL_INST
-
-async def get_call_final_inst(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user_id = update.effective_user.id; final_instructions = update.message.text.strip()
-    if not final_instructions: await update.message.reply_text("Finální instrukce nesmí být prázdné:"); return GET_CALL_FINAL_INST
-    context.user_data['new_call_data']['final_instructions'] = final_instructions; logger.info(f"Admin {user_id} zadal finální instrukce.")
-    call_data = context.user_data['new_call_data']; summary = "**Shrnutí nové výzvy:**\n\n"; summary += f"*Název:* {call_data.get('name')}\n"; summary += f"*Popis:* {call_data.get('description') or '-'}\n"; summary += f"*Pův. cena:* {call_data.get('original_price', '-')} Kč\n"; summary += f"*Cena po slevě:* {call_data.get('deal_price')} Kč\n"; summary += f"*Potř. data:* {call_data.get('data_needed') or '-'}\n"; summary += f"*Finální instrukce:* _{call_data.get('final_instructions')}_\n"; summary += "\n**Chceš tuto výzvu uložit?**"
-    reply_keyboard = [[KeyboardButton("Ano, uložit výzvu ✅")], [KeyboardButton("Ne, zrušit")]]; markup = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True, one_time_keyboard=True)
-    await update.message.reply_text(summary, reply_markup=markup, parse_mode=ParseMode.MARKDOWN); return CONFIRM_ADD_CALL
-
-async def confirm_add_call(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user_id = update.effective_user.id; response = update.message.text
+        return None
+
+
+def format_new_call_summary(call_data: dict) -> str:
+    """Shrnutí nové výzvy před potvrzením uložení."""
+    summary = "**Shrnutí nové výzvy:**\n\n"
+    summary += f"*Název:* {call_data.get('name')}\n"
+    summary += f"*Popis:* {call_data.get('description') or '-'}\n"
+    summary += f"*Pův. cena:* {call_data.get('original_price') or '-'} Kč\n"
+    summary += f"*Cena po slevě:* {call_data.get('deal_price')} Kč\n"
+    summary += f"*Kapacita:* {call_data['capacity']} ks\n" if call_data.get('capacity') else "*Kapacita:* neomezeně\n"
+    summary += f"*Potř. data:* {call_data.get('data_needed') or '-'}\n"
+    summary += f"*Finální instrukce:* _{call_data.get('final_instructions')}_\n"
+    summary += "\n**Chceš tuto výzvu uložit?**"
+    return summary
+
+
+def _wizard_step(next_state: int, message: str, call_data: dict, **extra) -> dict:
+    return {'status': 'ok', 'next_state': next_state, 'message': message, 'markdown': True, 'user_data_updates': {'new_call_data': call_data, WIZARD_STATE_KEY: next_state}, **extra}
+
+
+def start_add_call(is_admin: bool) -> dict:
+    """Vstup do průvodce /addcall."""
+    if not is_admin:
+        return {'status': 'error', 'message': "Tento příkaz může použít pouze administrátor.", 'next_state': END}
+    return _wizard_step(GET_CALL_NAME, "Začínáme přidávat novou výzvu.\nZadej **Název výzvy**:", {})
+
+
+def process_add_call_input(state: int, call_data: dict, text: str) -> dict:
+    """Jeden krok průvodce /addcall: ověří vstup pro daný stav a vrátí další krok."""
+    text = text.strip()
+    call_data = dict(call_data or {})
+    if state == GET_CALL_NAME:
+        if not text:
+            return {'status': 'invalid', 'message': "Název nemůže být prázdný. Zadej znovu:", 'next_state': state}
+        call_data['name'] = text
+        return _wizard_step(GET_CALL_DESC, "Název uložen. Zadej **Popis výzvy** (/skip):", call_data)
+    if state == GET_CALL_DESC:
+        call_data['description'] = text
+        return _wizard_step(GET_CALL_ORIG_PRICE, "Popis uložen. Zadej **Původní cenu** (číslo nebo /skip):", call_data)
+    if state == GET_CALL_ORIG_PRICE:
+        price = _parse_price(text)
+        if price is None or price < 0:
+            return {'status': 'invalid', 'message': "Neplatný formát. Zadej kladné číslo (např. 450.0) nebo /skip:", 'next_state': state}
+        call_data['original_price'] = price
+        return _wizard_step(GET_CALL_DEAL_PRICE, "Pův. cena uložena. Zadej **Cenu po slevě** (povinné, číslo):", call_data)
+    if state == GET_CALL_DEAL_PRICE:
+        price = _parse_price(text)
+        if price is None or price <= 0:
+            return {'status': 'invalid', 'message': "Neplatný formát/hodnota. Zadej kladné číslo:", 'next_state': state}
+        call_data['deal_price'] = price
+        return _wizard_step(GET_CALL_CAPACITY, "Cena po slevě uložena. Zadej **Kapacitu** - kolik kusů je k dispozici (číslo, nebo /skip = neomezeně):", call_data)
+    if state == GET_CALL_CAPACITY:
+        if not text.isdigit() or int(text) <= 0:
+            return {'status': 'invalid', 'message': "Zadej kladné celé číslo (počet kusů) nebo /skip:", 'next_state': state}
+        call_data['capacity'] = int(text)
+        return _wizard_step(GET_CALL_DATA_NEEDED, f"Kapacita uložena. Zadej **Potřebná data** (čárkou oddělená, nebo /skip; pro více kusů na osobu přidej '{QUANTITY_KEY}'):", call_data)
+    if state == GET_CALL_DATA_NEEDED:
+        call_data['data_needed'] = text or None
+        return _wizard_step(GET_CALL_FINAL_INST, "Potř. data uložena. Zadej **Finální instrukce** (použij {placeholdery}):", call_data)
+    if state == GET_CALL_FINAL_INST:
+        if not text:
+            return {'status': 'invalid', 'message': "Finální instrukce nesmí být prázdné:", 'next_state': state}
+        template_error = validate_template(text, call_data.get('data_needed'))
+        if template_error:
+            placeholders = ", ".join(f"{{{name}}}" for name in allowed_placeholders(call_data.get('data_needed')))
+            return {'status': 'invalid', 'message': f"{template_error}\nPovolené placeholdery: {placeholders}\nZadej instrukce znovu:", 'next_state': state}
+        call_data['final_instructions'] = text
+        return _wizard_step(CONFIRM_ADD_CALL, format_new_call_summary(call_data), call_data, reply_keyboard=[[CONFIRM_SAVE_CALL], [CONFIRM_DISCARD_CALL]])
+    return {'status': 'error', 'message': "Neočekávaný krok průvodce.", 'next_state': END}
+
+
+def process_add_call_skip(state: int, call_data: dict) -> dict:
+    """Zpracuje /skip u nepovinných kroků průvodce."""
+    call_data = dict(call_data or {})
+    if state == GET_CALL_DESC:
+        call_data['description'] = None
+        return _wizard_step(GET_CALL_ORIG_PRICE, "Popis přeskočen. Zadej **Původní cenu** (číslo nebo /skip):", call_data)
+    if state == GET_CALL_ORIG_PRICE:
+        call_data['original_price'] = None
+        return _wizard_step(GET_CALL_DEAL_PRICE, "Pův. cena přeskočena. Zadej **Cenu po slevě** (povinné, číslo):", call_data)
+    if state == GET_CALL_CAPACITY:
+        call_data['capacity'] = None
+        return _wizard_step(GET_CALL_DATA_NEEDED, "Kapacita přeskočena (neomezeně). Zadej **Potřebná data** (čárkou oddělená, nebo /skip):", call_data)
+    if state == GET_CALL_DATA_NEEDED:
+        call_data['data_needed'] = None
+        return _wizard_step(GET_CALL_FINAL_INST, "Potř. data přeskočena. Zadej **Finální instrukce**:", call_data)
+    return {'status': 'invalid', 'message': "Tento krok nelze přeskočit příkazem /skip.", 'next_state': state}
+
+
+def process_add_call_confirm(response: str, call_data: dict | None) -> dict:
+    """Vyhodnotí potvrzení uložení nové výzvy ('save' = handler má zapsat do DB)."""
     if "Ano, uložit výzvu" in response:
-        call_data = context.user_data.get('new_call_data')
-        if not call_data: await update.message.reply_text("Chyba: data nenalezena.", reply_markup=ReplyKeyboardRemove()); return ConversationHandler.END
-        new_id = add_new_call(name=call_data['name'], description=call_data.get('description'), original_price=call_data.get('original_price'), deal_price=call_data['deal_price'], status='active', data_needed=call_data.get('data_needed'), final_instructions=call_data.get('final_instructions'))
-        if new_id: await update.message.reply_text(f"Výzva '{call_data['name']}' uložena (ID {new_id})!", reply_markup=ReplyKeyboardRemove()); logger.info(f"Admin {user_id} uložil výzvu ID: {new_id}")
-        else: await update.message.reply_text("Chyba: Uložení do DB selhalo.", reply_markup=ReplyKeyboardRemove())
-    elif "Ne, zrušit" in response: await update.message.reply_text("Přidání zrušeno.", reply_markup=ReplyKeyboardRemove()); logger.info(f"Admin {user_id} zrušil přidání.")
-    else: await update.message.reply_text("Vyber 'Ano' nebo 'Ne'."); return CONFIRM_ADD_CALL
-    context.user_data.pop('new_call_data', None); return ConversationHandler.END
-
-async def skip_optional(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Zpracuje /skip pro nepovinné údaje při přidávání výzvy."""
-    current_state = context.user_data.get(ConversationHandler.STATE)
-    user_id = update.effective_user.id
-    logger.info(f"Admin {user_id} použil /skip ve stavu {current_state}")
-    next_state = current_state
-    if current_state == GET_CALL_DESC: context.user_data['new_call_data']['description'] = None; await update.message.reply_text("Popis přeskočen. Zadej **Původní cenu** (číslo nebo /skip):", parse_mode=ParseMode.MARKDOWN); next_state = GET_CALL_ORIG_PRICE
-    elif current_state == GET_CALL_ORIG_PRICE: context.user_data['new_call_data']['original_price'] = None; await update.message.reply_text("Pův. cena přeskočena. Zadej **Cenu po slevě** (povinné, číslo):", parse_mode=ParseMode.MARKDOWN); next_state = GET_CALL_DEAL_PRICE
-    elif current_state == GET_CALL_DATA_NEEDED: context.user_data['new_call_data']['data_needed'] = None; await update.message.reply_text("Potř. data přeskočena. Zadej **Finální instrukce**:", parse_mode=ParseMode.MARKDOWN); next_state = GET_CALL_FINAL_INST
-    else: await update.message.reply_text("Tento krok nelze přeskočit příkazem /skip.")
-    return next_state
-
-# --- Handler pro neznámé zprávy ---
-async def handle_unknown_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    text = update.message.text; user_id = update.effective_user.id
-    if 'current_data_key' in context.user_data or 'new_call_data' in context.user_data: logger.info(f"User {user_id} poslal '{text}' během konverzace."); await update.message.reply_text("Probíhá jiná akce. Dokonči ji prosím, nebo ji zruš pomocí /cancel.")
-    else: logger.warning(f"Received unknown text message from {user_id} mimo konverzaci: {text}"); await update.message.reply_text(f"Promiň, na zprávu '{text}' neumím reagovat. Zkus /help.")
-
-# ==== TESTOVACÍ FUNKCE ====
-async def test_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    logger.info("Test command triggered!"); await update.message.reply_text("Testovací příkaz funguje!")
-
-# --- Hlavní funkce ---
-def main() -> None:
-    """Spustí bota."""
-    try: init_db()
-    except Exception as e: logger.critical(f"Kritická chyba DB: {e}. Bot stop."); return
-
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
-
-    # ConversationHandler pro sběr dat účasti
-    participation_conv_handler = ConversationHandler(
-        entry_points=[CallbackQueryHandler(handle_call_selection, pattern="^call_")],
-        states={ PROCESSING_DATA: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_data_input)], },
-        fallbacks=[CommandHandler("cancel", cancel_all_conversations)], name="call_data_collection",
-    )
-
-    # ConversationHandler pro přidání výzvy adminem
-    add_call_conv_handler = ConversationHandler(
-        entry_points=[CommandHandler("addcall", add_call_start)],
-        states={
-            GET_CALL_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_call_name)],
-            GET_CALL_DESC: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_call_desc), CommandHandler("skip", skip_optional)],
-            GET_CALL_ORIG_PRICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_call_orig_price), CommandHandler("skip", skip_optional)],
-            GET_CALL_DEAL_PRICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_call_deal_price)],
-            GET_CALL_DATA_NEEDED: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_call_data_needed), CommandHandler("skip", skip_optional)],
-            GET_CALL_FINAL_INST: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_call_final_inst)],
-            CONFIRM_ADD_CALL: [MessageHandler(filters.Regex("^(Ano, uložit výzvu ✅|Ne, zrušit)$"), confirm_add_call)],
-        },
-        fallbacks=[CommandHandler("cancel", cancel_all_conversations)],
-        name="add_call_flow",
-    )
-
-    # --- Registrace handlerů ---
-    application.add_handler(participation_conv_handler)
-    application.add_handler(add_call_conv_handler)
-
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("vyzvy", list_calls))
-    application.add_handler(CommandHandler("zrusit_ucast", cancel_participation_start))
-    application.add_handler(CommandHandler("moje_ucasti", my_participations_command))
-    application.add_handler(CommandHandler("test", test_command))
-
-    application.add_handler(MessageHandler(filters.Regex("^(Ano, souhlasím 👍|Ne, děkuji)$"), handle_consent_response))
-    application.add_handler(CallbackQueryHandler(handle_cancel_selection, pattern="^cancel_"))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_unknown_message))
-
-    logger.info("Spouštím bota (polling)...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
-
-if __name__ == "__main__":
-    main()
+        if not call_data:
+            return {'status': 'error', 'message': "Chyba: data nenalezena.", 'remove_keyboard': True, 'next_state': END, 'clear_keys': list(WIZARD_KEYS)}
+        return {'status': 'save', 'call_data': call_data, 'remove_keyboard': True, 'next_state': END, 'clear_keys': list(WIZARD_KEYS), 'error_message': "Chyba: Uložení do DB selhalo."}
+    if CONFIRM_DISCARD_CALL in response:
+        return {'status': 'info', 'message': "Přidání zrušeno.", 'remove_keyboard': True, 'next_state': END, 'clear_keys': list(WIZARD_KEYS)}
+    return {'status': 'invalid', 'message': "Vyber 'Ano' nebo 'Ne'.", 'next_state': CONFIRM_ADD_CALL}
+
+
+def format_call_saved(call_data: dict, new_id: int) -> str:
+    return f"Výzva '{call_data['name']}' uložena (ID {new_id})!"
+
+
+# --- Ostatní ---
+def format_unknown_message(text: str, in_conversation: bool) -> str:
+    if in_conversation:
+        return "Probíhá jiná akce. Dokonči ji prosím, nebo ji zruš pomocí /cancel."
+    return f"Promiň, na zprávu '{text}' neumím reagovat. Zkus /help."
@@ -10,7 +10,7 @@ load_dotenv()  # Načte proměnné z .env souboru, pokud existuje
 
 # --- Telegram Token ---
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-if not TELEGRAM_TOKEN:
+if not TELEGRAM_TOKEN and not os.getenv("BOTS"):
     # Místo ValueError můžeme použít logger a ukončit/nebo nastavit default
     logger.critical(
         "KRITICKÁ CHYBA: Chybí TELEGRAM_BOT_TOKEN v .env souboru nebo proměnných prostředí!"
@@ -45,5 +45,167 @@ else:
     # Pro testování můžete dočasně nastavit ID zde, ale nezapomeňte ho pak odstranit nebo dát do .env!
     # Například: ADMIN_IDS = {123456789} # VASE_TELEGRAM_ID
 
+# --- Více botů v jednom procesu ---
+# BOTS=cz,sk -> pro každý bot TELEGRAM_BOT_TOKEN_CZ, ADMIN_IDS_CZ (bez nich platí ADMIN_IDS).
+# Bez BOTS běží jeden bot z TELEGRAM_BOT_TOKEN (tenant None = výchozí tenant v DB).
+def _parse_admin_ids(raw: str) -> set[int]:
+    return {int(admin_id.strip()) for admin_id in raw.split(",") if admin_id.strip().isdigit()}
+
+BOT_CONFIGS = []
+for _name in [name.strip().lower() for name in os.getenv("BOTS", "").split(",") if name.strip()]:
+    if not _name.replace("_", "").isalnum():
+        raise ValueError(f"Neplatné jméno bota v BOTS: '{_name}' (povolena jsou písmena, číslice a _)")
+    _token = os.getenv(f"TELEGRAM_BOT_TOKEN_{_name.upper()}")
+    if not _token:
+        logger.critical(f"KRITICKÁ CHYBA: Chybí TELEGRAM_BOT_TOKEN_{_name.upper()} pro bota '{_name}'!")
+        raise ValueError(f"Chybí TELEGRAM_BOT_TOKEN_{_name.upper()} pro bota '{_name}'!")
+    _admins = os.getenv(f"ADMIN_IDS_{_name.upper()}")
+    BOT_CONFIGS.append({"tenant": _name, "token": _token, "admin_ids": _parse_admin_ids(_admins) if _admins else set(ADMIN_IDS)})
+if BOT_CONFIGS:
+    TELEGRAM_TOKEN = TELEGRAM_TOKEN or BOT_CONFIGS[0]["token"]
+    logger.info(f"Hostované boty: {', '.join(config['tenant'] for config in BOT_CONFIGS)}")
+else:
+    BOT_CONFIGS.append({"tenant": None, "token": TELEGRAM_TOKEN, "admin_ids": ADMIN_IDS})
+
 # --- Další možné konfigurace ---
 # Např. limity, výchozí texty atd.
+
+# --- Archivace uzavřených výzev ---
+# Po kolika dnech od uzavření se výzva i s účastmi přesune do archivní DB
+try:
+    ARCHIVE_RETENTION_DAYS = int(os.getenv("ARCHIVE_RETENTION_DAYS", "30"))
+except ValueError:
+    logger.error("Neplatná hodnota ARCHIVE_RETENTION_DAYS, používám 30.")
+    ARCHIVE_RETENTION_DAYS = 30
+
+# --- Hromadné notifikace ---
+# Telegram povoluje zhruba 30 zpráv za sekundu napříč chaty, necháváme rezervu
+try:
+    NOTIFY_RATE_PER_SECOND = float(os.getenv("NOTIFY_RATE_PER_SECOND", "25"))
+except ValueError:
+    logger.error("Neplatná hodnota NOTIFY_RATE_PER_SECOND, používám 25.")
+    NOTIFY_RATE_PER_SECOND = 25.0
+
+# --- Souhrny nových výzev (digest, přihlášení přes /souhrn) ---
+# Místní čas rozesílky; týdenní souhrn chodí v DIGEST_WEEKDAY (0 = pondělí), -1 = souhrny vypnuté
+try:
+    DIGEST_HOUR = int(os.getenv("DIGEST_HOUR", "18"))
+    DIGEST_WEEKDAY = int(os.getenv("DIGEST_WEEKDAY", "0"))
+    DIGEST_PAGE_SIZE = int(os.getenv("DIGEST_PAGE_SIZE", "5"))  # Výzev na jednu stránku souhrnu
+except ValueError:
+    logger.error("Neplatná hodnota DIGEST_HOUR/DIGEST_WEEKDAY/DIGEST_PAGE_SIZE, používám výchozí.")
+    DIGEST_HOUR, DIGEST_WEEKDAY, DIGEST_PAGE_SIZE = 18, 0, 5
+
+# --- Rozpracované nákupy (sessions) ---
+# Po kolika sekundách nečinnosti rozpracovaný nákup vyprší a kolik jich držet v paměti
+try:
+    SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", "1800"))
+    SESSION_MAX = int(os.getenv("SESSION_MAX", "10000"))
+except ValueError:
+    logger.error("Neplatná hodnota SESSION_TTL_SECONDS/SESSION_MAX, používám výchozí.")
+    SESSION_TTL_SECONDS = 1800
+    SESSION_MAX = 10000
+# Kolik uživatelů držet v cache stavu (profil, souhlas, aktivní účasti - viz user_cache.py)
+try:
+    USER_CACHE_MAX = int(os.getenv("USER_CACHE_MAX", "10000"))
+except ValueError:
+    logger.error("Neplatná hodnota USER_CACHE_MAX, používám 10000.")
+    USER_CACHE_MAX = 10000
+# Poslat uživateli zprávu, že jeho nákup vypršel
+SESSION_EXPIRY_NOTICE = os.getenv("SESSION_EXPIRY_NOTICE", "1").lower() not in ("0", "false", "no")
+
+# --- Deduplikace updatů ---
+# Kolik posledních update_id si pamatovat pro zahození opakovaně doručených updatů
+try:
+    UPDATE_DEDUP_WINDOW = int(os.getenv("UPDATE_DEDUP_WINDOW", "1000"))
+except ValueError:
+    logger.error("Neplatná hodnota UPDATE_DEDUP_WINDOW, používám 1000.")
+    UPDATE_DEDUP_WINDOW = 1000
+
+# --- Zálohy ---
+BACKUP_DIR = os.getenv("BACKUP_DIR") or None  # None = složka backups vedle database.py
+try:
+    BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+    BACKUP_INTERVAL_HOURS = float(os.getenv("BACKUP_INTERVAL_HOURS", "0"))  # 0 = jen ručně přes /backup
+except ValueError:
+    logger.error("Neplatná hodnota BACKUP_KEEP/BACKUP_INTERVAL_HOURS, používám výchozí.")
+    BACKUP_KEEP = 7
+    BACKUP_INTERVAL_HOURS = 0.0
+
+# --- Ochrana před zahlcením (na uživatele) ---
+try:
+    FLOOD_RATE_PER_SECOND = float(os.getenv("FLOOD_RATE_PER_SECOND", "1"))  # Trvalá rychlost událostí
+    FLOOD_BURST = int(os.getenv("FLOOD_BURST", "5"))  # Kolik událostí najednou projde
+    CALLBACK_DEDUP_SECONDS = float(os.getenv("CALLBACK_DEDUP_SECONDS", "1"))  # Okno pro sloučení dvojkliku
+except ValueError:
+    logger.error("Neplatná hodnota FLOOD_RATE_PER_SECOND/FLOOD_BURST/CALLBACK_DEDUP_SECONDS, používám výchozí.")
+    FLOOD_RATE_PER_SECOND = 1.0
+    FLOOD_BURST = 5
+    CALLBACK_DEDUP_SECONDS = 1.0
+
+# --- Pool pro práci na pozadí (DB operace z callbacků) ---
+try:
+    WORKER_POOL_SIZE = int(os.getenv("WORKER_POOL_SIZE", "8"))  # Souběžné DB úlohy
+    WORKER_POOL_MAX_PENDING = int(os.getenv("WORKER_POOL_MAX_PENDING", "200"))  # Nad limit se odmítá
+except ValueError:
+    logger.error("Neplatná hodnota WORKER_POOL_SIZE/WORKER_POOL_MAX_PENDING, používám výchozí.")
+    WORKER_POOL_SIZE = 8
+    WORKER_POOL_MAX_PENDING = 200
+
+# --- Předehřátí při startu (viz bot.prewarm) ---
+try:
+    # Kolik spojení s Bot API otevřít předem (souběžné getMe), 0 = jen spojení z initialize()
+    PREWARM_HTTP_CONNECTIONS = int(os.getenv("PREWARM_HTTP_CONNECTIONS", "4"))
+except ValueError:
+    logger.error("Neplatná hodnota PREWARM_HTTP_CONNECTIONS, používám 4.")
+    PREWARM_HTTP_CONNECTIONS = 4
+
+# --- Řízené ukončení a předání záložní instanci (viz lifecycle.py) ---
+try:
+    # Jak dlouho (s) po SIGTERM čekat na rozpracované handlery a rozesílku, než se ukončí natvrdo
+    DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "10"))
+    # Platnost lease na polling (s); záloha převezme i po pádu aktivní instance, 0 = bez lease
+    HANDOFF_LEASE_SECONDS = int(os.getenv("HANDOFF_LEASE_SECONDS", "15"))
+except ValueError:
+    logger.error("Neplatná hodnota DRAIN_TIMEOUT/HANDOFF_LEASE_SECONDS, používám výchozí.")
+    DRAIN_TIMEOUT = 10.0
+    HANDOFF_LEASE_SECONDS = 15
+
+# --- Více procesů (supervisor + workery, viz workers.py) ---
+# 0 nebo 1 = vše v jednom procesu; N > 1 = N workerů, updaty rozdělené podle user_id
+try:
+    WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "0"))
+except ValueError:
+    logger.error("Neplatná hodnota WORKER_PROCESSES, používám 0 (jeden proces).")
+    WORKER_PROCESSES = 0
+
+# --- HTTP spojení s Bot API (viz transport.py) ---
+# Odesílání (sendMessage, editMessageText, ...) a polling (getUpdates) mají oddělené pooly,
+# aby dlouhé getUpdates nezabíralo místo rozesílce a naopak.
+try:
+    HTTP_SEND_POOL_SIZE = int(os.getenv("HTTP_SEND_POOL_SIZE", "32"))  # Max. souběžných spojení pro odesílání
+    HTTP_SEND_KEEPALIVE = int(os.getenv("HTTP_SEND_KEEPALIVE", "32"))  # Kolik nečinných spojení držet otevřených (méně než pool = nová spojení při nárazu)
+    HTTP_POLL_POOL_SIZE = int(os.getenv("HTTP_POLL_POOL_SIZE", "2"))  # getUpdates + potvrzení offsetu
+    HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))  # Po kolika s zavřít nečinné spojení
+    HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+    HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+    HTTP_WRITE_TIMEOUT = float(os.getenv("HTTP_WRITE_TIMEOUT", "10"))
+    HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "5"))  # Čekání na volné spojení z poolu
+except ValueError:
+    logger.error("Neplatná hodnota HTTP_* (pooly/timeouty), používám výchozí.")
+    HTTP_SEND_POOL_SIZE, HTTP_SEND_KEEPALIVE, HTTP_POLL_POOL_SIZE = 32, 32, 2
+    HTTP_KEEPALIVE_EXPIRY = 30.0
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_WRITE_TIMEOUT, HTTP_POOL_TIMEOUT = 5.0, 10.0, 10.0, 5.0
+# "1.1" nebo "2" (HTTP/2 vyžaduje balíček h2: pip install "python-telegram-bot[http2]")
+HTTP_VERSION = os.getenv("HTTP_VERSION", "1.1")
+
+# --- Deep-linky na výzvy ---
+# Tajemství pro podpis odkazů t.me/<bot>?start=...; bez něj se klíč odvodí z tokenu
+# (změna tokenu pak zneplatní dříve rozeslané odkazy)
+DEEPLINK_SECRET = os.getenv("DEEPLINK_SECRET") or None
+
+# --- Záznam provozu pro replay ---
+# Cesta k souboru, kam se připisují anonymizované příchozí updaty (vypnuto, pokud není nastaveno)
+TRAFFIC_RECORD_FILE = os.getenv("TRAFFIC_RECORD_FILE") or None
+# Sůl pro pseudonymizaci user_id; bez ní se generuje náhodná při každém startu
+TRAFFIC_RECORD_SALT = os.getenv("TRAFFIC_RECORD_SALT") or None
@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 import sqlite3
 import datetime
+import functools
 import logging
 import json
 import os
@@ -9,43 +10,301 @@ import os
 # --- Určení absolutní cesty k databázi ---
 _BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATABASE_FILE = os.path.join(_BASE_DIR, "database.sqlite3")
+# Studená databáze pro uzavřené a archivované výzvy (připojuje se přes ATTACH)
+ARCHIVE_DATABASE_FILE = os.path.join(_BASE_DIR, "archive.sqlite3")
+ARCHIVE_SCHEMA = "archive"
+# Tenant (bot) pro jednobotový provoz a pro data z doby před více boty
+DEFAULT_TENANT = "default"
+
+# Sloupce tabulek, které se přesouvají do archivu (pořadí musí sedět v obou schématech)
+_CALL_COLUMNS = (
+    "call_id, name, description, original_price, deal_price, status, data_needed, "
+    "image_url, start_at, end_at, final_instructions, created_at, closed_at, tenant"
+)
+_PARTICIPATION_COLUMNS = "user_id, call_id, status, collected_data, participation_timestamp"
+
+# --- Kompaktní kódování (schéma verze 1) ---
+# Stavy se ukládají jako malá čísla (kód = pořadí v n-tici, číselník je i v tabulce
+# `status_codes`) a časy jako celé sekundy od epochy (UTC). Navenek funkce tohoto
+# modulu dál vrací texty ('active', '2024-05-01 12:00:00') - převod dělá SQL.
+# Verze 2 přidává tabulku checkout_sessions (předání rozpracovaných nákupů při restartu),
+# verze 3 tabulku digest_subscriptions (souhrny nových výzev), verze 4 index změn účastí
+# (přírůstková obnova segmentů, viz audience.py), verze 5 kapacitu výzev a rezervace kusů.
+SCHEMA_VERSION = 5
+_COMPACT_VERSION = 1  # Databáze starší než tato verze se při init_db přestaví (viz _rename_legacy_tables)
+STATUS_CODES = {
+    "consent": ("pending", "granted", "denied"),
+    "user_state": ("start",),
+    "call": ("active", "closed"),
+    "participation": ("interested", "data_collected", "confirmed", "cancelled"),
+    "outbox": ("pending", "sent", "failed"),
+    "digest": ("daily", "weekly"),
+}
+# Kódované a časové sloupce (migrace starého textového schématu)
+_CODED_COLUMNS = {
+    "users": {"consent_status": "consent", "state": "user_state"},
+    "calls": {"status": "call"},
+    "participations": {"status": "participation"},
+    "notification_outbox": {"status": "outbox"},
+}
+_TIMESTAMP_COLUMNS = {
+    "joined_timestamp", "start_at", "end_at", "created_at", "closed_at", "archived_at",
+    "participation_timestamp", "sent_at", "processed_at",
+}
+_NOW = "CAST(strftime('%s', 'now') AS INTEGER)"
+
+
+def status_code(domain: str, name: str) -> int | None:
+    """Kód stavu podle názvu, None pro neznámý stav."""
+    names = STATUS_CODES[domain]
+    return names.index(name) if name in names else None
+
+
+def status_name(domain: str, code: int | None) -> str | None:
+    """Název stavu podle kódu, None pro neznámý kód."""
+    names = STATUS_CODES[domain]
+    return names[code] if code is not None and 0 <= code < len(names) else None
+
+
+def _codes(domain: str, *names: str) -> str:
+    # Kódy jako SQL literály (pro IN (...) a porovnání, ať planner vidí konstanty)
+    return ", ".join(str(status_code(domain, name)) for name in names)
+
+
+def _decoded(domain: str, column: str) -> str:
+    # SQL výraz vracející místo kódu text stavu, pod jménem sloupce
+    cases = " ".join(f"WHEN {code} THEN '{name}'" for code, name in enumerate(STATUS_CODES[domain]))
+    return f"CASE {column} {cases} END AS {column.split('.')[-1]}"
+
+
+def _datetime(column: str) -> str:
+    # Epoch -> 'YYYY-MM-DD HH:MM:SS' (stejný formát jako dřív CURRENT_TIMESTAMP)
+    return f"datetime({column}, 'unixepoch') AS {column.split('.')[-1]}"
+
+
+# Výzva v textové podobě (náhrada SELECT *); archiv kapacitu nedrží
+_CALL_FIELDS = (
+    "call_id", "name", "description", "original_price", "deal_price", _decoded("call", "status"),
+    "data_needed", "image_url", _datetime("start_at"), _datetime("end_at"), "final_instructions",
+    _datetime("created_at"), _datetime("closed_at"), "tenant",
+)
+_CALL_SELECT = ", ".join(_CALL_FIELDS + ("capacity",))
+_ARCHIVED_CALL_SELECT = ", ".join(_CALL_FIELDS + ("NULL AS capacity", _datetime("archived_at")))
 
 # Nastavení loggeru
 logger = logging.getLogger(__name__)
 logger.info(f"Database path set to: {DATABASE_FILE}")  # Logování cesty pro kontrolu
 
+# --- Jediný zapisovatel (režim více procesů, viz workers.py) ---
+# Ve workeru je nastaven `_writer` a zápisové funkce se místo přímého zápisu
+# přepošlou supervisoru, který je provádí postupně v jednom vlákně.
+_writer = None
+WRITE_FUNCTIONS = {}
+
+
+def set_writer(writer) -> None:
+    """Nastaví proxy pro zápisy (objekt s metodou call(name, args, kwargs)), None = zápis přímo."""
+    global _writer
+    _writer = writer
+
+
+def writes(func):
+    """Označí zápisovou funkci; s nastaveným zapisovatelem se volání přepošle jemu."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _writer is not None:
+            return _writer.call(func.__name__, args, kwargs)
+        return func(*args, **kwargs)
+    WRITE_FUNCTIONS[func.__name__] = wrapper
+    return wrapper
+
 
-def get_db_connection():
-    """Vytvoří a vrátí spojení s databází."""
+def get_db_connection(with_archive: bool = False):
+    """Vytvoří a vrátí spojení s databází.
+
+    S `with_archive=True` je navíc připojena archivní databáze jako schéma
+    `archive`, takže lze dotazovat např. `archive.calls`.
+    """
     try:
         conn = sqlite3.connect(DATABASE_FILE)
         conn.execute("PRAGMA foreign_keys = ON")
         conn.execute("PRAGMA encoding = 'UTF-8'")
         conn.row_factory = sqlite3.Row
+        if with_archive:
+            attach_archive(conn)
         return conn
     except sqlite3.Error as e:
         logger.error(f"Chyba při připojování k databázi {DATABASE_FILE}: {e}")
         raise
 
 
+def attach_archive(conn):
+    """Připojí archivní databázi ke spojení a zajistí, že v ní existují tabulky."""
+    conn.execute(f"ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}", (ARCHIVE_DATABASE_FILE,))
+    # Archiv verze 2 nezměnila, stačí mu kompaktní schéma
+    if conn.execute(f"PRAGMA {ARCHIVE_SCHEMA}.user_version").fetchone()[0] >= _COMPACT_VERSION:
+        return
+    # auto_vacuum jde nastavit jen na prázdné databázi, na existující nemá efekt
+    conn.execute(f"PRAGMA {ARCHIVE_SCHEMA}.auto_vacuum = INCREMENTAL")
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    if cursor.execute(f"PRAGMA {ARCHIVE_SCHEMA}.user_version").fetchone()[0] >= _COMPACT_VERSION:
+        conn.rollback()  # Mezitím převedl jiný proces
+        return
+    legacy = _rename_legacy_tables(cursor, ARCHIVE_SCHEMA, ("calls", "participations"))
+    cursor.execute(
+        f"""
+    CREATE TABLE IF NOT EXISTS {ARCHIVE_SCHEMA}.calls (
+        call_id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        description TEXT,
+        original_price REAL,
+        deal_price REAL NOT NULL,
+        status INTEGER,
+        data_needed TEXT,
+        image_url TEXT,
+        start_at INTEGER,
+        end_at INTEGER,
+        final_instructions TEXT,
+        created_at INTEGER,
+        closed_at INTEGER,
+        archived_at INTEGER DEFAULT ({_NOW}),
+        tenant TEXT NOT NULL DEFAULT 'default'
+    );
+    """
+    )
+    # Bez FK na users - ty zůstávají v hlavní databázi
+    cursor.execute(
+        f"""
+    CREATE TABLE IF NOT EXISTS {ARCHIVE_SCHEMA}.participations (
+        user_id INTEGER NOT NULL,
+        call_id INTEGER NOT NULL,
+        status INTEGER,
+        collected_data TEXT,
+        participation_timestamp INTEGER,
+        PRIMARY KEY (user_id, call_id)
+    ) WITHOUT ROWID;
+    """
+    )
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA}.idx_archive_participations_call ON participations (call_id)"
+    )
+    _copy_legacy_tables(cursor, ARCHIVE_SCHEMA, legacy)
+    cursor.execute(f"PRAGMA {ARCHIVE_SCHEMA}.user_version = {_COMPACT_VERSION}")
+    conn.commit()
+    if legacy:
+        logger.info(f"Archivní databáze převedena na kompaktní schéma (verze {_COMPACT_VERSION}).")
+
+
+def _rename_legacy_tables(cursor, schema: str, tables) -> list[str]:
+    """Přejmenuje existující tabulky na <jméno>_legacy a zahodí jejich indexy (kvůli jménům).
+
+    Volá se v otevřené transakci před CREATE TABLE nového schématu, data pak
+    přenese _copy_legacy_tables.
+    """
+    existing = {row[0] for row in cursor.execute(f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table'")}
+    legacy = [table for table in tables if table in existing]
+    # Bez legacy_alter_table by SQLite přepsal odkazy FOREIGN KEY ostatních tabulek na _legacy
+    cursor.execute("PRAGMA legacy_alter_table = ON")
+    for table in legacy:
+        indexes = cursor.execute(
+            f"SELECT name FROM {schema}.sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+            (table,),
+        ).fetchall()
+        for (index,) in indexes:
+            cursor.execute(f"DROP INDEX {schema}.{index}")
+        cursor.execute(f"ALTER TABLE {schema}.{table} RENAME TO {table}_legacy")
+    cursor.execute("PRAGMA legacy_alter_table = OFF")
+    return legacy
+
+
+def _legacy_expression(table: str, column: str) -> str:
+    """SQL výraz převádějící textový sloupec starého schématu na kompaktní hodnotu."""
+    domain = _CODED_COLUMNS.get(table, {}).get(column)
+    if domain:
+        cases = " ".join(f"WHEN '{name}' THEN {code}" for code, name in enumerate(STATUS_CODES[domain]))
+        return f"CASE {column} {cases} END"
+    if column in _TIMESTAMP_COLUMNS:
+        return f"CAST(strftime('%s', {column}) AS INTEGER)"
+    return column
+
+
+def _copy_legacy_tables(cursor, schema: str, legacy: list[str]) -> None:
+    """Přenese data z <jméno>_legacy do nových tabulek (společné sloupce) a staré tabulky smaže."""
+    for table in legacy:
+        old = f"{table}_legacy"
+        old_columns = {row[1] for row in cursor.execute(f"PRAGMA {schema}.table_info({old})")}
+        columns = [row[1] for row in cursor.execute(f"PRAGMA {schema}.table_info({table})") if row[1] in old_columns]
+        expressions = ", ".join(_legacy_expression(table, column) for column in columns)
+        copied = cursor.execute(
+            f"INSERT INTO {schema}.{table} ({', '.join(columns)}) SELECT {expressions} FROM {schema}.{old}"
+        ).rowcount
+        # AUTOINCREMENT musí navázat na původní sekvenci - ID archivovaných výzev se nesmí opakovat
+        has_sequence = cursor.execute(
+            f"SELECT 1 FROM {schema}.sqlite_master WHERE name = 'sqlite_sequence'"
+        ).fetchone()
+        if has_sequence and cursor.execute(f"SELECT 1 FROM {schema}.sqlite_sequence WHERE name = ?", (old,)).fetchone():
+            cursor.execute(f"DELETE FROM {schema}.sqlite_sequence WHERE name = ?", (table,))
+            cursor.execute(f"UPDATE {schema}.sqlite_sequence SET name = ? WHERE name = ?", (table, old))
+        cursor.execute(f"DROP TABLE {schema}.{old}")
+        logger.info(f"Tabulka '{schema}.{table}' převedena na kompaktní schéma ({copied} řádků).")
+
+
+def _add_missing_columns(cursor, table: str, columns: dict[str, str]) -> None:
+    """Doplní do existující tabulky sloupce přidané v novější verzi schématu."""
+    existing = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+    for column, declaration in columns.items():
+        if column not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+            logger.info(f"Tabulka '{table}' doplněna o sloupec '{column}'.")
+
+
 def init_db():
-    """Inicializuje databázi a vytvoří tabulky, pokud neexistují."""
+    """Inicializuje databázi a vytvoří tabulky, pokud neexistují.
+
+    Databázi bez kompaktního kódování (user_version < 1) převede - tabulky se
+    přestaví v jedné transakci a pak VACUUM; novější verze jen doplní chybějící
+    tabulky. Aktuální schéma se nekontroluje ani nezapisuje (rychlý restart).
+    """
     conn = None  # Inicializace pro finally blok
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            if version > SCHEMA_VERSION:
+                logger.warning(f"Databáze má novější schéma (verze {version}) než tento kód ({SCHEMA_VERSION}).")
+            logger.info(f"Schéma databáze je aktuální (verze {version}).")
+            return
+
+        # Inkrementální vacuum, aby šlo po archivaci vracet volné stránky.
+        # Na existující databázi se režim projeví až po jednorázovém VACUUM.
+        if cursor.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            cursor.execute("VACUUM")
+            logger.info("Databáze převedena na auto_vacuum = INCREMENTAL.")
+
+        # Přestavba tabulek musí běžet bez kontroly FK (mimo transakci nastavitelné jen tady)
+        cursor.execute("PRAGMA foreign_keys = OFF")
+        cursor.execute("BEGIN IMMEDIATE")
+        legacy = []
+        if cursor.execute("PRAGMA user_version").fetchone()[0] < _COMPACT_VERSION:
+            legacy = _rename_legacy_tables(
+                cursor, "main",
+                ("users", "calls", "participations", "notification_outbox", "bot_state", "processed_updates"),
+            )
 
-        # Tabulka uživatelů
+        # Tabulka uživatelů (consent_status a state jsou kódy ze STATUS_CODES)
         cursor.execute(
-            """
+            f"""
         CREATE TABLE IF NOT EXISTS users (
             telegram_id INTEGER PRIMARY KEY,
             first_name TEXT,
             last_name TEXT,
             username TEXT,
-            consent_status TEXT DEFAULT 'pending',
-            state TEXT DEFAULT 'start',
-            joined_timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            consent_status INTEGER DEFAULT 0,
+            state INTEGER DEFAULT 0,
+            joined_timestamp INTEGER DEFAULT ({_NOW})
         );
         """
         )
@@ -53,44 +312,158 @@ def init_db():
 
         # Tabulka Calls (Výzvy)
         cursor.execute(
-            """
+            f"""
         CREATE TABLE IF NOT EXISTS calls (
             call_id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT NOT NULL,
             description TEXT,
             original_price REAL,
             deal_price REAL NOT NULL,
-            status TEXT DEFAULT 'active',
+            status INTEGER DEFAULT 0,
             data_needed TEXT,
             image_url TEXT,
-            start_at DATETIME,
-            end_at DATETIME,
+            start_at INTEGER,
+            end_at INTEGER,
             final_instructions TEXT,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            created_at INTEGER DEFAULT ({_NOW}),
+            closed_at INTEGER,
+            tenant TEXT NOT NULL DEFAULT 'default',
+            capacity INTEGER,
+            remaining INTEGER
         );
         """
         )
+        # Kapacita (verze 5): NULL = neomezeně, remaining = kusy, které ještě nikdo nerezervoval
+        _add_missing_columns(cursor, "calls", {"capacity": "INTEGER", "remaining": "INTEGER"})
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_calls_tenant_status ON calls (tenant, status)")
         logger.info("Tabulka 'calls' zkontrolována/vytvořena.")
 
-        # Tabulka Participations (Účasti)
+        # Tabulka Participations (Účasti) - klíčem je rovnou (user_id, call_id), bez rowid
         cursor.execute(
-            """
+            f"""
         CREATE TABLE IF NOT EXISTS participations (
-            participation_id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER NOT NULL,
             call_id INTEGER NOT NULL,
-            status TEXT DEFAULT 'interested',
+            status INTEGER DEFAULT 0,
             collected_data TEXT,
-            participation_timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            participation_timestamp INTEGER DEFAULT ({_NOW}),
+            reserved INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, call_id),
             FOREIGN KEY (user_id) REFERENCES users (telegram_id) ON DELETE CASCADE,
-            FOREIGN KEY (call_id) REFERENCES calls (call_id) ON DELETE CASCADE,
-            UNIQUE(user_id, call_id)
-        );
+            FOREIGN KEY (call_id) REFERENCES calls (call_id) ON DELETE CASCADE
+        ) WITHOUT ROWID;
         """
         )
+        _add_missing_columns(cursor, "participations", {"reserved": "INTEGER NOT NULL DEFAULT 0"})  # Rezervované kusy
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_participations_call ON participations (call_id, status)")
+        # Účasti změněné od daného času - obnova indexu segmentů (audience.py)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_participations_timestamp ON participations (participation_timestamp)")
         logger.info("Tabulka 'participations' zkontrolována/vytvořena.")
 
+        # Fronta odchozích notifikací (umožňuje navázat rozesílku po restartu)
+        cursor.execute(
+            f"""
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            notification_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            call_id INTEGER,
+            kind TEXT NOT NULL,
+            text TEXT NOT NULL,
+            status INTEGER DEFAULT 0,
+            attempts INTEGER DEFAULT 0,
+            created_at INTEGER DEFAULT ({_NOW}),
+            sent_at INTEGER,
+            tenant TEXT NOT NULL DEFAULT 'default',
+            UNIQUE(user_id, call_id, kind)
+        );
+        """
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_outbox_status ON notification_outbox (status, notification_id)"
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_outbox_tenant_status ON notification_outbox (tenant, status, notification_id)"
+        )
+        logger.info("Tabulka 'notification_outbox' zkontrolována/vytvořena.")
+
+        # Stav bota (např. poslední zpracovaný update_id) a okno zpracovaných updatů
+        cursor.execute(
+            """
+        CREATE TABLE IF NOT EXISTS bot_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        ) WITHOUT ROWID;
+        """
+        )
+        # update_id jsou unikátní jen v rámci jednoho bota
+        cursor.execute(
+            f"""
+        CREATE TABLE IF NOT EXISTS processed_updates (
+            tenant TEXT NOT NULL DEFAULT 'default',
+            update_id INTEGER NOT NULL,
+            processed_at INTEGER DEFAULT ({_NOW}),
+            PRIMARY KEY (tenant, update_id)
+        ) WITHOUT ROWID;
+        """
+        )
+        logger.info("Tabulky 'bot_state' a 'processed_updates' zkontrolovány/vytvořeny.")
+
+        # Rozpracované nákupy předané při restartu další instanci (data = JSON klíčů CheckoutSession)
+        cursor.execute(
+            f"""
+        CREATE TABLE IF NOT EXISTS checkout_sessions (
+            tenant TEXT NOT NULL DEFAULT 'default',
+            user_id INTEGER NOT NULL,
+            chat_id INTEGER,
+            data TEXT NOT NULL,
+            last_seen INTEGER DEFAULT ({_NOW}),
+            PRIMARY KEY (tenant, user_id)
+        ) WITHOUT ROWID;
+        """
+        )
+        logger.info("Tabulka 'checkout_sessions' zkontrolována/vytvořena.")
+
+        # Odběr souhrnů nových výzev; served_until = čas (epoch), do kterého už uživatel souhrn dostal
+        cursor.execute(
+            f"""
+        CREATE TABLE IF NOT EXISTS digest_subscriptions (
+            tenant TEXT NOT NULL DEFAULT 'default',
+            user_id INTEGER NOT NULL,
+            period INTEGER NOT NULL,
+            served_until INTEGER NOT NULL DEFAULT ({_NOW}),
+            PRIMARY KEY (tenant, user_id),
+            FOREIGN KEY (user_id) REFERENCES users (telegram_id) ON DELETE CASCADE
+        ) WITHOUT ROWID;
+        """
+        )
+        # Rozesílka čte odběratele jednoho období po dávkách podle user_id
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_digest_period ON digest_subscriptions (tenant, period, user_id)"
+        )
+        logger.info("Tabulka 'digest_subscriptions' zkontrolována/vytvořena.")
+
+        # Číselník kódů stavů - pro ruční dotazy, aplikace převádí podle STATUS_CODES
+        cursor.execute(
+            """
+        CREATE TABLE IF NOT EXISTS status_codes (
+            domain TEXT NOT NULL,
+            code INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            PRIMARY KEY (domain, code)
+        ) WITHOUT ROWID;
+        """
+        )
+        cursor.executemany(
+            "INSERT OR REPLACE INTO status_codes (domain, code, name) VALUES (?, ?, ?)",
+            [(domain, code, name) for domain, names in STATUS_CODES.items() for code, name in enumerate(names)],
+        )
+
+        _copy_legacy_tables(cursor, "main", legacy)
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
         conn.commit()  # Potvrdíme všechny změny
+        if legacy:
+            cursor.execute("VACUUM")  # Přestavěné tabulky uvolnily stránky, soubor zmenšíme
+            logger.info(f"Databáze převedena na kompaktní schéma (verze {_COMPACT_VERSION}).")
         logger.info("Inicializace databáze dokončena.")
 
     except sqlite3.Error as e:
@@ -106,13 +479,14 @@ def init_db():
 # --- Funkce pro práci s DB ---
 
 
-def get_active_calls():
-    """Načte všechny aktivní výzvy z databáze."""
+def get_active_calls(tenant: str = DEFAULT_TENANT):
+    """Načte všechny aktivní výzvy daného bota (tenantu) z databáze."""
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
         cursor.execute(
-            "SELECT call_id, name, description, original_price, deal_price FROM calls WHERE status = 'active' ORDER BY created_at DESC"
+            f"SELECT call_id, name, description, original_price, deal_price FROM calls WHERE tenant = ? AND status = {_codes('call', 'active')} ORDER BY created_at DESC",
+            (tenant,),
         )
         calls = cursor.fetchall()
         logger.info(
@@ -126,20 +500,23 @@ def get_active_calls():
 
 
 # --- NOVÁ FUNKCE ---
-def get_all_calls():
-    """Načte všechny výzvy z databáze bez ohledu na status."""
+def get_all_calls(include_archive: bool = False, tenant: str | None = None):
+    """Načte všechny výzvy z databáze bez ohledu na status.
+
+    S `include_archive=True` vrátí i výzvy přesunuté do archivu
+    (sloupec `archived` je pak 1). S `tenant` jen výzvy daného bota.
+    """
     calls = []  # Defaultní hodnota pro případ chyby
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(with_archive=include_archive)
         cursor = conn.cursor()
         # Vybereme ID, jméno a status, seřadíme podle ID nebo data vytvoření
-        cursor.execute(
-            """
-            SELECT call_id, name, status, created_at
-            FROM calls
-            ORDER BY call_id DESC
-        """
-        )
+        where = " WHERE tenant = :tenant" if tenant else ""
+        columns = f"call_id, name, {_decoded('call', 'status')}, {_datetime('created_at')}"
+        query = f"SELECT {columns}, 0 AS archived FROM calls{where}"
+        if include_archive:
+            query += f" UNION ALL SELECT {columns}, 1 AS archived FROM {ARCHIVE_SCHEMA}.calls{where}"
+        cursor.execute(query + " ORDER BY call_id DESC", {"tenant": tenant})
         calls = cursor.fetchall()
         conn.close()
         logger.info(f"DEBUG get_all_calls: Načteno řádků: {len(calls)}")
@@ -152,13 +529,18 @@ def get_all_calls():
 # --------------------
 
 
-def get_call_details(call_id: int):
-    """Načte všechny detaily konkrétní výzvy podle ID."""
+def get_call_details(call_id: int, include_archive: bool = False):
+    """Načte všechny detaily konkrétní výzvy podle ID (volitelně i z archivu)."""
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(with_archive=include_archive)
         cursor = conn.cursor()
-        cursor.execute("SELECT * FROM calls WHERE call_id = ?", (call_id,))
+        cursor.execute(f"SELECT {_CALL_SELECT} FROM calls WHERE call_id = ?", (call_id,))
         call = cursor.fetchone()
+        if call is None and include_archive:
+            cursor.execute(
+                f"SELECT {_ARCHIVED_CALL_SELECT} FROM {ARCHIVE_SCHEMA}.calls WHERE call_id = ?", (call_id,)
+            )
+            call = cursor.fetchone()
         conn.close()
         return call
     except sqlite3.Error as e:
@@ -166,10 +548,11 @@ def get_call_details(call_id: int):
         return None
 
 
+@writes
 def update_user_consent(user_id: int, consent_status: str):
     """Aktualizuje stav souhlasu uživatele."""
-    allowed_statuses = ["pending", "granted", "denied"]
-    if consent_status not in allowed_statuses:
+    code = status_code("consent", consent_status)
+    if code is None:
         logger.error(
             f"Neplatný consent_status '{consent_status}' pro uživatele {user_id}"
         )
@@ -179,7 +562,7 @@ def update_user_consent(user_id: int, consent_status: str):
         cursor = conn.cursor()
         cursor.execute(
             "UPDATE users SET consent_status = ? WHERE telegram_id = ?",
-            (consent_status, user_id),
+            (code, user_id),
         )
         conn.commit()
         conn.close()
@@ -192,13 +575,30 @@ def update_user_consent(user_id: int, consent_status: str):
         return False
 
 
+def get_user_consent(user_id: int) -> str | None:
+    """Vrátí consent_status uživatele, nebo None, pokud uživatel není v DB."""
+    try:
+        conn = get_db_connection()
+        row = conn.execute(
+            "SELECT consent_status FROM users WHERE telegram_id = ?", (user_id,)
+        ).fetchone()
+        conn.close()
+        return status_name("consent", row["consent_status"]) if row else None
+    except sqlite3.Error as e:
+        logger.error(f"Chyba při načítání souhlasu uživatele {user_id}: {e}")
+        return None
+
+
+@writes
 def add_or_update_user(user_id: int, first_name: str, last_name: str, username: str):
     """Přidá nebo aktualizuje uživatele."""
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
         cursor.execute(
-            "INSERT INTO users (telegram_id, first_name, last_name, username) VALUES (?, ?, ?, ?) ON CONFLICT(telegram_id) DO UPDATE SET first_name=excluded.first_name, last_name=excluded.last_name, username=excluded.username, joined_timestamp=CURRENT_TIMESTAMP",
+            # Nezměněný profil se nepřepisuje (ani joined_timestamp)
+            f"INSERT INTO users (telegram_id, first_name, last_name, username) VALUES (?, ?, ?, ?) ON CONFLICT(telegram_id) DO UPDATE SET first_name=excluded.first_name, last_name=excluded.last_name, username=excluded.username, joined_timestamp={_NOW} "
+            "WHERE first_name IS NOT excluded.first_name OR last_name IS NOT excluded.last_name OR username IS NOT excluded.username",
             (user_id, first_name or "", last_name or "", username or ""),
         )
         conn.commit()
@@ -210,17 +610,32 @@ def add_or_update_user(user_id: int, first_name: str, last_name: str, username:
         return False
 
 
-def add_or_update_participation(
-    user_id: int, call_id: int, status: str, collected_data: dict = None
-):
-    """Přidá nebo aktualizuje účast uživatele ve výzvě (ukládá data jako JSON)."""
-    allowed_statuses = ["interested", "data_collected", "confirmed", "cancelled"]
+# Rezervace kusů výzvy s kapacitou: sklad (calls.remaining) se posune o rozdíl nové
+# a dosavadní rezervace účasti. Podmínka ve WHERE brání přeprodání i při souběhu - bez
+# čtení předem, takže transakce začíná rovnou zápisem a drží zámek DB jen na dva příkazy.
+_HELD = "COALESCE((SELECT reserved FROM participations WHERE user_id = :user_id AND call_id = :call_id), 0)"
+_RESERVE_STOCK = (
+    f"UPDATE calls SET remaining = remaining - (:reserved - {_HELD}) "
+    f"WHERE call_id = :call_id AND remaining >= :reserved - {_HELD} RETURNING remaining"
+)
+# reserved NULL = rezervaci ponechat beze změny (účast bez udaného počtu kusů)
+_UPSERT_PARTICIPATION = (
+    "INSERT INTO participations (user_id, call_id, status, collected_data, reserved) "
+    "VALUES (:user_id, :call_id, :status, :data, COALESCE(:reserved, 0)) "
+    f"ON CONFLICT(user_id, call_id) DO UPDATE SET status=excluded.status, collected_data=CASE WHEN excluded.status = {_codes('participation', 'cancelled')} THEN NULL ELSE excluded.collected_data END, "
+    f"reserved=COALESCE(:reserved, reserved), participation_timestamp={_NOW}"
+)
+
+
+def _participation_params(user_id: int, call_id: int, status: str, collected_data: dict | None) -> dict | None:
+    """Parametry upsertu účasti (kód stavu, údaje jako JSON), None při neplatném vstupu."""
+    code = status_code("participation", status)
     data_json = None
-    if status not in allowed_statuses:
+    if code is None:
         logger.error(
             f"Neplatný participation status '{status}' pro user {user_id}, call {call_id}"
         )
-        return False
+        return None
     if collected_data is not None and status != "cancelled":
         try:
             data_json = json.dumps(collected_data, ensure_ascii=False)
@@ -228,23 +643,151 @@ def add_or_update_participation(
             logger.error(
                 f"Chyba při převodu collected_data na JSON pro user {user_id}, call {call_id}: {e}"
             )
-            return False
+            return None
+    return {"user_id": user_id, "call_id": call_id, "status": code, "data": data_json, "reserved": None}
+
+
+@writes
+def add_or_update_participation(
+    user_id: int, call_id: int, status: str, collected_data: dict = None
+):
+    """Přidá nebo aktualizuje účast uživatele ve výzvě (ukládá data jako JSON).
+
+    Zrušení účasti ve stejné transakci vrátí její rezervované kusy do skladu výzvy.
+    """
+    params = _participation_params(user_id, call_id, status, collected_data)
+    if params is None:
+        return False
+    conn = None
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO participations (user_id, call_id, status, collected_data) VALUES (?, ?, ?, ?) ON CONFLICT(user_id, call_id) DO UPDATE SET status=excluded.status, collected_data=CASE WHEN excluded.status = 'cancelled' THEN NULL ELSE excluded.collected_data END, participation_timestamp=CURRENT_TIMESTAMP",
-            (user_id, call_id, status, data_json),
-        )
+        if status == "cancelled":
+            params["reserved"] = 0
+            cursor.execute(_RESERVE_STOCK, params).fetchall()  # U výzvy bez kapacity nic nezmění
+        cursor.execute(_UPSERT_PARTICIPATION, params)
         conn.commit()
-        conn.close()
         logger.info(
             f"Účast pro user {user_id}, call {call_id} přidána/aktualizována na status {status}."
         )
         return True
     except sqlite3.Error as e:
         logger.error(f"Chyba při ukládání účasti user {user_id}, call {call_id}: {e}")
+        if conn:
+            conn.rollback()  # Vrácené kusy zrušení nesmí zůstat viset
         return False
+    finally:
+        if conn:
+            conn.close()
+
+
+def reserve_participation(user_id: int, call_id: int, status: str, collected_data: dict | None, quantity: int) -> dict | None:
+    """Uloží účast a rezervuje pro ni `quantity` kusů výzvy (přepíše dosavadní rezervaci).
+
+    Vrací {'reserved': bool, 'remaining': volné kusy (None u výzvy bez kapacity)},
+    None při chybě. Vyprodanou výzvu pozná už čtením, bez zápisového zámku - při
+    náporu na žhavou výzvu tak pozdě příchozí nečekají ve frontě zápisů.
+    """
+    try:
+        conn = get_db_connection()
+        stock = conn.execute(
+            "SELECT c.remaining, COALESCE(p.reserved, 0) AS held FROM calls c "
+            "LEFT JOIN participations p ON p.call_id = c.call_id AND p.user_id = ? WHERE c.call_id = ?",
+            (user_id, call_id),
+        ).fetchone()
+        conn.close()
+    except sqlite3.Error as e:
+        logger.error(f"Chyba při kontrole skladu výzvy {call_id}: {e}")
+        return None
+    if stock is not None and stock["remaining"] is not None and quantity - stock["held"] > stock["remaining"]:
+        return {"reserved": False, "remaining": stock["remaining"]}
+    return store_reservation(user_id, call_id, status, collected_data, quantity)
+
+
+@writes
+def store_reservation(user_id: int, call_id: int, status: str, collected_data: dict | None, quantity: int) -> dict | None:
+    """Zápisová část reserve_participation: posun skladu a upsert účasti v jedné transakci."""
+    params = _participation_params(user_id, call_id, status, collected_data)
+    if params is None:
+        return None
+    params["reserved"] = quantity
+    conn = None
+    try:
+        conn = get_db_connection()
+        stock = conn.execute(_RESERVE_STOCK, params).fetchall()
+        if not stock:
+            # Buď výzva bez kapacity (remaining NULL), nebo kusy mezitím došly
+            row = conn.execute("SELECT remaining FROM calls WHERE call_id = ?", (call_id,)).fetchone()
+            if row is not None and row["remaining"] is not None:
+                conn.rollback()
+                logger.info(f"Rezervace {quantity} ks výzvy {call_id} pro user {user_id} odmítnuta, zbývá {row['remaining']}.")
+                return {"reserved": False, "remaining": row["remaining"]}
+        conn.execute(_UPSERT_PARTICIPATION, params)
+        conn.commit()
+        logger.info(f"Účast user {user_id}, call {call_id} uložena se stavem {status} a rezervací {quantity} ks.")
+        return {"reserved": True, "remaining": stock[0]["remaining"] if stock else None}
+    except sqlite3.Error as e:
+        logger.error(f"Chyba při rezervaci kusů výzvy {call_id} pro user {user_id}: {e}")
+        if conn:
+            conn.rollback()  # Odečtené kusy bez uložené účasti by se ztratily
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+
+@writes
+def release_reservations(pairs: list[tuple[int, int]]) -> int | None:
+    """Vrátí do skladu kusy rozpracovaných účastí (user_id, call_id) - vypršelý nákup.
+
+    Týká se jen účastí ve stavu 'interested'; dokončené (údaje vyplněné) si rezervaci
+    nechávají. Vrací počet uvolněných rezervací, nebo None při chybě.
+    """
+    pending = f"user_id = :user_id AND call_id = :call_id AND status = {_codes('participation', 'interested')} AND reserved > 0"
+    conn = None
+    try:
+        conn = get_db_connection()
+        released = 0
+        for user_id, call_id in pairs:
+            params = {"user_id": user_id, "call_id": call_id}
+            conn.execute(
+                f"UPDATE calls SET remaining = remaining + (SELECT reserved FROM participations WHERE {pending}) "
+                f"WHERE call_id = :call_id AND remaining IS NOT NULL AND EXISTS (SELECT 1 FROM participations WHERE {pending})",
+                params,
+            )
+            released += conn.execute(f"UPDATE participations SET reserved = 0 WHERE {pending}", params).rowcount
+        conn.commit()
+        if released:
+            logger.info(f"Uvolněno {released} rezervací vypršelých nákupů.")
+        return released
+    except sqlite3.Error as e:
+        logger.error(f"Chyba při uvolňování rezervací: {e}")
+        if conn:
+            conn.rollback()
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+
+def get_stale_reservations(older_than: int, tenant: str = DEFAULT_TENANT, shard: int = 0, shards: int = 1) -> list[tuple[int, int]]:
+    """Rozpracované účasti s rezervací, které se nezměnily `older_than` sekund (např. po pádu instance).
+
+    Ve více procesech jen uživatelé `user_id % shards == shard` (živé nákupy ostatních nevidíme).
+    """
+    try:
+        conn = get_db_connection()
+        rows = conn.execute(
+            f"SELECT p.user_id, p.call_id FROM calls c JOIN participations p ON p.call_id = c.call_id "
+            f"WHERE c.tenant = ? AND c.remaining IS NOT NULL AND p.status = {_codes('participation', 'interested')} "
+            f"AND p.reserved > 0 AND p.participation_timestamp < {_NOW} - ? AND p.user_id % ? = ?",
+            (tenant, older_than, shards, shard),
+        ).fetchall()
+        conn.close()
+        return [(row["user_id"], row["call_id"]) for row in rows]
+    except sqlite3.Error as e:
+        logger.error(f"Chyba při hledání starých rezervací: {e}")
+        return []
 
 
 def get_participation(user_id: int, call_id: int):
@@ -254,7 +797,7 @@ def get_participation(user_id: int, call_id: int):
         conn = get_db_connection()
         cursor = conn.cursor()
         cursor.execute(
-            "SELECT * FROM participations WHERE user_id = ? AND call_id = ?",
+            f"SELECT user_id, call_id, {_decoded('participation', 'status')}, collected_data, {_datetime('participation_timestamp')} FROM participations WHERE user_id = ? AND call_id = ?",
             (user_id, call_id),
         )
         participation_row = cursor.fetchone()
@@ -279,15 +822,15 @@ def get_participation(user_id: int, call_id: int):
         return None
 
 
-def get_user_active_participations(user_id: int):
-    """Načte aktivní účasti uživatele a připojí název výzvy."""
+def get_user_active_participations(user_id: int, tenant: str = DEFAULT_TENANT):
+    """Načte aktivní účasti uživatele ve výzvách daného bota a připojí název výzvy."""
     participations = []
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
         cursor.execute(
-            "SELECT p.participation_id, p.call_id, p.status, c.name as call_name FROM participations p JOIN calls c ON p.call_id = c.call_id WHERE p.user_id = ? AND p.status IN ('interested', 'data_collected', 'confirmed') ORDER BY p.participation_timestamp DESC",
-            (user_id,),
+            f"SELECT p.call_id, {_decoded('participation', 'p.status')}, c.name as call_name FROM participations p JOIN calls c ON p.call_id = c.call_id WHERE p.user_id = ? AND c.tenant = ? AND p.status IN ({_codes('participation', 'interested', 'data_collected', 'confirmed')}) ORDER BY p.participation_timestamp DESC",
+            (user_id, tenant),
         )
         participations = cursor.fetchall()
         conn.close()
@@ -299,6 +842,7 @@ def get_user_active_participations(user_id: int):
         return []
 
 
+@writes
 def add_new_call(
     name: str,
     description: str | None,
@@ -310,25 +854,37 @@ def add_new_call(
     image_url: str | None = None,
     start_at: str | None = None,
     end_at: str | None = None,
+    tenant: str = DEFAULT_TENANT,
+    capacity: int | None = None,
 ) -> int | None:
-    """Vloží novou výzvu do databáze a vrátí její ID, nebo None při chybě."""
+    """Vloží novou výzvu (daného bota) do databáze a vrátí její ID, nebo None při chybě.
+
+    `capacity` omezí počet kusů, které si účastníci mohou rezervovat (None = neomezeně).
+    """
+    code = status_code("call", status)
+    if code is None:
+        logger.error(f"Neplatný status výzvy '{status}' pro '{name}'")
+        return None
     conn = None
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
         cursor.execute(
-            "INSERT INTO calls (name, description, original_price, deal_price, status, data_needed, image_url, start_at, end_at, final_instructions) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            "INSERT INTO calls (name, description, original_price, deal_price, status, data_needed, image_url, start_at, end_at, final_instructions, tenant, capacity, remaining) VALUES (?, ?, ?, ?, ?, ?, ?, CAST(strftime('%s', ?) AS INTEGER), CAST(strftime('%s', ?) AS INTEGER), ?, ?, ?, ?)",
             (
                 name,
                 description,
                 original_price,
                 deal_price,
-                status,
+                code,
                 data_needed,
                 image_url,
                 start_at,
                 end_at,
                 final_instructions,
+                tenant,
+                capacity,
+                capacity,
             ),
         )
         conn.commit()
@@ -342,3 +898,528 @@ def add_new_call(
             conn.rollback()
             conn.close()
             return None
+
+
+@writes
+def close_call(call_id: int) -> bool:
+    """Uzavře výzvu a zaznamená čas uzavření (od něj se počítá retence archivu)."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            f"UPDATE calls SET status = {_codes('call', 'closed')}, closed_at = {_NOW} WHERE call_id = ? AND status != {_codes('call', 'closed')}",
+            (call_id,),
+        )
+        conn.commit()
+        updated = cursor.rowcount > 0
+        conn.close()
+        logger.info(f"Výzva {call_id} uzavřena: {updated}")
+        return updated
+    except sqlite3.Error as e:
+        logger.error(f"Chyba při uzavírání výzvy {call_id}: {e}")
+        return False
+
+
+@writes
+def archive_closed_calls(retention_days: int = 30, batch_size: int = 50):
+    """Přesune uzavřené výzvy starší než retence i s účastmi do archivní DB.
+
+    Každá dávka výzev se přesouvá v jedné transakci (přes obě připojená
+    schémata), po přesunu se uvolněné stránky vrátí systému pomocí
+    `PRAGMA incremental_vacuum`. Vrací slovník se statistikou, nebo None při chybě.
+    """
+    conn = None
+    stats = {"calls": 0, "participations": 0, "freed_pages": 0}
+    try:
+        conn = get_db_connection(with_archive=True)
+        cursor = conn.cursor()
+        # closed_at mají jen výzvy uzavřené přes close_call, starší záznamy berou end_at/created_at
+        cursor.execute(
+            f"SELECT call_id FROM calls WHERE status = {_codes('call', 'closed')} AND COALESCE(closed_at, end_at, created_at) <= CAST(strftime('%s', 'now', ?) AS INTEGER) ORDER BY call_id",
+            (f"-{int(retention_days)} days",),
+        )
+        call_ids = [row["call_id"] for row in cursor.fetchall()]
+        if not call_ids:
+            logger.info("Archivace: žádné výzvy k přesunu.")
+            return stats
+
+        for start in range(0, len(call_ids), batch_size):
+            batch = call_ids[start : start + batch_size]
+            placeholders = ", ".join("?" for _ in batch)
+            with conn:  # Jedna transakce na dávku, při chybě rollback
+                cursor.execute(
+                    f"INSERT OR REPLACE INTO {ARCHIVE_SCHEMA}.calls ({_CALL_COLUMNS}) SELECT {_CALL_COLUMNS} FROM calls WHERE call_id IN ({placeholders})",
+                    batch,
+                )
+                cursor.execute(
+                    f"INSERT OR REPLACE INTO {ARCHIVE_SCHEMA}.participations ({_PARTICIPATION_COLUMNS}) SELECT {_PARTICIPATION_COLUMNS} FROM participations WHERE call_id IN ({placeholders})",
+                    batch,
+                )
+                stats["participations"] += cursor.execute(
+                    f"DELETE FROM participations WHERE call_id IN ({placeholders})", batch
+                ).rowcount
+                stats["calls"] += cursor.execute(
+                    f"DELETE FROM calls WHERE call_id IN ({placeholders})", batch
+                ).rowcount
+            logger.info(f"Archivace: přesunuta dávka {len(batch)} výzev.")
+
+        free_before = cursor.execute("PRAGMA main.freelist_count").fetchone()[0]
+        # Pragma uvolňuje stránky postupně při každém kroku, executescript ji dokrokuje celou
+        conn.executescript("PRAGMA main.incremental_vacuum;")
+        free_after = cursor.execute("PRAGMA main.freelist_count").fetchone()[0]
+        stats["freed_pages"] = free_before - free_after
+        logger.info(
+            f"Archivace dokončena: {stats['calls']} výzev, {stats['participations']} účastí, uvolněno {stats['freed_pages']} stránek."
+        )
+        return stats
+    except sqlite3.Error as e:
+        logger.error(f"Chyba při archivaci uzavřených výzev: {e}")
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+
+@writes
+def confirm_call_participations(call_id: int, render_message) -> int | None:
+    """Hromadně potvrdí všechny účasti se stavem 'data_collected' ve výzvě.
+
+    Změna stavu i zařazení notifikací do `notification_outbox` proběhne v jedné
+    transakci. `render_message(call, participant)` dostane řádek výzvy a slovník
+    účastníka (user_id, first_name, collected_data) a vrátí text notifikace.
+    Vrací počet potvrzených účastí, nebo None při chybě.
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        # IMMEDIATE zamkne zápis hned, aby mezi SELECT a UPDATE nepřibyla další účast
+        cursor.execute("BEGIN IMMEDIATE")
+        call = cursor.execute(f"SELECT {_CALL_SELECT} FROM calls WHERE call_id = ?", (call_id,)).fetchone()
+        if call is None:
+            conn.rollback()
+            logger.warning(f"Hromadné potvrzení: výzva {call_id} neexistuje.")
+            return None
+        cursor.execute(
+            f"SELECT p.user_id, p.collected_data, u.first_name FROM participations p JOIN users u ON u.telegram_id = p.user_id WHERE p.call_id = ? AND p.status = {_codes('participation', 'data_collected')}",
+            (call_id,),
+        )
+        notifications = []
+        for row in cursor.fetchall():
+            try:
+                collected_data = json.loads(row["collected_data"]) if row["collected_data"] else {}
+            except json.JSONDecodeError:
+                logger.error(f"Chyba dekódování JSON pro user {row['user_id']}, call {call_id}")
+                collected_data = {}
+            participant = {
+                "user_id": row["user_id"],
+                "first_name": row["first_name"],
+                "collected_data": collected_data,
+            }
+            notifications.append((row["user_id"], call_id, "confirmed", render_message(call, participant), call["tenant"]))
+
+        confirmed = cursor.execute(
+            f"UPDATE participations SET status = {_codes('participation', 'confirmed')}, participation_timestamp = {_NOW} WHERE call_id = ? AND status = {_codes('participation', 'data_collected')}",
+            (call_id,),
+        ).rowcount
+        cursor.executemany(
+            "INSERT OR IGNORE INTO notification_outbox (user_id, call_id, kind, text, tenant) VALUES (?, ?, ?, ?, ?)",
+            notifications,
+        )
+        conn.commit()
+        logger.info(f"Hromadně potvrzeno {confirmed} účastí ve výzvě {call_id}.")
+        return confirmed
+    except sqlite3.Error as e:
+        logger.error(f"Chyba při hromadném potvrzení účastí ve výzvě {call_id}: {e}")
+        if conn:
+            conn.rollback()
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+
+def get_pending_notifications(limit: int = 100, tenant: str = DEFAULT_TENANT):
+    """Načte dávku dosud neodeslaných notifikací daného bota v pořadí zařazení."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT notification_id, user_id, call_id, kind, text, attempts FROM notification_outbox WHERE status = {_codes('outbox', 'pending')} AND tenant = ? ORDER BY notification_id LIMIT ?",
+            (tenant, limit),
+        )
+        notifications = cursor.fetchall()
+        conn.close()
+        return notifications
+    except sqlite3.Error as e:
+        logger.error(f"Chyba při načítání čekajících notifikací: {e}")
+        return []
+
+
+@writes
+def mark_notifications_sent(notification_ids: list[int]) -> bool:
+    """Označí dávku notifikací jako odeslanou (jeden commit na dávku)."""
+    if not notification_ids:
+        return True
+    try:
+        conn = get_db_connection()
+        conn.executemany(
+            f"UPDATE notification_outbox SET status = {_codes('outbox', 'sent')}, sent_at = {_NOW} WHERE notification_id = ?",
+            [(notification_id,) for notification_id in notification_ids],
+        )
+        conn.commit()
+        conn.close()
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Chyba při označování odeslaných notifikací: {e}")
+        return False
+
+
+@writes
+def mark_notification_failed(notification_id: int, max_attempts: int = 3, permanent: bool = False) -> bool:
+    """Zvýší počet pokusů; po vyčerpání (nebo při trvalé chybě) notifikaci vyřadí."""
+    try:
+        conn = get_db_connection()
+        conn.execute(
+            f"UPDATE notification_outbox SET attempts = attempts + 1, status = CASE WHEN ? OR attempts + 1 >= ? THEN {_codes('outbox', 'failed')} ELSE status END WHERE notification_id = ?",
+            (permanent, max_attempts, notification_id),
+        )
+        conn.commit()
+        conn.close()
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Chyba při označování neúspěšné notifikace {notification_id}: {e}")
+        return False
+
+
+def _state_key(key: str, tenant: str) -> str:
+    # Výchozí tenant používá holé klíče (kompatibilita s jednobotovým provozem)
+    return key if tenant == DEFAULT_TENANT else f"{tenant}:{key}"
+
+
+def get_bot_state(key: str, default: str | None = None, tenant: str = DEFAULT_TENANT) -> str | None:
+    """Načte hodnotu ze stavové tabulky bota."""
+    try:
+        conn = get_db_connection()
+        row = conn.execute("SELECT value FROM bot_state WHERE key = ?", (_state_key(key, tenant),)).fetchone()
+        conn.close()
+        return row["value"] if row else default
+    except sqlite3.Error as e:
+        logger.error(f"Chyba při načítání stavu bota '{key}': {e}")
+        return default
+
+
+def get_recent_update_ids(limit: int, tenant: str = DEFAULT_TENANT) -> list[int]:
+    """Vrátí ID naposledy zpracovaných updatů bota (vzestupně), nejvýše `limit`."""
+    try:
+        conn = get_db_connection()
+        rows = conn.execute(
+            "SELECT update_id FROM processed_updates WHERE tenant = ? ORDER BY update_id DESC LIMIT ?",
+            (tenant, limit),
+        ).fetchall()
+        conn.close()
+        return [row["update_id"] for row in reversed(rows)]
+    except sqlite3.Error as e:
+        logger.error(f"Chyba při načítání zpracovaných updatů: {e}")
+        return []
+
+
+def _save_update_offset(conn, offset: int, tenant: str) -> None:
+    # Offset jen roste (souběžné zápisy i předchozí instance)
+    conn.execute(
+        "INSERT INTO bot_state (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = MAX(CAST(value AS INTEGER), CAST(excluded.value AS INTEGER))",
+        (_state_key("last_update_id", tenant), offset),
+    )
+
+
+@writes
+def save_update_offset(offset: int, tenant: str = DEFAULT_TENANT) -> bool:
+    """Posune uložený offset (souvislou hranici dokončených updatů) - supervisor v režimu workerů."""
+    try:
+        conn = get_db_connection()
+        _save_update_offset(conn, offset, tenant)
+        conn.commit()
+        conn.close()
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Chyba při ukládání offsetu updatů {offset}: {e}")
+        return False
+
+
+@writes
+def mark_update_processed(update_id: int, window: int, prune: bool = False, tenant: str = DEFAULT_TENANT,
+                          offset: int | None = None) -> bool:
+    """Zapíše zpracovaný update a posune uložený offset na `offset` v jedné transakci.
+
+    `offset` je souvislá hranice dokončených updatů (ne nutně `update_id`), None offset
+    nemění. S `prune=True` zároveň smaže záznamy starší než okno posledních `window` updatů.
+    """
+    try:
+        conn = get_db_connection()
+        conn.execute("INSERT OR IGNORE INTO processed_updates (tenant, update_id) VALUES (?, ?)", (tenant, update_id))
+        if offset:
+            _save_update_offset(conn, offset, tenant)
+        if prune:
+            conn.execute("DELETE FROM processed_updates WHERE tenant = ? AND update_id <= ?", (tenant, update_id - window))
+        conn.commit()
+        conn.close()
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Chyba při ukládání zpracovaného updatu {update_id}: {e}")
+        return False
+
+
+# --- Předání provozu mezi instancemi (viz lifecycle.py) ---
+@writes
+def acquire_lease(name: str, owner: str, ttl_seconds: int, replace: str | None = None) -> bool | None:
+    """Získá nebo prodlouží lease `name` (záznam v bot_state) pro `owner` na `ttl_seconds`.
+
+    Uspěje, pokud lease nikdo nedrží, drží ho už `owner`, vypršel, nebo má
+    přesně hodnotu `replace` (převzetí po mrtvém procesu - compare-and-swap).
+    False = lease drží někdo jiný, None = chyba DB (např. zamčená) - o lease nic neříká.
+    """
+    try:
+        conn = get_db_connection()
+        cursor = conn.execute(
+            f"""INSERT INTO bot_state (key, value) VALUES (?, json_object('owner', ?, 'expires', {_NOW} + ?))
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+            WHERE json_extract(bot_state.value, '$.owner') = ? OR json_extract(bot_state.value, '$.expires') < {_NOW} OR bot_state.value = ?""",
+            (name, owner, ttl_seconds, owner, replace),
+        )
+        acquired = cursor.rowcount == 1
+        conn.commit()
+        conn.close()
+        return acquired
+    except sqlite3.Error as e:
+        logger.error(f"Chyba při získávání lease '{name}': {e}")
+        return None
+
+
+@writes
+def release_lease(name: str, owner: str) -> bool:
+    """Uvolní lease, pokud ho drží `owner`."""
+    try:
+        conn = get_db_connection()
+        conn.execute("DELETE FROM bot_state WHERE key = ? AND json_extract(value, '$.owner') = ?", (name, owner))
+        conn.commit()
+        conn.close()
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Chyba při uvolňování lease '{name}': {e}")
+        return False
+
+
+@writes
+def save_checkout_sessions(sessions: list[tuple], tenant: str = DEFAULT_TENANT) -> bool:
+    """Uloží rozpracované nákupy (user_id, chat_id, data, last_seen) pro převzetí jinou instancí."""
+    try:
+        conn = get_db_connection()
+        conn.executemany(
+            "INSERT OR REPLACE INTO checkout_sessions (tenant, user_id, chat_id, data, last_seen) VALUES (?, ?, ?, ?, ?)",
+            [(tenant, user_id, chat_id, json.dumps(data, ensure_ascii=False), last_seen)
+             for user_id, chat_id, data, last_seen in sessions],
+        )
+        conn.commit()
+        conn.close()
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Chyba při ukládání rozpracovaných nákupů: {e}")
+        return False
+
+
+@writes
+def take_checkout_sessions(tenant: str = DEFAULT_TENANT, shard: int = 0, shards: int = 1) -> list[dict]:
+    """Načte a smaže uložené nákupy bota (jen uživatele `user_id % shards == shard`)."""
+    try:
+        conn = get_db_connection()
+        rows = conn.execute(
+            "SELECT user_id, chat_id, data, last_seen FROM checkout_sessions WHERE tenant = ? AND user_id % ? = ?",
+            (tenant, shards, shard),
+        ).fetchall()
+        conn.executemany(
+            "DELETE FROM checkout_sessions WHERE tenant = ? AND user_id = ?",
+            [(tenant, row["user_id"]) for row in rows],
+        )
+        conn.commit()
+        conn.close()
+        return [{"user_id": row["user_id"], "chat_id": row["chat_id"], "data": json.loads(row["data"]),
+                 "last_seen": row["last_seen"]} for row in rows]
+    except sqlite3.Error as e:
+        logger.error(f"Chyba při načítání rozpracovaných nákupů: {e}")
+        return []
+
+
+# --- Souhrny nových výzev (viz notifications.deliver_digest) ---
+@writes
+def set_digest_subscription(user_id: int, period: str | None, tenant: str = DEFAULT_TENANT) -> bool:
+    """Přihlásí uživatele k souhrnu ('daily'/'weekly'), None odběr zruší.
+
+    Nový odběratel dostane jen výzvy vytvořené po přihlášení; změna období
+    zachová, kam až už souhrny dostal.
+    """
+    try:
+        conn = get_db_connection()
+        if period is None:
+            conn.execute("DELETE FROM digest_subscriptions WHERE tenant = ? AND user_id = ?", (tenant, user_id))
+        else:
+            code = status_code("digest", period)
+            if code is None:
+                conn.close()
+                logger.error(f"Neplatné období souhrnu '{period}' pro user {user_id}")
+                return False
+            conn.execute(
+                "INSERT INTO digest_subscriptions (tenant, user_id, period) VALUES (?, ?, ?) ON CONFLICT(tenant, user_id) DO UPDATE SET period = excluded.period",
+                (tenant, user_id, code),
+            )
+        conn.commit()
+        conn.close()
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Chyba při ukládání odběru souhrnu user {user_id}: {e}")
+        return False
+
+
+def get_digest_subscription(user_id: int, tenant: str = DEFAULT_TENANT) -> str | None:
+    """Období odběru souhrnu uživatele ('daily'/'weekly'), nebo None."""
+    try:
+        conn = get_db_connection()
+        row = conn.execute("SELECT period FROM digest_subscriptions WHERE tenant = ? AND user_id = ?", (tenant, user_id)).fetchone()
+        conn.close()
+        return status_name("digest", row["period"]) if row else None
+    except sqlite3.Error as e:
+        logger.error(f"Chyba při načítání odběru souhrnu user {user_id}: {e}")
+        return None
+
+
+def count_digest_subscriptions(tenant: str = DEFAULT_TENANT) -> dict:
+    """Počet odběratelů podle období (pro /stats)."""
+    try:
+        conn = get_db_connection()
+        rows = conn.execute("SELECT period, COUNT(*) AS count FROM digest_subscriptions WHERE tenant = ? GROUP BY period", (tenant,)).fetchall()
+        conn.close()
+        return {status_name("digest", row["period"]): row["count"] for row in rows}
+    except sqlite3.Error as e:
+        logger.error(f"Chyba při počítání odběratelů souhrnu: {e}")
+        return {}
+
+
+def get_digest_recipients(period: str, cutoff: int, after_user_id: int = 0, limit: int = 100,
+                          tenant: str = DEFAULT_TENANT, shard: int = 0, shards: int = 1):
+    """Další dávka odběratelů `period` se souhlasem, kteří souhrn do `cutoff` ještě nedostali.
+
+    Čte se podle user_id (za `after_user_id`), ve více procesech jen `user_id % shards == shard`.
+    """
+    try:
+        conn = get_db_connection()
+        rows = conn.execute(
+            f"""SELECT d.user_id, d.served_until FROM digest_subscriptions d JOIN users u ON u.telegram_id = d.user_id
+            WHERE d.tenant = ? AND d.period = ? AND d.user_id > ? AND d.served_until < ? AND d.user_id % ? = ?
+            AND u.consent_status = {_codes('consent', 'granted')}
+            ORDER BY d.user_id LIMIT ?""",
+            (tenant, status_code("digest", period), after_user_id, cutoff, shards, shard, limit),
+        ).fetchall()
+        conn.close()
+        return rows
+    except sqlite3.Error as e:
+        logger.error(f"Chyba při načítání odběratelů souhrnu: {e}")
+        return []
+
+
+def get_digest_calls(since: int, cutoff: int, tenant: str = DEFAULT_TENANT):
+    """Aktivní výzvy bota vytvořené v intervalu (since, cutoff] (created = epoch), nejstarší první."""
+    try:
+        conn = get_db_connection()
+        rows = conn.execute(
+            f"""SELECT call_id, name, description, original_price, deal_price, created_at AS created FROM calls
+            WHERE tenant = ? AND status = {_codes('call', 'active')} AND created_at > ? AND created_at <= ?
+            ORDER BY created_at, call_id""",
+            (tenant, since, cutoff),
+        ).fetchall()
+        conn.close()
+        return rows
+    except sqlite3.Error as e:
+        logger.error(f"Chyba při načítání výzev pro souhrn: {e}")
+        return []
+
+
+@writes
+def mark_digest_served(user_ids: list[int], cutoff: int, tenant: str = DEFAULT_TENANT) -> bool:
+    """Zapíše, že uživatelé dostali souhrn do `cutoff` (jedna transakce na dávku)."""
+    if not user_ids:
+        return True
+    try:
+        conn = get_db_connection()
+        conn.executemany(
+            "UPDATE digest_subscriptions SET served_until = MAX(served_until, ?) WHERE tenant = ? AND user_id = ?",
+            [(cutoff, tenant, user_id) for user_id in user_ids],
+        )
+        conn.commit()
+        conn.close()
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Chyba při ukládání stavu souhrnu: {e}")
+        return False
+
+
+# --- Segmenty uživatelů (viz audience.py) ---
+def get_audience_rows(user_ids: list[int] | None = None):
+    """Účasti s výzvou (tenant, název, cena) seřazené podle uživatele; None = všechny, jinak jen `user_ids`."""
+    select = (
+        f"SELECT p.user_id, p.call_id, {_decoded('participation', 'p.status')}, p.participation_timestamp, "
+        "c.tenant, c.name, c.deal_price FROM participations p JOIN calls c ON c.call_id = p.call_id"
+    )
+    try:
+        conn = get_db_connection()
+        if user_ids is None:
+            rows = conn.execute(f"{select} ORDER BY p.user_id").fetchall()
+        else:
+            rows = []
+            for start in range(0, len(user_ids), 500):  # Limit počtu parametrů SQLite
+                batch = user_ids[start:start + 500]
+                rows += conn.execute(f"{select} WHERE p.user_id IN ({', '.join('?' * len(batch))}) ORDER BY p.user_id", batch).fetchall()
+        conn.close()
+        return rows
+    except sqlite3.Error as e:
+        logger.error(f"Chyba při načítání účastí pro segmenty: {e}")
+        return None
+
+
+def get_changed_participants(since: int):
+    """Uživatelé, jejichž účasti se změnily v `since` nebo později, s časem poslední změny."""
+    try:
+        conn = get_db_connection()
+        # Bez INDEXED BY volí planner kvůli GROUP BY průchod celou tabulkou v pořadí primárního klíče
+        rows = conn.execute(
+            "SELECT user_id, MAX(participation_timestamp) AS changed FROM participations INDEXED BY idx_participations_timestamp "
+            "WHERE participation_timestamp >= ? GROUP BY user_id",
+            (since,),
+        ).fetchall()
+        conn.close()
+        return rows
+    except sqlite3.Error as e:
+        logger.error(f"Chyba při načítání změněných účastí: {e}")
+        return None
+
+
+@writes
+def enqueue_announcements(call_id: int, user_ids: list[int], text: str, tenant: str = DEFAULT_TENANT) -> int | None:
+    """Zařadí oznámení výzvy do `notification_outbox` pro uživatele se souhlasem.
+
+    Každý uživatel dostane oznámení výzvy nejvýše jednou (UNIQUE user_id, call_id, kind).
+    Vrací počet nově zařazených, nebo None při chybě.
+    """
+    try:
+        conn = get_db_connection()
+        before = conn.total_changes
+        conn.executemany(
+            f"INSERT OR IGNORE INTO notification_outbox (user_id, call_id, kind, text, tenant) SELECT telegram_id, ?, 'announce', ?, ? FROM users WHERE telegram_id = ? AND consent_status = {_codes('consent', 'granted')}",
+            [(call_id, text, tenant, user_id) for user_id in user_ids],
+        )
+        queued = conn.total_changes - before
+        conn.commit()
+        conn.close()
+        logger.info(f"Oznámení výzvy {call_id} zařazeno pro {queued} z {len(user_ids)} uživatelů.")
+        return queued
+    except sqlite3.Error as e:
+        logger.error(f"Chyba při zařazování oznámení výzvy {call_id}: {e}")
+        return None
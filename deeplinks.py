@@ -0,0 +1,90 @@
+# deeplinks.py
+# -*- coding: utf-8 -*-
+"""Podepsané deep-linky na výzvy (t.me/<bot>?start=<payload>).
+
+Payload má tvar `c<call_id v base36><podpis>`, kde podpis je prvních
+PAYLOAD_SIG_BYTES bajtů HMAC-SHA256 (base64url, bez '='). Vejde se do
+limitu Telegramu (64 znaků, jen A-Z a-z 0-9 _ -) a bez klíče nejde
+odkazy na jiné výzvy uhodnout procházením čísel.
+
+Použití z příkazové řádky (`--bot` = jméno bota z BOTS, bez něj výchozí bot):
+    python deeplinks.py [--bot <jméno>] <bot_username> <call_id> [<call_id> ...]
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import sys
+
+PAYLOAD_PREFIX = "c"
+PAYLOAD_SIG_BYTES = 6  # 48 bitů podpisu -> 8 znaků base64url
+_SIG_LEN = len(base64.urlsafe_b64encode(b"\0" * PAYLOAD_SIG_BYTES))
+_BASE36 = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def derive_key(secret: str) -> bytes:
+    """Klíč pro podpis odkazů (z DEEPLINK_SECRET, nebo z tokenu bota)."""
+    return hashlib.sha256(b"dealup-deeplink:" + secret.encode("utf-8")).digest()
+
+
+def tenant_key(token: str, secret: str | None = None, tenant: str | None = None) -> bytes:
+    """Klíč odkazů bota: ze společného DEEPLINK_SECRET (u hostovaného bota i s jeho jménem), jinak z tokenu."""
+    if secret:
+        # Odkaz podepsaný pro jednoho bota u jiného neprojde
+        return derive_key(f"{secret}:{tenant}" if tenant else secret)
+    return derive_key(token)
+
+
+def _to_base36(number: int) -> str:
+    digits = []
+    while True:
+        number, rem = divmod(number, 36)
+        digits.append(_BASE36[rem])
+        if not number:
+            return "".join(reversed(digits))
+
+
+def _signature(key: bytes, body: str) -> str:
+    digest = hmac.new(key, body.encode("ascii"), hashlib.sha256).digest()[:PAYLOAD_SIG_BYTES]
+    return base64.urlsafe_b64encode(digest).decode("ascii")
+
+
+def sign_call_payload(call_id: int, key: bytes) -> str:
+    """Vytvoří podepsaný payload pro /start odkazující na výzvu."""
+    body = PAYLOAD_PREFIX + _to_base36(call_id)
+    return body + _signature(key, body)
+
+
+def parse_call_payload(payload: str | None, key: bytes) -> int | None:
+    """Ověří payload a vrátí call_id, nebo None (neplatný formát či podpis)."""
+    if not payload or not payload.startswith(PAYLOAD_PREFIX) or len(payload) <= len(PAYLOAD_PREFIX) + _SIG_LEN:
+        return None
+    body, signature = payload[:-_SIG_LEN], payload[-_SIG_LEN:]
+    if not hmac.compare_digest(signature, _signature(key, body)):
+        return None
+    try:
+        return int(body[len(PAYLOAD_PREFIX):], 36)
+    except ValueError:
+        return None
+
+
+def call_link(bot_username: str, call_id: int, key: bytes) -> str:
+    return f"https://t.me/{bot_username}?start={sign_call_payload(call_id, key)}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Podepsané deep-linky na výzvy.")
+    parser.add_argument("--bot", help="Jméno bota z BOTS (bez něj výchozí bot)")
+    parser.add_argument("bot_username")
+    parser.add_argument("call_ids", nargs="+", type=int, metavar="call_id")
+    args = parser.parse_args()
+    from config import BOT_CONFIGS, DEEPLINK_SECRET
+    from database import DEFAULT_TENANT
+    tenants = {config["tenant"] or DEFAULT_TENANT: config for config in BOT_CONFIGS}
+    name = args.bot.lower() if args.bot else next(iter(tenants))
+    if name not in tenants:
+        print(f"Bot '{args.bot}' není v BOTS (hostované: {', '.join(tenants)}).")
+        sys.exit(2)
+    link_key = tenant_key(tenants[name]["token"], DEEPLINK_SECRET, None if name == DEFAULT_TENANT else name)
+    for call_id in args.call_ids:
+        print(f"{call_id}: {call_link(args.bot_username.lstrip('@'), call_id, link_key)}")
@@ -0,0 +1,156 @@
+# fake_bot_api.py
+# -*- coding: utf-8 -*-
+"""Lokální náhrada Telegram Bot API pro replay a benchmarky.
+
+Minimální HTTP/1.1 server (asyncio, keep-alive) na adrese
+http://127.0.0.1:<port>/bot<token>/<metoda>. Na běžné metody, které bot
+volá (getMe, sendMessage, editMessageText, answerCallbackQuery,
+sendDocument, ...), vrací platné odpovědi, takže python-telegram-bot
+funguje beze změny - stačí `Application.builder().base_url(api.base_url)`.
+
+Každé volání se zaznamená (čas, metoda, chat) a volitelně předá do
+`on_call`, podle čehož replay měří latenci odpovědí. `latency` přidá
+ke každé odpovědi umělé zpoždění (simulace RTT k api.telegram.org).
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import Counter
+from urllib.parse import parse_qsl
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "DealUpBot", "username": "dealup_fake_bot",
+            "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": False}
+_MULTIPART_CHAT_FIELD = b'name="chat_id"\r\n\r\n'
+
+
+class FakeBotApi:
+    """Falešné Bot API běžící ve stejném event loopu jako testovaný bot."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.on_call = None  # Volitelné: on_call(method, chat_id, timestamp)
+        self.calls = Counter()
+        self.connections = 0  # Počet otevřených TCP spojení (ukazuje, zda klient drží keep-alive)
+        self.connection_tasks: set[asyncio.Task] = set()  # Obsluha spojení (replay je nečeká)
+        self._server = None
+        self._message_id = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/bot"
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"FakeBotApi poslouchá na {self.base_url}")
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    # --- HTTP ---
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self.connection_tasks.add(task)
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                path = request_line.split()[1].decode("ascii")
+                method = path.rstrip("/").rsplit("/", 1)[-1]
+                payload = self._dispatch(method, self._parse_params(headers.get("content-type", ""), body))
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                data = json.dumps(payload).encode("utf-8")
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                             + f"Content-Length: {len(data)}\r\n\r\n".encode("ascii") + data)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.connection_tasks.discard(task)
+            writer.close()
+
+    @staticmethod
+    def _parse_params(content_type: str, body: bytes) -> dict:
+        if content_type.startswith("application/x-www-form-urlencoded"):
+            return dict(parse_qsl(body.decode("utf-8")))
+        if content_type.startswith("application/json") and body:
+            return json.loads(body)
+        if content_type.startswith("multipart/form-data"):
+            # Soubory nás nezajímají, jen chat_id pro evidenci volání
+            start = body.find(_MULTIPART_CHAT_FIELD)
+            if start != -1:
+                start += len(_MULTIPART_CHAT_FIELD)
+                return {"chat_id": body[start:body.find(b"\r\n", start)].decode("ascii")}
+        return {}
+
+    # --- Bot API ---
+    def _message(self, chat_id, text: str | None = None, message_id: int | None = None, **extra) -> dict:
+        if message_id is None:
+            self._message_id += 1
+            message_id = self._message_id
+        message = {"message_id": int(message_id), "date": int(time.time()),
+                   "chat": {"id": int(chat_id), "type": "private"}, "from": BOT_USER}
+        if text is not None:
+            message["text"] = text
+        message.update(extra)
+        return message
+
+    def _dispatch(self, method: str, params: dict) -> dict:
+        self.calls[method] += 1
+        chat_id = params.get("chat_id")
+        if chat_id is None and method == "answerCallbackQuery":
+            # Replay skládá callback_query_id jako "<chat_id>:<pořadí>"
+            chat_id = str(params.get("callback_query_id", "")).split(":", 1)[0] or None
+        if self.on_call is not None:
+            self.on_call(method, int(chat_id) if chat_id else None, time.perf_counter())
+
+        if method == "getMe":
+            result = BOT_USER
+        elif method == "getUpdates":
+            result = []
+        elif method in ("sendMessage", "editMessageText"):
+            result = self._message(chat_id or 0, params.get("text", ""), params.get("message_id"))
+        elif method == "sendDocument":
+            result = self._message(chat_id or 0, document={"file_id": f"doc{self._message_id}", "file_unique_id": f"u{self._message_id}"})
+        else:
+            result = True  # answerCallbackQuery, deleteWebhook, setMyCommands, ...
+        return {"ok": True, "result": result}
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    async def _serve(port: int) -> None:
+        api = FakeBotApi(port=port)
+        await api.start()
+        await asyncio.Event().wait()
+
+    asyncio.run(_serve(int(sys.argv[1]) if len(sys.argv) > 1 else 8081))
@@ -0,0 +1,92 @@
+# flood_guard.py
+# -*- coding: utf-8 -*-
+"""Ochrana před zahlcením: limit událostí na uživatele a slučování dvojkliků.
+
+Guard běží jako TypeHandler ve skupině před všemi ostatními handlery. Každý
+uživatel má token bucket (rychlost + nárazová rezerva); co se nevejde, se
+zahodí dřív, než to sáhne do DB nebo pošle zprávu. Opakované stisknutí
+stejného tlačítka (stejná callback_data) v krátkém okně se sloučí s prvním.
+Zahozené i sloučené callbacky dostanou jen levné answerCallbackQuery, aby
+se v klientovi netočilo kolečko.
+"""
+import logging
+import time
+from collections import OrderedDict
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes, TypeHandler
+
+logger = logging.getLogger(__name__)
+
+GUARD_GROUP = -2  # Před deduplikací updatů (-1) i před běžnými handlery (0)
+
+
+class FloodGuard:
+    """Token bucket na uživatele + deduplikace callback_data."""
+
+    def __init__(self, rate_per_second: float, burst: int, dedup_seconds: float, max_tracked: int = 50000, exempt_ids=()):
+        self.rate = rate_per_second
+        self.burst = burst
+        self.dedup_seconds = dedup_seconds
+        self.max_tracked = max_tracked
+        self.exempt_ids = set(exempt_ids)
+        self._buckets: OrderedDict[int, tuple[float, float]] = OrderedDict()  # user_id -> (tokens, čas)
+        self._last_callbacks: OrderedDict[tuple[int, str], float] = OrderedDict()
+        self.stats = {"allowed": 0, "dropped_messages": 0, "dropped_callbacks": 0, "merged_callbacks": 0}
+
+    def _take_token(self, user_id: int, now: float) -> bool:
+        tokens, updated = self._buckets.pop(user_id, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        # Znovu vložený klíč jde na konec -> na začátku jsou nejdéle neaktivní uživatelé
+        self._buckets[user_id] = (tokens, now)
+        if len(self._buckets) > self.max_tracked:
+            self._buckets.popitem(last=False)
+        return allowed
+
+    def _is_repeated_callback(self, user_id: int, data: str, now: float) -> bool:
+        key = (user_id, data)
+        last = self._last_callbacks.pop(key, None)
+        self._last_callbacks[key] = now
+        # Staré záznamy průběžně odmazáváme od začátku
+        while self._last_callbacks:
+            oldest_key, oldest_time = next(iter(self._last_callbacks.items()))
+            if now - oldest_time <= self.dedup_seconds and len(self._last_callbacks) <= self.max_tracked:
+                break
+            del self._last_callbacks[oldest_key]
+        return last is not None and now - last <= self.dedup_seconds
+
+    def check(self, user_id: int, callback_data: str | None = None, now: float | None = None) -> str:
+        """Vrátí 'allow', 'merge' (dvojklik) nebo 'drop' (nad limit)."""
+        if user_id in self.exempt_ids:
+            return "allow"
+        now = time.monotonic() if now is None else now
+        if callback_data is not None and self._is_repeated_callback(user_id, callback_data, now):
+            return "merge"
+        return "allow" if self._take_token(user_id, now) else "drop"
+
+    async def guard(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        user = update.effective_user
+        if user is None:
+            return
+        query = update.callback_query
+        verdict = self.check(user.id, query.data if query else None)
+        if verdict == "allow":
+            self.stats["allowed"] += 1
+            return
+        if query:
+            self.stats["merged_callbacks" if verdict == "merge" else "dropped_callbacks"] += 1
+            try:
+                await query.answer("Moc rychle, chvilku počkej." if verdict == "drop" else None)
+            except Exception as e:
+                logger.debug(f"FloodGuard: answerCallbackQuery selhalo: {e}")
+        else:
+            self.stats["dropped_messages"] += 1
+        if verdict == "drop":
+            logger.info(f"FloodGuard: zahozen update od user {user.id}.")
+        raise ApplicationHandlerStop
+
+    def register(self, application) -> None:
+        application.add_handler(TypeHandler(Update, self.guard), group=GUARD_GROUP)
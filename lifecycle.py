@@ -0,0 +1,136 @@
+# lifecycle.py
+# -*- coding: utf-8 -*-
+"""Restart bez výpadku: řízené ukončení (drain) a předání pollingu záložní instanci.
+
+Telegram dovolí getUpdates jen jednomu odběrateli, instance se stejnou DB se
+proto střídají přes lease v tabulce bot_state. Záloha se spustí celá
+(initialize, předehřátí) a čeká, až lease uvolní aktivní instance - ta ho
+drží a průběžně prodlužuje. Při SIGTERM aktivní instance (bot.run_fleet,
+workers.run_supervisor):
+
+1. zastaví getUpdates - stažené updaty potvrdí Telegramu a dozpracuje,
+   nové čekají u Telegramu (neztratí se),
+2. zastaví rozesílku po právě odesílané zprávě a zapíše její stav,
+3. nechá doběhnout rozpracované handlery a úlohy (nejvýše DRAIN_TIMEOUT),
+4. uloží rozpracované nákupy do DB (checkout_sessions),
+5. uvolní lease - záloha hned převezme polling, nákupy i zbytek rozesílky.
+
+Spadne-li aktivní instance, záloha převezme po vypršení lease
+(HANDOFF_LEASE_SECONDS); proces na stejném stroji, který už neběží, pozná
+hned. Bez lease (HANDOFF_LEASE_SECONDS=0) běží jediná instance jako dřív.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+
+from database import acquire_lease, release_lease, get_bot_state
+
+logger = logging.getLogger(__name__)
+
+LEASE_NAME = "polling_lease"
+POLL_INTERVAL = 0.1  # Jak často (s) záloha zkouší lease získat
+RENEW_RETRY = 1.0  # Po chybě DB při prodlužování se to zkusí znovu za tolik s (do vypršení lease)
+
+
+class StopRequested(Exception):
+    """Ukončení přišlo dřív, než instance převzala provoz (záloha nikdy nezačala pollovat)."""
+
+
+def instance_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _dead_owner(value: str | None) -> bool:
+    """True, pokud lease drží proces na tomto stroji, který už neběží."""
+    try:
+        host, pid = json.loads(value)["owner"].rsplit(":", 1)
+        if host != socket.gethostname():
+            return False
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except (TypeError, ValueError, KeyError, PermissionError, OSError):
+        return False
+    return False
+
+
+class Handoff:
+    """Lease na polling pro celý proces (všechny boty) a signál k ukončení."""
+
+    def __init__(self, ttl_seconds: int, name: str = LEASE_NAME):
+        self.ttl_seconds = ttl_seconds
+        self.name = name
+        self.owner = instance_id()
+        self.held = False
+        self.stop_requested = asyncio.Event()  # Nastaví SIGINT/SIGTERM nebo ztráta lease
+        self._renewer: asyncio.Task | None = None
+        self._expires = 0.0  # time.monotonic(), kdy nejpozději vyprší naposledy prodloužený lease
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0
+
+    def request_stop(self) -> None:
+        self.stop_requested.set()
+
+    async def _try_acquire(self) -> bool:
+        if await asyncio.to_thread(acquire_lease, self.name, self.owner, self.ttl_seconds):
+            return True
+        current = await asyncio.to_thread(get_bot_state, self.name)
+        if _dead_owner(current):
+            logger.warning(f"Handoff: držitel lease už neběží ({current}), přebírám.")
+            return await asyncio.to_thread(acquire_lease, self.name, self.owner, self.ttl_seconds, current)
+        return False
+
+    async def acquire(self) -> None:
+        """Počká na lease (aktivní instance ho drží); vyvolá StopRequested, pokud přijde ukončení."""
+        if self.held or not self.enabled:
+            return
+        waited = False
+        while not await self._try_acquire():
+            if not waited:
+                logger.info(f"Handoff: polling drží jiná instance, čekám jako záloha ({self.owner}).")
+                waited = True
+            try:
+                await asyncio.wait_for(self.stop_requested.wait(), POLL_INTERVAL)
+            except TimeoutError:
+                continue
+            raise StopRequested()
+        self.held = True
+        self._expires = time.monotonic() + self.ttl_seconds
+        self._renewer = asyncio.create_task(self._renew())
+        logger.info(f"Handoff: lease získán ({self.owner}){', převzato od předchozí instance' if waited else ''}.")
+
+    async def _renew(self) -> None:
+        delay = self.ttl_seconds / 3
+        while True:
+            await asyncio.sleep(delay)
+            attempted = time.monotonic()  # Lease platí nejvýš TTL od pokusu (ne od odpovědi)
+            renewed = await asyncio.to_thread(acquire_lease, self.name, self.owner, self.ttl_seconds)
+            if renewed:
+                self._expires = attempted + self.ttl_seconds
+                delay = self.ttl_seconds / 3
+                continue
+            if renewed is None and time.monotonic() < self._expires:
+                # Chyba DB (např. zamčená) lease neruší - zkusíme znovu, dokud ještě platí
+                logger.warning(f"Handoff: prodloužení lease selhalo, zkusím znovu (platí ještě {self._expires - time.monotonic():.1f} s).")
+                delay = min(RENEW_RETRY, max(0.0, self._expires - time.monotonic()))
+                continue
+            # Lease převzal někdo jiný (např. proces stál déle než TTL), nebo vypršel - dva pollery nesmí běžet
+            logger.critical("Handoff: lease ztracen, ukončuji instanci.")
+            self.held = False
+            self.request_stop()
+            return
+
+    async def release(self) -> None:
+        """Uvolní lease - záloha okamžitě převezme polling."""
+        if self._renewer is not None:
+            self._renewer.cancel()
+            self._renewer = None
+        if self.held:
+            await asyncio.to_thread(release_lease, self.name, self.owner)
+            self.held = False
+            logger.info("Handoff: lease uvolněn, provoz může převzít záloha.")
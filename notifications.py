@@ -0,0 +1,195 @@
+# notifications.py
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import time
+from collections import defaultdict
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import ParseMode
+from telegram.error import Forbidden, BadRequest, RetryAfter, TelegramError
+
+import bot_logic
+from templates import call_templates
+from database import (
+    DEFAULT_TENANT, get_pending_notifications, mark_notifications_sent, mark_notification_failed,
+    get_digest_recipients, get_digest_calls, mark_digest_served, set_digest_subscription
+)
+
+logger = logging.getLogger(__name__)
+
+# Rozesílka běží pro každého bota vždy jen jedna, další spuštění počká (a najde už jen zbytek fronty)
+_delivery_locks: defaultdict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+_stopping = False  # Při ukončení se rozesílka zastaví po právě odesílané zprávě (viz stop_delivery)
+MARK_RETRIES = 3  # Pokusy o zápis stavu dávky (s čekáním 1 a 2 s), pak se rozesílka/souhrn přeruší
+
+
+class RateLimiter:
+    """Jednoduchý token bucket pro odchozí zprávy (sdílený všemi rozesílkami)."""
+
+    def __init__(self, rate_per_second: float, burst: int | None = None):
+        self.rate = rate_per_second
+        self.capacity = burst or max(1, int(rate_per_second))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Počká, dokud není k dispozici token pro další zprávu."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+async def send_limited(bot, limiter: RateLimiter, **kwargs) -> None:
+    """Odešle zprávu přes limiter; při RetryAfter počká a zkusí ji znovu, ostatní chyby propustí."""
+    while True:
+        await limiter.acquire()
+        try:
+            await bot.send_message(**kwargs)
+            return
+        except RetryAfter as e:
+            # Telegram nás brzdí - počkáme a zkusíme tutéž zprávu znovu
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+            logger.warning(f"Rozesílka: RetryAfter {retry_after}s.")
+            await asyncio.sleep(retry_after)
+
+
+def render_confirmation_message(call, participant: dict) -> str:
+    """Sestaví text potvrzení účasti včetně vyplněných finálních instrukcí."""
+    call_name = call['name'] or f"Výzva ID {call['call_id']}"
+    compiled = call_templates.get_or_put(call).compiled  # Šablona se zkompiluje jednou pro celou dávku
+    formatted_instructions = bot_logic.render_final_instructions(call, participant['user_id'], participant['first_name'] or "Uživateli", participant['collected_data'], compiled)
+    return f"Tvá účast ve Výzvě '{call_name}' byla potvrzena! 🎉\n\n{formatted_instructions}"
+
+
+async def deliver_pending_notifications(bot, limiter: RateLimiter, batch_size: int = 100, max_attempts: int = 3, tenant: str = DEFAULT_TENANT) -> dict:
+    """Odešle všechny čekající notifikace bota (tenantu) z `notification_outbox`.
+
+    Stav se ukládá po dávkách, takže po pádu nebo restartu rozesílka naváže
+    tam, kde skončila (opakovat se může nejvýše poslední nepotvrzená dávka).
+    Po stop_delivery se zapíše rozeslaná část dávky a zbytek nechá další instanci.
+    Když se stav dávky nepodaří zapsat, rozesílka skončí - jinak by se tatáž dávka
+    načetla a rozeslala znovu; zbytek dokončí příští spuštění.
+    """
+    stats = {"sent": 0, "failed": 0}
+    async with _delivery_locks[tenant]:
+        while not _stopping:
+            batch = get_pending_notifications(limit=batch_size, tenant=tenant)
+            if not batch:
+                break
+            sent_ids = []
+            unmarked = False
+            for notification in batch:
+                if _stopping:
+                    logger.info("Rozesílka: ukončuji, zbytek fronty zůstává v outboxu.")
+                    break
+                notification_id = notification['notification_id']
+                try:
+                    await send_limited(bot, limiter, chat_id=notification['user_id'], text=notification['text'])
+                    sent_ids.append(notification_id)
+                except (Forbidden, BadRequest) as e:
+                    # Uživatel bota zablokoval nebo chat neexistuje - nemá smysl opakovat
+                    logger.info(f"Notifikaci {notification_id} pro user {notification['user_id']} nelze doručit: {e}")
+                    unmarked |= not mark_notification_failed(notification_id, permanent=True)
+                    stats["failed"] += 1
+                except TelegramError as e:
+                    logger.warning(f"Chyba při odesílání notifikace {notification_id}: {e}")
+                    unmarked |= not mark_notification_failed(notification_id, max_attempts=max_attempts)
+                    stats["failed"] += 1
+            stats["sent"] += len(sent_ids)
+            if not await _write_state(mark_notifications_sent, sent_ids) or unmarked:
+                logger.error(f"Rozesílka: stav dávky se nepodařilo zapsat do DB, přerušuji (odesláno {stats['sent']}).")
+                break
+            logger.info(f"Rozesílka: dávka hotova, odesláno celkem {stats['sent']}.")
+    return stats
+
+
+async def _write_state(write, *args) -> bool:
+    """Zapíše stav dávky (`write` vrací bool); při chybě DB (např. zamčená) to zkusí znovu s prodlevou."""
+    for attempt in range(MARK_RETRIES):
+        if write(*args):
+            return True
+        if attempt + 1 < MARK_RETRIES:
+            await asyncio.sleep(2 ** attempt)
+    return False
+
+
+def digest_markup(rows: list[list[tuple[str, str]]]) -> InlineKeyboardMarkup | None:
+    return InlineKeyboardMarkup([[InlineKeyboardButton(text, callback_data=data) for text, data in row] for row in rows]) if rows else None
+
+
+async def deliver_digest(bot, limiter: RateLimiter, period: str, cutoff: int, page_size: int, batch_size: int = 100,
+                         tenant: str = DEFAULT_TENANT, shard: int = 0, shards: int = 1) -> dict:
+    """Rozešle odběratelům `period` souhrn nových výzev do `cutoff` - jednu zprávu na uživatele.
+
+    Odběratelé se čtou z DB po dávkách; každý dostane aktivní výzvy vytvořené
+    od svého posledního souhrnu (první stránku s tlačítky, další přes listování).
+    Kdo nic nového nemá, dostane jen posunutý served_until. Stav se zapisuje po
+    dávkách, opakované spuštění se stejným `cutoff` tak jen dokončí zbytek;
+    když zápis selže, souhrn skončí (jinak by dávka dostala souhrn znovu).
+    """
+    stats = {"sent": 0, "failed": 0, "empty": 0}
+    async with _delivery_locks[f"{tenant}:digest"]:
+        after = 0
+        while not _stopping:
+            batch = get_digest_recipients(period, cutoff, after, batch_size, tenant, shard, shards)
+            if not batch:
+                break
+            # Výzvy pro celou dávku jedním dotazem; stránka se sestaví jednou pro každý served_until
+            calls = get_digest_calls(min(row['served_until'] for row in batch), cutoff, tenant)
+            pages = {}
+            served = []
+            for recipient in batch:
+                if _stopping:
+                    logger.info("Souhrn: ukončuji, zbývající odběratelé ho dostanou po restartu.")
+                    break
+                since = recipient['served_until']
+                if since not in pages:
+                    new_calls = [call for call in calls if call['created'] > since]
+                    pages[since] = bot_logic.format_digest_page(new_calls, 0, page_size, since, cutoff) if new_calls else None
+                served.append(recipient['user_id'])
+                if pages[since] is None:
+                    stats["empty"] += 1
+                    continue
+                text, rows = pages[since]
+                try:
+                    try:
+                        await send_limited(bot, limiter, chat_id=recipient['user_id'], text=text, reply_markup=digest_markup(rows), parse_mode=ParseMode.MARKDOWN)
+                    except BadRequest as e:
+                        if "parse" not in str(e).lower():
+                            raise
+                        # Markdown v názvu výzvy - pošleme jako prostý text (jako list_calls)
+                        await send_limited(bot, limiter, chat_id=recipient['user_id'], text=text.replace('*', '').replace('~', ''), reply_markup=digest_markup(rows))
+                    stats["sent"] += 1
+                except Forbidden as e:
+                    # Uživatel bota zablokoval - další souhrny by také selhaly
+                    logger.info(f"Souhrn pro user {recipient['user_id']} nelze doručit ({e}), ruším odběr.")
+                    set_digest_subscription(recipient['user_id'], None, tenant)
+                    stats["failed"] += 1
+                except TelegramError as e:
+                    # Souhrn se neopakuje (příští přijde s dalšími výzvami), jen se započítá
+                    logger.info(f"Souhrn pro user {recipient['user_id']} nelze doručit: {e}")
+                    stats["failed"] += 1
+            if not await _write_state(mark_digest_served, served, cutoff, tenant):
+                logger.error(f"Souhrn {period} ({tenant}): stav dávky se nepodařilo zapsat do DB, přerušuji (odesláno {stats['sent']}).")
+                break
+            after = batch[-1]['user_id']
+        if stats["sent"] or stats["failed"]:
+            logger.info(f"Souhrn {period} ({tenant}): odesláno {stats['sent']}, nedoručeno {stats['failed']}, bez novinek {stats['empty']}.")
+    return stats
+
+
+async def stop_delivery() -> None:
+    """Zastaví rozesílky (po právě odesílané zprávě) a počká, až zapíšou svůj stav."""
+    global _stopping
+    _stopping = True
+    for lock in list(_delivery_locks.values()):
+        async with lock:
+            pass
@@ -0,0 +1,74 @@
+# pipeline.py
+# -*- coding: utf-8 -*-
+"""Rychlé potvrzení callbacků a omezený pool pro práci na pozadí.
+
+Handler tlačítka nejdřív (souběžně) odpoví na callback query a přepne zprávu
+do stavu "zpracovávám", takže uživatel dostane odezvu hned. Blokující práce
+(SQLite) pak běží ve vláknech přes WorkerPool: nejvýše `max_workers` úloh
+současně a nejvýše `max_pending` čekajících - nad limit pool úlohu odmítne
+(PoolBusy) místo toho, aby fronta rostla bez omezení.
+"""
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+PROCESSING_TEXT = "⏳ Zpracovávám..."
+BUSY_TEXT = "Bot je teď vytížený, zkus to prosím za chvíli znovu."
+
+
+class PoolBusy(Exception):
+    """Pool má plnou frontu, úloha nebyla přijata."""
+
+
+class WorkerPool:
+    """Omezený počet souběžných blokujících úloh (ve vláknech) s limitem fronty."""
+
+    def __init__(self, max_workers: int, max_pending: int):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._semaphore = asyncio.Semaphore(max_workers)
+        self._pending = 0
+        self.stats = {"completed": 0, "rejected": 0, "failed": 0}
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def submit(self, func, *args, **kwargs):
+        """Spustí blokující `func` ve vlákně a vrátí její výsledek; při plné frontě vyvolá PoolBusy.
+
+        Používá se pro novou práci (vstupní body), kterou lze bezpečně odmítnout.
+        """
+        if self._pending >= self.max_pending:
+            self.stats["rejected"] += 1
+            raise PoolBusy()
+        return await self.run(func, *args, **kwargs)
+
+    async def run(self, func, *args, **kwargs):
+        """Jako submit, ale úlohu nikdy neodmítne - pro dokončení už rozběhnuté práce."""
+        self._pending += 1
+        try:
+            async with self._semaphore:
+                result = await asyncio.to_thread(func, *args, **kwargs)
+            self.stats["completed"] += 1
+            return result
+        except Exception:
+            self.stats["failed"] += 1
+            raise
+        finally:
+            self._pending -= 1
+
+
+async def fast_ack(query, processing_text: str = PROCESSING_TEXT) -> float:
+    """Souběžně odpoví na callback a přepne zprávu do stavu zpracování.
+
+    Vrací dobu potvrzení v ms (pro logování); chyba optimistické editace se jen zaloguje.
+    """
+    started = time.perf_counter()
+    results = await asyncio.gather(query.answer(), query.edit_message_text(processing_text, reply_markup=None), return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logger.warning(f"fast_ack: {result}")
+    return (time.perf_counter() - started) * 1000
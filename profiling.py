@@ -0,0 +1,174 @@
+# profiling.py
+# -*- coding: utf-8 -*-
+"""Diagnostika běžícího procesu na požádání (admin příkazy).
+
+- SamplingProfiler: vlákno, které po dobu měření v intervalu čte zásobníky
+  všech vláken (sys._current_frames) a počítá, kde kód tráví čas. Výstup je
+  ve formátu "collapsed stacks" (lze přímo vložit do flamegraph.pl /
+  speedscope) doplněný o přehled nejčastějších funkcí.
+- MemoryTracker: tracemalloc snapshoty a rozdíl proti předchozímu.
+- format_asyncio_tasks: výpis běžících asyncio úloh i se zásobníkem.
+
+Mimo měření nic neběží: vlákno profileru existuje jen po dobu vzorkování
+a tracemalloc je zapnutý jen mezi /memsnap a /memsnap stop.
+"""
+import asyncio
+import io
+import linecache
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename
+    if filename.startswith(_BASE_DIR):
+        filename = os.path.relpath(filename, _BASE_DIR)
+    else:
+        filename = os.path.basename(filename)
+    return f"{code.co_name} ({filename}:{frame.f_lineno})"
+
+
+class ProfilerBusy(RuntimeError):
+    """Měření už běží."""
+
+
+class SamplingProfiler:
+    """Vzorkovací profiler všech vláken procesu."""
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+        self._running = False
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def _sample_loop(self, duration: float, stacks: Counter) -> int:
+        own_ident = threading.get_ident()
+        names = {}
+        samples = 0
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                if ident not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(f"[{names.get(ident, ident)}]")
+                stacks[tuple(reversed(stack))] += 1
+            samples += 1
+            time.sleep(self.interval)
+        return samples
+
+    def profile(self, duration: float) -> str:
+        """Vzorkuje `duration` sekund (blokuje volající vlákno) a vrátí textový report."""
+        with self._lock:
+            if self._running:
+                raise ProfilerBusy()
+            self._running = True
+        try:
+            stacks: Counter = Counter()
+            started = time.perf_counter()
+            samples = self._sample_loop(duration, stacks)
+            elapsed = time.perf_counter() - started
+        finally:
+            self._running = False
+        return self._report(stacks, samples, elapsed)
+
+    async def profile_async(self, duration: float) -> str:
+        """Spustí měření ve vlastním vlákně, event loop mezitím běží dál (a je měřen)."""
+        return await asyncio.to_thread(self.profile, duration)
+
+    @staticmethod
+    def _report(stacks: Counter, samples: int, elapsed: float, top: int = 40) -> str:
+        own = Counter()
+        inclusive = Counter()
+        for stack, count in stacks.items():
+            own[stack[-1]] += count
+            for label in set(stack[1:]):
+                inclusive[label] += count
+        total = sum(stacks.values()) or 1
+        out = io.StringIO()
+        out.write(f"# Vzorků: {samples} za {elapsed:.1f} s, zásobníků: {total}\n\n")
+        out.write("# Nejčastěji na vrcholu zásobníku (self):\n")
+        for label, count in own.most_common(top):
+            out.write(f"{100 * count / total:6.2f}%  {label}\n")
+        out.write("\n# Včetně volaných funkcí (inclusive):\n")
+        for label, count in inclusive.most_common(top):
+            out.write(f"{100 * count / total:6.2f}%  {label}\n")
+        out.write("\n# Collapsed stacks (flamegraph.pl / speedscope):\n")
+        for stack, count in stacks.most_common():
+            out.write(f"{';'.join(stack)} {count}\n")
+        return out.getvalue()
+
+
+class MemoryTracker:
+    """tracemalloc na požádání: první snapshot je základ, další se porovnávají s předchozím."""
+
+    def __init__(self, frames: int = 10):
+        self.frames = frames
+        self._previous = None
+
+    @property
+    def active(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def snapshot(self, top: int = 30) -> str:
+        """Zapne tracemalloc (pokud neběží) a vrátí report snapshotu / rozdílu."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._previous = tracemalloc.take_snapshot()
+            return "tracemalloc zapnut, uložen výchozí snapshot. Další /memsnap ukáže rozdíl.\n"
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        out = io.StringIO()
+        out.write(f"# Sledovaná paměť: {current / 1024:.1f} KiB (špička {peak / 1024:.1f} KiB)\n\n")
+        out.write("# Rozdíl proti předchozímu snapshotu:\n")
+        for stat in snapshot.compare_to(self._previous, "lineno")[:top]:
+            out.write(f"{stat}\n")
+        out.write("\n# Největší alokace (traceback):\n")
+        for stat in snapshot.statistics("traceback")[:top // 3]:
+            out.write(f"\n{stat.size / 1024:.1f} KiB v {stat.count} blocích\n")
+            for line in stat.traceback.format():
+                out.write(f"{line}\n")
+        self._previous = snapshot
+        return out.getvalue()
+
+    def stop(self) -> None:
+        tracemalloc.stop()
+        self._previous = None
+
+
+def format_asyncio_tasks(limit: int = 20) -> str:
+    """Vypíše všechny úlohy event loopu se zásobníkem (volá se z běžícího loopu)."""
+    tasks = sorted(asyncio.all_tasks(), key=lambda task: task.get_name())
+    out = io.StringIO()
+    out.write(f"# Asyncio úloh: {len(tasks)}\n")
+    for task in tasks:
+        coro = task.get_coro()
+        out.write(f"\n{task.get_name()}: {getattr(coro, '__qualname__', coro)} {'(hotovo)' if task.done() else ''}\n")
+        for frame in task.get_stack(limit=limit):
+            line = linecache.getline(frame.f_code.co_filename, frame.f_lineno).strip()
+            out.write(f"  {_frame_label(frame)}: {line}\n")
+    return out.getvalue()
+
+
+# Sdílené instance pro admin příkazy
+profiler = SamplingProfiler()
+memory_tracker = MemoryTracker()
@@ -0,0 +1,314 @@
+# replay.py
+# -*- coding: utf-8 -*-
+"""Replay zaznamenaného provozu (traffic_recorder.py) proti lokálnímu FakeBotApi.
+
+Updaty ze záznamu se pošlou do stejně nakonfigurované Application jako
+v produkci (bot.build_application), jen proti falešnému Bot API a kopii
+DB (snapshot ze zálohy, nebo prázdná DB). Aby byl replay deterministický,
+všechny handlery běží blokujícím způsobem a updaty jednoho uživatele jdou
+striktně za sebou; různí uživatelé běží souběžně.
+
+S --workers N jdou updaty přes workers.ShardRouter do N procesů workerů
+(stejně jako v produkčním režimu WORKER_PROCESSES=N), bez limitu souběžnosti
+- porovnání s jedním procesem ukáže, jak propustnost škáluje s jádry.
+
+Pro každý update se měří:
+- first_response: doba do prvního volání API pro daný chat (co vidí uživatel),
+- handled: doba do dokončení všech handlerů.
+
+Výsledkem je report (tabulka + JSON), který lze porovnat mezi verzemi.
+
+Použití:
+    python replay.py <záznam.jsonl> [--db <snapshot.sqlite3[.gz]>] [--speed 1] [--workers 4] [--label v1.2] [--report out.json]
+    python replay.py compare <starý.json> <nový.json>
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from itertools import chain
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:replay")  # Token jde jen na lokální FakeBotApi
+
+from telegram import Update
+from telegram.ext import Application, ConversationHandler
+
+import backup
+import database
+from fake_bot_api import FakeBotApi, BOT_USER
+from traffic_recorder import load_recording
+
+logger = logging.getLogger("replay")
+
+RESPONSE_KINDS = ("first_response", "handled")
+
+
+def update_kind(record: dict) -> str:
+    """Kategorie updatu pro report: příkaz, prefix callbacku, text nebo jiné."""
+    text = record.get("x") or ""
+    if record["k"] == "c":
+        return text.split("_", 1)[0] + "_"
+    if record["k"] == "m":
+        return text.split()[0].split("@")[0] if text.startswith("/") else "text"
+    return "other"
+
+
+def build_update_data(record: dict, update_id: int) -> dict:
+    """JSON updatu ve tvaru, v jakém ho vrací getUpdates."""
+    user_id = record["u"]
+    user = {"id": user_id, "is_bot": False, "first_name": "Replay"}
+    chat = {"id": user_id, "type": "private"}
+    message = {"message_id": update_id, "date": int(record["t"]), "chat": chat, "from": user}
+    if record["k"] == "c":
+        message.update(text="…", **{"from": BOT_USER})
+        data = {"update_id": update_id, "callback_query": {
+            "id": f"{user_id}:{update_id}", "from": user, "chat_instance": str(user_id), "data": record["x"], "message": message}}
+    else:
+        if record["k"] == "m":
+            text = record["x"]
+            message["text"] = text
+            if text.startswith("/"):
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        data = {"update_id": update_id, "message": message}
+    return data
+
+
+def build_update(record: dict, update_id: int, bot) -> Update:
+    return Update.de_json(build_update_data(record, update_id), bot)
+
+
+def force_blocking(application: Application) -> None:
+    """Všechny handlery (i uvnitř ConversationHandlerů) přepne na block=True."""
+    for handler in chain.from_iterable(application.handlers.values()):
+        if isinstance(handler, ConversationHandler):
+            inner = chain(handler.entry_points, handler.fallbacks, chain.from_iterable(handler.states.values()))
+            for conv_handler in inner:
+                conv_handler.block = True
+        else:
+            handler.block = True
+
+
+def percentiles(values: list[float]) -> dict:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {"count": len(ordered), "p50": round(pick(0.50), 2), "p90": round(pick(0.90), 2),
+            "p99": round(pick(0.99), 2), "max": round(ordered[-1], 2), "mean": round(sum(ordered) / len(ordered), 2)}
+
+
+def prepare_database(snapshot: str | None, workdir: str) -> None:
+    """Nasměruje database.py na kopii snapshotu (nebo prázdnou DB) v dočasném adresáři."""
+    database.DATABASE_FILE = os.path.join(workdir, "replay.sqlite3")
+    database.ARCHIVE_DATABASE_FILE = os.path.join(workdir, "replay-archive.sqlite3")
+    if snapshot:
+        if snapshot.endswith(".gz"):
+            backup._decompress(snapshot, database.DATABASE_FILE)
+        else:
+            shutil.copyfile(snapshot, database.DATABASE_FILE)
+    database.init_db()
+
+
+async def replay(records: list[dict], speed: float, concurrency: int | None, max_gap: float, api_latency: float,
+                 no_flood_guard: bool, workers: int = 0) -> dict:
+    import bot  # Až po nasměrování DB
+    from tenants import Tenant
+
+    api = FakeBotApi(latency=api_latency)
+    await api.start()
+    user_ids = {record["u"] for record in records}
+    admin_ids = {record["u"] for record in records if record.get("a")}
+    flood_exempt_ids = user_ids if no_flood_guard else admin_ids
+    loop = asyncio.get_running_loop()
+
+    if workers:
+        from workers import ShardRouter
+        config = {"tenant": None, "token": bot.BOT_CONFIGS[0]["token"], "admin_ids": admin_ids}
+        router = ShardRouter(workers, [config], base_url=api.base_url, report_done=True,
+                             options={"blocking": True, "flood_exempt_ids": flood_exempt_ids})
+        await asyncio.to_thread(router.start)
+        router.activate()
+        done_waiters: dict[int, asyncio.Future] = {}
+
+        def on_event(event) -> None:
+            waiter = done_waiters.pop(event[3], None)
+            if waiter is not None:
+                waiter.set_result(None)
+
+        def read_events() -> None:
+            while (event := router.events.get()) is not None:
+                loop.call_soon_threadsafe(on_event, event)
+
+        events_thread = threading.Thread(target=read_events, daemon=True)
+        events_thread.start()
+
+        async def process(record: dict, update_id: int) -> None:
+            waiter = done_waiters[update_id] = loop.create_future()
+            router.route(0, build_update_data(record, update_id))
+            await waiter
+
+        # Produkční supervisor updaty nelimituje, řadí se až ve frontách workerů
+        limit = concurrency or len(user_ids) or 1
+    else:
+        tenant = Tenant(None, bot.BOT_CONFIGS[0]["token"], admin_ids=admin_ids)
+        tenant.flood_guard.exempt_ids.update(flood_exempt_ids)
+        application = bot.build_application(tenant, base_url=api.base_url)
+        force_blocking(application)
+        await application.initialize()
+
+        async def process(record: dict, update_id: int) -> None:
+            await application.process_update(build_update(record, update_id, application.bot))
+
+        # Výchozí souběžnost jako v produkci (Application bez concurrent_updates zpracovává po jednom)
+        limit = concurrency or application.update_processor.max_concurrent_updates
+
+    waiters: dict[int, asyncio.Future] = {}
+
+    def on_call(method, chat_id, timestamp):
+        waiter = waiters.get(chat_id)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(timestamp)
+
+    api.on_call = on_call
+
+    # Plánované časy: původní rozestupy / speed, dlouhé pauzy zkrácené na max_gap
+    offsets, offset, previous = [], 0.0, records[0]["t"] if records else 0.0
+    for record in records:
+        offset += min(record["t"] - previous, max_gap) / speed if speed > 0 else 0.0
+        offsets.append(offset)
+        previous = record["t"]
+    first_update_id = int(database.get_bot_state("last_update_id") or 0) + 1
+    per_user = defaultdict(list)
+    for index, record in enumerate(records):
+        per_user[record["u"]].append((offsets[index], first_update_id + index, record))
+
+    samples = {kind: defaultdict(list) for kind in RESPONSE_KINDS}
+    no_response = defaultdict(int)
+    semaphore = asyncio.Semaphore(limit)
+    started = time.perf_counter()
+
+    async def run_user(events) -> None:
+        for at, update_id, record in events:
+            delay = started + at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            kind = update_kind(record)
+            async with semaphore:
+                waiter = waiters[record["u"]] = loop.create_future()
+                begin = time.perf_counter()
+                await process(record, update_id)
+                samples["handled"][kind].append((time.perf_counter() - begin) * 1000)
+                if waiter.done():
+                    samples["first_response"][kind].append((waiter.result() - begin) * 1000)
+                else:
+                    no_response[kind] += 1
+                del waiters[record["u"]]
+
+    await asyncio.gather(*(run_user(events) for events in per_user.values()))
+    wall = time.perf_counter() - started
+
+    if workers:
+        await asyncio.to_thread(router.stop)  # Workery před koncem dokončí i práci na pozadí
+        router.events.put(None)
+        events_thread.join()
+        extra = {"workers": workers, "routed": router.routed, "writer": dict(router.writer.stats)}
+    else:
+        # Doběhnutí práce na pozadí (např. rozesílka po /confirmcall)
+        background = asyncio.all_tasks() - {asyncio.current_task()} - api.connection_tasks
+        if background:
+            await asyncio.wait(background, timeout=10)
+        await application.shutdown()
+        extra = {"flood": dict(tenant.flood_guard.stats), "db_pool": dict(bot.db_pool.stats)}
+    await api.stop()
+
+    return {
+        "updates": len(records),
+        "users": len(user_ids),
+        "wall_seconds": round(wall, 3),
+        "throughput_ups": round(len(records) / wall, 1) if wall else None,
+        "latency_ms": {kind: percentiles(list(chain.from_iterable(samples[kind].values()))) for kind in RESPONSE_KINDS},
+        "by_kind": {kind: percentiles(values) for kind, values in sorted(samples["first_response"].items())},
+        "no_response": dict(no_response),
+        "api_calls": dict(api.calls),
+        **extra,
+    }
+
+
+def print_report(report: dict) -> None:
+    print(f"Replay '{report['label']}' ({report['mode']}): {report['updates']} updatů, {report['users']} uživatelů, "
+          f"{report['wall_seconds']} s, {report['throughput_ups']} updatů/s")
+    for kind in RESPONSE_KINDS:
+        print(f"  {kind:15s} {report['latency_ms'][kind]}")
+    print("  Podle druhu (first_response, ms):")
+    for kind, stats in report["by_kind"].items():
+        print(f"    {kind:18s} {stats}")
+    if report["no_response"]:
+        print(f"  Bez odpovědi: {report['no_response']}")
+    print(f"  API volání: {report['api_calls']}")
+    if "routed" in report:
+        print(f"  Updaty na workery: {report['routed']}, zápisy: {report['writer']}")
+
+
+def compare_reports(old_path: str, new_path: str) -> None:
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{'metrika':32s} {old['label']:>12s} {new['label']:>12s}   změna")
+    rows = [("throughput_ups", old["throughput_ups"], new["throughput_ups"])]
+    for kind in RESPONSE_KINDS:
+        for q in ("p50", "p90", "p99"):
+            rows.append((f"{kind}.{q} ms", old["latency_ms"][kind].get(q), new["latency_ms"][kind].get(q)))
+    for name, a, b in rows:
+        change = f"{100 * (b - a) / a:+.1f}%" if a and b is not None else "-"
+        print(f"{name:32s} {a!s:>12s} {b!s:>12s}   {change}")
+
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == "compare":
+        if len(argv) != 3:
+            print("Použití: python replay.py compare <starý.json> <nový.json>")
+            return 2
+        compare_reports(argv[1], argv[2])
+        return 0
+
+    parser = argparse.ArgumentParser(description="Replay zaznamenaného provozu proti FakeBotApi.")
+    parser.add_argument("recording")
+    parser.add_argument("--db", help="Snapshot DB (.sqlite3 nebo záloha .sqlite3.gz); bez něj prázdná DB")
+    parser.add_argument("--speed", type=float, default=0.0, help="1 = původní tempo, 2 = dvojnásobné, 0 = co nejrychleji (výchozí)")
+    parser.add_argument("--max-gap", type=float, default=10.0, help="Nejdelší pauza mezi updaty v s (před zrychlením)")
+    parser.add_argument("--concurrency", type=int, help="Max. souběžně zpracovávaných updatů (výchozí jako v Application)")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="Umělé zpoždění odpovědí API v ms")
+    parser.add_argument("--workers", type=int, default=0, help="Počet procesů workerů (0 = vše v jednom procesu jako dosud)")
+    parser.add_argument("--no-flood-guard", action="store_true", help="Vyjme všechny uživatele z flood guardu (vhodné pro --speed 0)")
+    parser.add_argument("--label", default=time.strftime("%Y%m%d-%H%M%S"), help="Označení verze v reportu")
+    parser.add_argument("--report", help="Kam uložit report (JSON)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    records = load_recording(args.recording)
+    if not records:
+        print(f"Záznam {args.recording} je prázdný.")
+        return 1
+    with tempfile.TemporaryDirectory(prefix="replay-") as workdir:
+        prepare_database(args.db, workdir)
+        report = asyncio.run(replay(records, args.speed, args.concurrency, args.max_gap, args.api_latency / 1000, args.no_flood_guard, args.workers))
+    mode = f"x{args.speed:g}" if args.speed > 0 else "max"
+    report.update(label=args.label, recording=os.path.basename(args.recording), mode=f"{mode}, {args.workers} workerů" if args.workers else mode)
+    print_report(report)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
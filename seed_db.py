@@ -2,7 +2,8 @@
 import sqlite3
 import logging
 import json  # <- Přidán import JSON
-from database import DATABASE_FILE  # Předpokládá, že database.py je ve stejném adresáři
+from database import DATABASE_FILE, DEFAULT_TENANT, status_code  # Předpokládá, že database.py je ve stejném adresáři
+from templates import validate_template
 
 # Nastavení logování
 logging.basicConfig(
@@ -60,15 +61,27 @@ def seed_calls_from_json():
                         f"Přeskakuji záznam kvůli chybějícím klíčům (name/deal_price): {call.get('name', 'BEZ NÁZVU')}"
                     )
                     continue
+                # Šablonu finálních instrukcí ověříme hned, ne až při prvním nákupu
+                if call.get("final_instructions"):
+                    template_error = validate_template(
+                        call["final_instructions"], call.get("data_needed")
+                    )
+                    if template_error:
+                        logging.warning(
+                            f"Přeskakuji '{call['name']}' kvůli neplatným final_instructions: {template_error}"
+                        )
+                        continue
 
                 cursor.execute(
                     """
                     INSERT INTO calls (
                         name, description, original_price, deal_price, status,
-                        data_needed, image_url, start_at, end_at, final_instructions
+                        data_needed, image_url, start_at, end_at, final_instructions, tenant,
+                        capacity, remaining
                     )
                     VALUES (:name, :description, :original_price, :deal_price, :status,
-                            :data_needed, :image_url, :start_at, :end_at, :final_instructions)
+                            :data_needed, :image_url, :start_at, :end_at, :final_instructions, :tenant,
+                            :capacity, :capacity)
                 """,
                     {
                         # Použijeme .get() s defaultními hodnotami pro volitelné sloupce
@@ -76,12 +89,14 @@ def seed_calls_from_json():
                         "description": call.get("description"),
                         "original_price": call.get("original_price"),
                         "deal_price": call["deal_price"],
-                        "status": call.get("status", "active"),  # Defaultně active
+                        "status": status_code("call", call.get("status", "active")),  # Defaultně active (v DB jako kód)
                         "data_needed": call.get("data_needed"),
                         "image_url": call.get("image_url"),
                         "start_at": call.get("start_at"),
                         "end_at": call.get("end_at"),
                         "final_instructions": call.get("final_instructions"),
+                        "tenant": call.get("tenant", DEFAULT_TENANT),  # Bot z BOTS, jinak výchozí
+                        "capacity": call.get("capacity"),  # Počet kusů, bez klíče neomezeně
                     },
                 )
                 inserted_count += 1
@@ -0,0 +1,168 @@
+# sessions.py
+# -*- coding: utf-8 -*-
+"""Úložiště rozpracovaných nákupů (sběr údajů k výzvě) s vypršením a LRU.
+
+Místo klíčů v context.user_data, které by zůstaly viset po každém
+nedokončeném nákupu, drží bot jednu kompaktní CheckoutSession na uživatele.
+Session se chová jako slovník (Mapping), takže ji lze předat přímo funkcím
+z bot_logic, které čtou user_data.
+
+Při restartu s předáním (lifecycle.py) se živé sessions uloží do DB (export)
+a nová instance na ně naváže (restore).
+"""
+import time
+import logging
+from collections import OrderedDict
+from collections.abc import Mapping
+
+logger = logging.getLogger(__name__)
+
+_UNSET = object()
+
+
+class CheckoutSession(Mapping):
+    """Stav jednoho rozpracovaného nákupu (bez __dict__, jen sloty)."""
+
+    # Klíče viditelné pro bot_logic (shodné s dřívějšími klíči user_data)
+    DATA_KEYS = ('current_call_id', 'current_call_capacity', 'data_needed_list', 'data_needed_index', 'collected_data_so_far', 'current_data_key')
+    __slots__ = ('user_id', 'chat_id', 'last_seen') + DATA_KEYS
+
+    def __init__(self, user_id: int, chat_id: int | None):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.last_seen = time.monotonic()
+        for key in self.DATA_KEYS:
+            setattr(self, key, _UNSET)
+
+    # --- Mapping rozhraní pro bot_logic ---
+    def __getitem__(self, key):
+        if key not in self.DATA_KEYS:
+            raise KeyError(key)
+        value = getattr(self, key)
+        if value is _UNSET:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        return (key for key in self.DATA_KEYS if getattr(self, key) is not _UNSET)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def snapshot(self) -> dict:
+        """Vyplněné klíče jako JSON-serializovatelný slovník (pro předání jiné instanci)."""
+        return {key: list(value) if isinstance(value, tuple) else value for key, value in self.items()}
+
+    def apply(self, result: dict) -> None:
+        """Promítne 'user_data_updates' a 'clear_keys' z výsledku bot_logic."""
+        for key in result.get('clear_keys', []):
+            if key in self.DATA_KEYS:
+                setattr(self, key, _UNSET)
+        for key, value in result.get('user_data_updates', {}).items():
+            if key not in self.DATA_KEYS:
+                logger.warning(f"Session: neznámý klíč '{key}' ignorován.")
+                continue
+            if key == 'data_needed_list':
+                value = tuple(value)  # Neměnný a menší než list
+            setattr(self, key, value)
+
+
+class SessionStore:
+    """Sessions podle user_id s vypršením po nečinnosti a limitem počtu (LRU)."""
+
+    def __init__(self, ttl_seconds: float, max_sessions: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._sessions: OrderedDict[int, CheckoutSession] = OrderedDict()
+        self._evicted: list[CheckoutSession] = []  # Vytlačené limitem, čekají na úklid
+        self.stats = {"started": 0, "expired": 0, "evicted": 0, "restored": 0}
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _is_expired(self, session: CheckoutSession, now: float) -> bool:
+        return now - session.last_seen > self.ttl_seconds
+
+    def get(self, user_id: int) -> CheckoutSession | None:
+        """Vrátí živou session uživatele a obnoví její čas; prošlou rovnou zahodí."""
+        session = self._sessions.get(user_id)
+        if session is None:
+            return None
+        now = time.monotonic()
+        if self._is_expired(session, now):
+            del self._sessions[user_id]
+            self._evicted.append(session)
+            self.stats["expired"] += 1
+            return None
+        session.last_seen = now
+        self._sessions.move_to_end(user_id)
+        return session
+
+    def peek(self, user_id: int) -> CheckoutSession | None:
+        """Session uživatele bez obnovení času (úklid na pozadí)."""
+        return self._sessions.get(user_id)
+
+    def start(self, user_id: int, chat_id: int | None) -> CheckoutSession:
+        """Založí novou session (případnou starší téhož uživatele nahradí)."""
+        self._sessions.pop(user_id, None)
+        session = CheckoutSession(user_id, chat_id)
+        self._sessions[user_id] = session
+        self.stats["started"] += 1
+        while len(self._sessions) > self.max_sessions:
+            _, oldest = self._sessions.popitem(last=False)
+            self._evicted.append(oldest)
+            self.stats["evicted"] += 1
+        return session
+
+    def drop(self, user_id: int) -> CheckoutSession | None:
+        """Odstraní session (dokončený nebo zrušený nákup)."""
+        return self._sessions.pop(user_id, None)
+
+    def evict_expired(self) -> list[CheckoutSession]:
+        """Odebere prošlé sessions a vrátí je spolu s těmi vytlačenými limitem."""
+        now = time.monotonic()
+        expired = self._evicted
+        self._evicted = []
+        # OrderedDict je seřazený od nejdéle nepoužité, stačí projít začátek
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if not self._is_expired(session, now):
+                break
+            del self._sessions[user_id]
+            expired.append(session)
+            self.stats["expired"] += 1
+        return expired
+
+    # --- Předání při restartu (viz lifecycle.py) ---
+    def export(self) -> list[tuple]:
+        """Živé sessions jako (user_id, chat_id, data, last_seen v sekundách epochy)."""
+        now = time.monotonic()
+        offset = time.time() - now  # monotonic -> čas epochy
+        return [
+            (user_id, session.chat_id, session.snapshot(), int(session.last_seen + offset))
+            for user_id, session in self._sessions.items()
+            if not self._is_expired(session, now)
+        ]
+
+    def restore(self, saved: list[dict]) -> int:
+        """Obnoví sessions předané jinou instancí (viz export) a vrátí jejich počet.
+
+        Prošlé se vynechají, stejně jako uživatelé, kteří mezitím začali nový nákup.
+        """
+        now = time.monotonic()
+        offset = time.time() - now
+        restored = 0
+        # Od nejnovější, každá na začátek - pořadí podle last_seen zůstane zachované
+        for entry in sorted(saved, key=lambda entry: entry['last_seen'], reverse=True):
+            if entry['user_id'] in self._sessions:
+                continue
+            session = CheckoutSession(entry['user_id'], entry['chat_id'])
+            session.apply({'user_data_updates': entry['data']})
+            session.last_seen = min(now, entry['last_seen'] - offset)
+            if self._is_expired(session, now):
+                continue
+            self._sessions[entry['user_id']] = session
+            self._sessions.move_to_end(entry['user_id'], last=False)
+            restored += 1
+        self.stats["restored"] += restored
+        return restored
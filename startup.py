@@ -0,0 +1,33 @@
+# startup.py
+# -*- coding: utf-8 -*-
+"""Měření startu bota po fázích (importy, DB, sestavení, initialize, předehřátí).
+
+Fáze se zapisují postupně (`mark` = čas od předchozí značky), výsledný rozpad
+se zaloguje, jakmile je bot připravený přijímat updaty, a je i v /stats.
+"""
+import time
+
+
+class StartupTimer:
+    """Rozpad času startu na pojmenované fáze."""
+
+    def __init__(self, origin: float | None = None):
+        self.origin = time.perf_counter() if origin is None else origin
+        self._last = self.origin
+        self.phases: dict[str, float] = {}  # fáze -> sekundy (opakovaná fáze se sčítá)
+
+    def mark(self, phase: str) -> float:
+        """Ukončí fázi `phase` (trvala od předchozí značky) a vrátí její délku."""
+        now = time.perf_counter()
+        elapsed = now - self._last
+        self.phases[phase] = self.phases.get(phase, 0.0) + elapsed
+        self._last = now
+        return elapsed
+
+    @property
+    def total(self) -> float:
+        return self._last - self.origin
+
+    def report(self) -> str:
+        parts = ", ".join(f"{phase} {seconds * 1000:.0f} ms" for phase, seconds in self.phases.items())
+        return f"{self.total * 1000:.0f} ms ({parts})"
@@ -0,0 +1,470 @@
+# stress_db.py
+# -*- coding: utf-8 -*-
+"""Zátěžový test souběhu: upserty účastí a uživatelů, závody v konverzaci.
+
+Každý scénář běží nad čerstvou dočasnou DB, zápisy jdou přímo přes funkce
+database.py (jako v jednoprocesovém režimu) z mnoha vláken a procesů:
+
+- naval       tisíce uživatelů se najednou přihlásí do jedné výzvy
+              (add_or_update_user, zájem, údaje),
+- dvojklik    stejný uživatel odešle údaje --taps× současně (první INSERT
+              i UPDATE větev upsertu ON CONFLICT(user_id, call_id)),
+- zruseni     odeslání údajů souběžně se zrušením účasti,
+- profil      souběžné add_or_update_user pro stejné user_id s různými jmény,
+- kapacita    žhavá výzva s omezeným počtem kusů: všichni najednou rezervují
+              (dvojklik s různým počtem kusů), každý čtvrtý souběžně ruší -
+              sklad se nesmí přeprodat ani ztratit kusy,
+- konverzace  skutečné handlery bota (dvojklik na 'Mám zájem', zadání údaje,
+              /cancel souběžně s posledním údajem) v asyncio přes db_pool.
+
+Po každém scénáři ověří invarianty výsledného stavu (jediný řádek na
+uživatele a výzvu, platné stavy, zrušená účast bez údajů, celistvý profil,
+sklad = kapacita - rezervace, cache a sessions bota v souladu s DB), spočítá chyby 'database is locked'
+a ostatní neúspěšné zápisy a vypíše propustnost a latenci zápisů.
+Při porušení invariantu skončí s návratovým kódem 1.
+
+Použití: python stress_db.py [--users 2000] [--threads 8] [--processes 4] [--taps 4] [--in-flight 50] [--capacity 1000] [--wal] [--scenario naval ...]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:stress")  # Konverzace běží jen proti falešným objektům Telegramu
+
+import database
+from database import add_or_update_participation, add_or_update_user, reserve_participation
+
+LOCKED = "database is locked"
+FIRST_USER_ID = 100000
+DATA_NEEDED = "email"
+SCENARIOS = ("naval", "dvojklik", "zruseni", "profil", "kapacita", "konverzace")
+
+
+class ErrorCounter(logging.Handler):
+    """Počítá chyby zalogované database.py (funkce chybu zalogují a vrátí False)."""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.locked = 0
+        self.other = Counter()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        message = record.getMessage()
+        if LOCKED in message:
+            self.locked += 1
+        else:
+            self.other[message.split(":")[0][:60]] += 1
+
+    @classmethod
+    def install(cls) -> "ErrorCounter":
+        counter = cls()
+        db_logger = logging.getLogger(database.__name__)
+        db_logger.handlers[:] = [counter]
+        db_logger.propagate = False  # Tisíce chyb nepatří na výstup, jen do souhrnu
+        return counter
+
+
+def profile(user_id: int, variant: int) -> tuple:
+    return user_id, f"Jméno{variant}", f"Příjmení{variant}", f"user{user_id}_{variant}"
+
+
+def collected(user_id: int, variant: int) -> dict:
+    return {"email": f"u{user_id}@example.cz", "pokus": variant}
+
+
+def quantity(user_id: int, variant: int) -> int:
+    return 1 + (user_id + variant) % 3
+
+
+def steps(op: tuple) -> list[tuple]:
+    """Zápisy jedné operace (druh, user_id, call_id, varianta) v pořadí, jak je dělá bot."""
+    kind, user_id, call_id, variant = op
+    join = (add_or_update_participation, (user_id, call_id, "interested"))
+    submit = (add_or_update_participation, (user_id, call_id, "data_collected", collected(user_id, variant)))
+    if kind == "nakup":
+        return [(add_or_update_user, profile(user_id, variant)), join, submit]
+    if kind == "udaje":
+        return [submit]
+    if kind == "zruseni":
+        return [(add_or_update_participation, (user_id, call_id, "cancelled"))]
+    if kind == "profil":
+        return [(add_or_update_user, profile(user_id, variant))]
+    if kind == "rezervace":
+        # Vyprodáno je platný výsledek (vrací slovník), selhání jen None
+        return [(reserve_participation, (user_id, call_id, "interested", None, quantity(user_id, variant)))]
+    raise ValueError(f"Neznámá operace {kind}")
+
+
+def run_ops(path: str, ops: list[tuple], threads: int, barrier=None) -> dict:
+    """Provede operace z `threads` vláken; vrací počty a latence zápisů (ms)."""
+    database.DATABASE_FILE = path
+    counter = ErrorCounter.install()
+    latencies = []
+    failed_users = set()
+
+    def execute(op: tuple) -> None:
+        for func, args in steps(op):
+            started = time.perf_counter()
+            ok = func(*args)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if not ok:
+                failed_users.add(op[1])
+                return
+
+    if barrier is not None:
+        barrier.wait()  # Všechny procesy začnou naráz
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(execute, ops))
+    return {"writes": len(latencies), "latencies": latencies, "failed_users": failed_users,
+            "locked": counter.locked, "errors": counter.other}
+
+
+def process_main(path: str, ops: list[tuple], threads: int, barrier, results) -> None:
+    results.put(run_ops(path, ops, threads, barrier))
+
+
+def run_parallel(path: str, ops: list[tuple], threads: int, processes: int) -> tuple[dict, float]:
+    """Rozdělí operace po jedné mezi procesy (kopie téže operace tak běží v různých procesech)."""
+    if processes <= 1:
+        started = time.perf_counter()
+        result = run_ops(path, ops, threads)
+        return result, time.perf_counter() - started
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(processes + 1)
+    results = context.Queue()
+    workers = [context.Process(target=process_main, args=(path, ops[index::processes], threads, barrier, results))
+               for index in range(processes)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    started = time.perf_counter()
+    parts = [results.get() for _ in workers]
+    elapsed = time.perf_counter() - started
+    for worker in workers:
+        worker.join()
+    merged = {"writes": 0, "latencies": [], "failed_users": set(), "locked": 0, "errors": Counter()}
+    for part in parts:
+        merged["writes"] += part["writes"]
+        merged["latencies"] += part["latencies"]
+        merged["failed_users"] |= part["failed_users"]
+        merged["locked"] += part["locked"]
+        merged["errors"] += part["errors"]
+    return merged, elapsed
+
+
+# --- Příprava DB ---
+
+def prepare(path: str, wal: bool, capacity: int | None = None) -> int:
+    """Čerstvá DB s jednou aktivní výzvou (volitelně s kapacitou); vrací její call_id."""
+    database.DATABASE_FILE = path
+    database.ARCHIVE_DATABASE_FILE = os.path.join(os.path.dirname(path), "archive.sqlite3")
+    database.init_db()
+    if wal:
+        conn = database.get_db_connection()
+        conn.execute("PRAGMA journal_mode = WAL")  # Jako workers.enable_wal
+        conn.close()
+    return database.add_new_call("Zátěžová výzva", "stress", 100, 50, "active", DATA_NEEDED, "Díky, {user_first_name}!", capacity=capacity)
+
+
+def seed_users(path: str, user_ids: list[int], call_id: int | None = None, consent: str = "pending") -> None:
+    """Hromadně vloží uživatele (a případně jejich zájem o výzvu) mimo měření."""
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO users (telegram_id, first_name, last_name, username, consent_status) VALUES (?, ?, ?, ?, ?)",
+        [profile(user_id, 0) + (database.status_code("consent", consent),) for user_id in user_ids],
+    )
+    if call_id is not None:
+        conn.executemany(
+            "INSERT INTO participations (user_id, call_id, status) VALUES (?, ?, ?)",
+            [(user_id, call_id, database.status_code("participation", "interested")) for user_id in user_ids],
+        )
+    conn.commit()
+    conn.close()
+
+
+# --- Invarianty ---
+
+def participations(path: str, call_id: int) -> tuple[dict, list[str]]:
+    """Účasti ve výzvě podle uživatele; porušení obecných invariantů (duplicity, neplatný stav, údaje)."""
+    conn = sqlite3.connect(path)
+    rows = conn.execute("SELECT user_id, status, collected_data FROM participations WHERE call_id = ?", (call_id,)).fetchall()
+    conn.close()
+    by_user, violations = {}, []
+    for user_id, code, data in rows:
+        status = database.status_name("participation", code)
+        if user_id in by_user:
+            violations.append(f"user {user_id}: víc řádků účasti v jedné výzvě")
+        if status is None:
+            violations.append(f"user {user_id}: neplatný kód stavu {code}")
+        if status == "cancelled" and data is not None:
+            violations.append(f"user {user_id}: zrušená účast s údaji {data}")
+        if status == "data_collected":
+            try:
+                if not json.loads(data).get("email"):
+                    raise ValueError
+            except (TypeError, ValueError, AttributeError):
+                violations.append(f"user {user_id}: data_collected bez platných údajů ({data})")
+        by_user[user_id] = (status, json.loads(data) if data else None)
+    return by_user, violations
+
+
+def expect_all(by_user: dict, user_ids: list[int], failed_users: set, statuses: tuple) -> list[str]:
+    """Každý uživatel bez neúspěšného zápisu má účast v některém z `statuses`."""
+    violations = []
+    for user_id in user_ids:
+        if user_id in failed_users:
+            continue
+        status = by_user.get(user_id, (None,))[0]
+        if status not in statuses:
+            violations.append(f"user {user_id}: stav {status}, čekáno {'/'.join(statuses)}")
+    return violations
+
+
+def check_naval(path, call_id, user_ids, result, args) -> tuple[list[str], Counter]:
+    by_user, violations = participations(path, call_id)
+    violations += expect_all(by_user, user_ids, result["failed_users"], ("data_collected",))
+    conn = sqlite3.connect(path)
+    users = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    conn.close()
+    if users < len(user_ids) - len(result["failed_users"]):
+        violations.append(f"v tabulce users je {users} z {len(user_ids)} uživatelů")
+    return violations, Counter(status for status, _ in by_user.values())
+
+
+def check_dvojklik(path, call_id, user_ids, result, args) -> tuple[list[str], Counter]:
+    by_user, violations = participations(path, call_id)
+    violations += expect_all(by_user, user_ids, result["failed_users"], ("data_collected",))
+    for user_id, (status, data) in by_user.items():
+        if data and data.get("pokus") not in range(args.taps):
+            violations.append(f"user {user_id}: údaje z neexistujícího pokusu {data}")
+    return violations, Counter(status for status, _ in by_user.values())
+
+
+def check_zruseni(path, call_id, user_ids, result, args) -> tuple[list[str], Counter]:
+    by_user, violations = participations(path, call_id)
+    # Vyhraje zápis, který doběhl později - oba výsledky jsou platné, 'interested' ne
+    violations += expect_all(by_user, user_ids, result["failed_users"], ("data_collected", "cancelled"))
+    return violations, Counter(status for status, _ in by_user.values())
+
+
+def check_profil(path, call_id, user_ids, result, args) -> tuple[list[str], Counter]:
+    conn = sqlite3.connect(path)
+    rows = conn.execute("SELECT telegram_id, first_name, last_name, username FROM users").fetchall()
+    conn.close()
+    violations, seen, outcome = [], Counter(), Counter()
+    for user_id, first_name, last_name, username in rows:
+        seen[user_id] += 1
+        variant = first_name.removeprefix("Jméno")
+        # Celý profil musí pocházet z jednoho zápisu
+        if (last_name, username) != (f"Příjmení{variant}", f"user{user_id}_{variant}"):
+            violations.append(f"user {user_id}: smíšený profil {first_name}/{last_name}/{username}")
+        outcome[f"pokus {variant}"] += 1
+    violations += [f"user {user_id}: {count} řádky" for user_id, count in seen.items() if count > 1]
+    violations += [f"user {user_id}: chybí" for user_id in user_ids if user_id not in seen and user_id not in result["failed_users"]]
+    return violations, outcome
+
+
+def check_kapacita(path, call_id, user_ids, result, args) -> tuple[list[str], Counter]:
+    by_user, violations = participations(path, call_id)
+    conn = sqlite3.connect(path)
+    capacity, remaining = conn.execute("SELECT capacity, remaining FROM calls WHERE call_id = ?", (call_id,)).fetchone()
+    reserved = dict(conn.execute("SELECT user_id, reserved FROM participations WHERE call_id = ?", (call_id,)).fetchall())
+    conn.close()
+    if remaining < 0:
+        violations.append(f"přeprodáno: remaining {remaining}")
+    if remaining != capacity - sum(reserved.values()):
+        violations.append(f"sklad nesedí: remaining {remaining}, kapacita {capacity} - rezervace {sum(reserved.values())}")
+    for user_id, held in reserved.items():
+        if by_user[user_id][0] == "cancelled" and held:
+            violations.append(f"user {user_id}: zrušená účast drží {held} ks")
+        elif held and held not in {quantity(user_id, tap) for tap in range(args.taps)}:
+            violations.append(f"user {user_id}: rezervace {held} ks z neexistujícího pokusu")
+    outcome = Counter(f"{status} {'s rezervací' if reserved[user_id] else 'bez kusů'}" for user_id, (status, _) in by_user.items())
+    outcome["zbývá ks"] = remaining
+    return violations, outcome
+
+
+def db_scenario(name: str, path: str, call_id: int, user_ids: list[int], args) -> tuple:
+    """(operace, kontrola) pro scénáře, které zapisují přímo přes database.py."""
+    taps = range(args.taps)
+    if name == "naval":
+        ops = [("nakup", user_id, call_id, 0) for user_id in user_ids]
+        return ops, check_naval
+    if name == "dvojklik":
+        seed_users(path, user_ids)
+        ops = [("udaje", user_id, call_id, tap) for user_id in user_ids for tap in taps]
+        return ops, check_dvojklik
+    if name == "zruseni":
+        seed_users(path, user_ids, call_id)
+        ops = [op for user_id in user_ids for op in (("udaje", user_id, call_id, 0), ("zruseni", user_id, call_id, 0))]
+        return ops, check_zruseni
+    if name == "kapacita":
+        seed_users(path, user_ids)
+        ops = [("rezervace", user_id, call_id, tap) for user_id in user_ids for tap in taps]
+        ops += [("zruseni", user_id, call_id, 0) for user_id in user_ids[::4]]
+        return ops, check_kapacita
+    ops = [("profil", user_id, call_id, tap) for user_id in user_ids for tap in taps]
+    return ops, check_profil
+
+
+# --- Konverzace přes handlery bota ---
+
+class FakeTelegram:
+    """Falešné Update/Context pro handlery; počítá odpovědi podle textu."""
+
+    def __init__(self, tenant):
+        self.tenant = tenant
+        self.replies = Counter()
+        self.user_data = {}
+
+    async def _reply(self, text=None, **kwargs) -> None:
+        self.replies[(text or "")[:40]] += 1
+
+    async def _answer(self, *args, **kwargs) -> None:
+        pass
+
+    def update(self, user_id: int, text: str | None = None, callback_data: str | None = None):
+        user = SimpleNamespace(id=user_id, first_name="Jan", last_name="Novák", username=f"user{user_id}")
+        message = SimpleNamespace(text=text, chat_id=user_id, reply_text=self._reply)
+        query = SimpleNamespace(data=callback_data, message=message, from_user=user,
+                                answer=self._answer, edit_message_text=self._reply) if callback_data else None
+        return SimpleNamespace(effective_user=user, effective_chat=SimpleNamespace(id=user_id),
+                               message=message if text is not None else None, callback_query=query)
+
+    def context(self, user_id: int):
+        from tenants import TENANT_KEY
+        return SimpleNamespace(bot=SimpleNamespace(send_message=self._reply), bot_data={TENANT_KEY: self.tenant},
+                               user_data=self.user_data.setdefault(user_id, {}), args=[],
+                               application=SimpleNamespace(create_task=lambda coro, **kwargs: asyncio.ensure_future(coro)))
+
+
+async def run_conversations(path: str, call_id: int, user_ids: list[int], args) -> tuple[dict, float, list[str], Counter]:
+    """Nejvýše --in-flight uživatelů najednou: dvojklik na výzvu, údaj; každý druhý pošle /cancel souběžně s údajem."""
+    import bot
+    from tenants import Tenant
+
+    database.DATABASE_FILE = path
+    counter = ErrorCounter.install()
+    tenant = Tenant(None, os.environ["TELEGRAM_BOT_TOKEN"])
+    fake = FakeTelegram(tenant)
+    crashes = Counter()
+    calls = 0
+    in_flight = asyncio.Semaphore(args.in_flight)
+
+    async def handler(func, user_id: int, **update) -> None:
+        nonlocal calls
+        calls += 1
+        try:
+            await func(fake.update(user_id, **update), fake.context(user_id))
+        except Exception as e:
+            crashes[f"{func.__name__}: {type(e).__name__}"] += 1
+
+    async def user_flow(user_id: int) -> None:
+        async with in_flight:
+            await conversation(user_id)
+
+    async def conversation(user_id: int) -> None:
+        await asyncio.gather(*(handler(bot.handle_call_selection, user_id, callback_data=f"call_{call_id}") for _ in range(args.taps)))
+        data_input = handler(bot.process_data_input, user_id, text=f"u{user_id}@example.cz")
+        if user_id % 2:
+            await data_input
+        else:
+            await asyncio.gather(data_input, handler(bot.cancel_all_conversations, user_id, text="/cancel"))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user_flow(user_id) for user_id in user_ids))
+    elapsed = time.perf_counter() - started
+
+    by_user, violations = participations(path, call_id)
+    busy = fake.replies[bot.BUSY_TEXT[:40]]
+    if not busy:
+        violations += expect_all(by_user, user_ids[1::2], set(), ("data_collected",))
+        violations += expect_all(by_user, user_ids[0::2], set(), ("data_collected", "cancelled"))
+    violations += [f"{count}× výjimka {name}" for name, count in crashes.items()]
+    if len(tenant.sessions):
+        violations.append(f"po doběhnutí zůstalo {len(tenant.sessions)} rozpracovaných nákupů")
+    # Cache aktivních účastí (user_cache) musí odpovídat DB
+    for user_id in user_ids:
+        cached = [row["call_id"] for row in bot.load_active_participations(user_id, tenant.name)]
+        stored = [row["call_id"] for row in database.get_user_active_participations(user_id, tenant.name)]
+        if cached != stored:
+            violations.append(f"user {user_id}: cache účastí {cached} != DB {stored}")
+    outcome = Counter(status for status, _ in by_user.values())
+    if busy:
+        outcome["odmítnuto (pool plný)"] = busy
+    result = {"writes": calls, "latencies": [], "failed_users": set(), "locked": counter.locked, "errors": counter.other}
+    return result, elapsed, violations, outcome
+
+
+# --- Běh ---
+
+def run_scenario(name: str, workdir: str, args) -> bool:
+    from replay import percentiles
+
+    path = os.path.join(workdir, f"{name}.sqlite3")
+    call_id = prepare(path, args.wal, args.capacity if name == "kapacita" else None)
+    user_ids = list(range(FIRST_USER_ID, FIRST_USER_ID + args.users))
+    if name == "konverzace":
+        seed_users(path, user_ids, consent="granted")
+        result, elapsed, violations, outcome = asyncio.run(run_conversations(path, call_id, user_ids, args))
+        unit = "handlerů"
+    else:
+        ops, check = db_scenario(name, path, call_id, user_ids, args)
+        result, elapsed = run_parallel(path, ops, args.threads, args.processes)
+        violations, outcome = check(path, call_id, user_ids, result, args)
+        unit = "zápisů"
+
+    stats = percentiles(result["latencies"])
+    print(f"\n== {name} ==")
+    print(f"  {result['writes']} {unit} za {elapsed:.2f} s  ->  {result['writes'] / elapsed:,.0f} {unit}/s".replace(",", " "))
+    if stats["count"]:
+        print(f"  latence zápisu ms: p50 {stats['p50']}  p90 {stats['p90']}  p99 {stats['p99']}  max {stats['max']}")
+    print(f"  '{LOCKED}': {result['locked']}   jiné chyby DB: {sum(result['errors'].values())}   uživatelů s neúspěšným zápisem: {len(result['failed_users'])}")
+    for message, count in result["errors"].most_common(3):
+        print(f"    {count}× {message}")
+    print("  výsledný stav: " + ", ".join(f"{status} {count}" for status, count in sorted(outcome.items(), key=str)))
+    if violations:
+        print(f"  PORUŠENO {len(violations)} invariantů, např.:")
+        for violation in violations[:5]:
+            print(f"    {violation}")
+    else:
+        print("  invarianty OK")
+    return not violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Zátěžový test souběžných zápisů do DB a závodů v konverzaci.")
+    parser.add_argument("--users", type=int, default=2000, help="Počet uživatelů ve scénáři")
+    parser.add_argument("--threads", type=int, default=8, help="Vláken v každém procesu")
+    parser.add_argument("--processes", type=int, default=4, help="Počet procesů (1 = jen vlákna)")
+    parser.add_argument("--taps", type=int, default=4, help="Kolikrát současně pošle stejný uživatel tutéž akci")
+    parser.add_argument("--in-flight", type=int, default=50, help="Souběžných konverzací (nad limit db_pool bot odmítá)")
+    parser.add_argument("--capacity", type=int, default=1000, help="Kusů žhavé výzvy ve scénáři kapacita")
+    parser.add_argument("--wal", action="store_true", help="Journal mode WAL (jako režim s workery)")
+    parser.add_argument("--scenario", nargs="+", choices=SCENARIOS, default=list(SCENARIOS), help="Které scénáře spustit")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+
+    workdir = tempfile.mkdtemp(prefix="stress_db_")
+    try:
+        print(f"Uživatelů: {args.users}, procesů: {args.processes} × vláken: {args.threads}, "
+              f"souběžných opakování: {args.taps}, journal: {'WAL' if args.wal else 'výchozí'}")
+        passed = [run_scenario(name, workdir, args) for name in args.scenario]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(0 if all(passed) else 1)
+
+
+if __name__ == "__main__":
+    main()
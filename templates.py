@@ -0,0 +1,162 @@
+# templates.py
+# -*- coding: utf-8 -*-
+"""Předkompilované šablony final_instructions.
+
+Šablona se rozloží (string.Formatter) jednou - při zápisu výzvy se tím ověří,
+že obsahuje jen známé placeholdery, a při běhu se zkompilovaná podoba drží
+v cache podle call_id, takže dokončení nákupu už nemusí šablonu znovu
+načítat z DB ani parsovat.
+
+Vedle šablon drží cache i katalog aktivních výzev každého bota (/vyzvy);
+jakákoli změna výzvy (invalidate, clear) katalogy zahodí.
+"""
+import logging
+import string
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Placeholdery dostupné v každé šabloně (doplněné o položky data_needed výzvy)
+BASE_PLACEHOLDERS = ("user_first_name", "user_id", "call_name", "deal_price", "call_id")
+
+_formatter = string.Formatter()
+_CONVERSIONS = {None: lambda value: value, "s": str, "r": repr, "a": ascii}
+
+
+class TemplateError(ValueError):
+    """Šablona final_instructions je neplatná (syntaxe nebo neznámý placeholder)."""
+
+
+def allowed_placeholders(data_needed: str | None) -> tuple[str, ...]:
+    """Placeholdery povolené pro výzvu s daným data_needed."""
+    extra = [item.strip() for item in (data_needed or "").split(",") if item.strip()]
+    return BASE_PLACEHOLDERS + tuple(extra)
+
+
+class CompiledTemplate:
+    """Šablona rozložená na literály a pole, připravená k rychlému vyplnění."""
+
+    __slots__ = ("source", "parts", "fields")
+
+    def __init__(self, source: str, parts: tuple, fields: frozenset):
+        self.source = source
+        self.parts = parts  # (literal, field, conversion, format_spec)
+        self.fields = fields
+
+    def render(self, values: dict) -> str:
+        out = []
+        for literal, field, conversion, format_spec in self.parts:
+            out.append(literal)
+            if field is not None:
+                out.append(format(_CONVERSIONS[conversion](values[field]), format_spec))
+        return "".join(out)
+
+
+def compile_template(source: str, data_needed: str | None = None) -> CompiledTemplate:
+    """Rozloží a ověří šablonu. Při chybě vyvolá TemplateError."""
+    allowed = set(allowed_placeholders(data_needed))
+    parts = []
+    fields = set()
+    try:
+        parsed = list(_formatter.parse(source))
+    except ValueError as e:
+        raise TemplateError(f"Neplatná syntaxe šablony: {e}") from e
+    for literal, field, format_spec, conversion in parsed:
+        if field is None:
+            parts.append((literal, None, None, ""))
+            continue
+        if field == "" or field.isdigit():
+            raise TemplateError("Poziční placeholdery ({} nebo {0}) nejsou povoleny.")
+        if "." in field or "[" in field:
+            raise TemplateError(f"Placeholder {{{field}}} nesmí obsahovat přístup k atributům.")
+        if field not in allowed:
+            raise TemplateError(f"Neznámý placeholder {{{field}}}.")
+        if format_spec and "{" in format_spec:
+            raise TemplateError(f"Vnořené placeholdery ve formátu {{{field}}} nejsou povoleny.")
+        if conversion not in _CONVERSIONS:
+            raise TemplateError(f"Neplatná konverze !{conversion} u {{{field}}}.")
+        fields.add(field)
+        parts.append((literal, field, conversion, format_spec or ""))
+    return CompiledTemplate(source, tuple(parts), frozenset(fields))
+
+
+def validate_template(source: str, data_needed: str | None = None) -> str | None:
+    """Vrátí chybovou zprávu, nebo None, pokud je šablona v pořádku."""
+    try:
+        compile_template(source, data_needed)
+        return None
+    except TemplateError as e:
+        return str(e)
+
+
+class CachedCall:
+    """Údaje výzvy potřebné k dokončení nákupu + zkompilovaná šablona."""
+
+    __slots__ = ("call", "compiled")
+
+    def __init__(self, call: dict, compiled: CompiledTemplate | None):
+        self.call = call
+        self.compiled = compiled
+
+
+class TemplateCache:
+    """Cache zkompilovaných šablon podle call_id (LRU, s ruční invalidací)."""
+
+    _CALL_FIELDS = ("call_id", "tenant", "name", "status", "deal_price", "data_needed", "final_instructions", "capacity")
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self._entries: OrderedDict[int, CachedCall] = OrderedDict()
+        self._catalogues: dict[str, list] = {}  # tenant -> aktivní výzvy (řádky get_active_calls)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def put(self, call) -> CachedCall:
+        """Zkompiluje šablonu výzvy (řádek z DB) a uloží ji do cache."""
+        snapshot = {key: call[key] for key in self._CALL_FIELDS}
+        compiled = None
+        if snapshot["final_instructions"]:
+            try:
+                compiled = compile_template(snapshot["final_instructions"], snapshot["data_needed"])
+            except TemplateError as e:
+                # Starší výzvy mohly vzniknout bez validace - vykreslí se syrová šablona
+                logger.warning(f"Šablona výzvy {snapshot['call_id']} je neplatná: {e}")
+        entry = CachedCall(snapshot, compiled)
+        self._entries[snapshot["call_id"]] = entry
+        self._entries.move_to_end(snapshot["call_id"])
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return entry
+
+    def get(self, call_id: int) -> CachedCall | None:
+        entry = self._entries.get(call_id)
+        if entry is not None:
+            self._entries.move_to_end(call_id)
+        return entry
+
+    def get_or_put(self, call) -> CachedCall:
+        """Vrátí položku z cache, pokud odpovídá aktuální šabloně výzvy, jinak ji obnoví."""
+        entry = self.get(call["call_id"])
+        if entry is not None and entry.call["final_instructions"] == call["final_instructions"]:
+            return entry
+        return self.put(call)
+
+    def catalogue(self, tenant: str) -> list | None:
+        return self._catalogues.get(tenant)
+
+    def set_catalogue(self, tenant: str, calls: list) -> None:
+        self._catalogues[tenant] = calls
+
+    def invalidate(self, call_id: int) -> None:
+        """Zahodí výzvu (změněnou, uzavřenou nebo nově přidanou) i katalogy, ve kterých může být."""
+        self._entries.pop(call_id, None)
+        self._catalogues.clear()
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._catalogues.clear()
+
+
+# Sdílená cache pro celý proces (bot, rozesílky)
+call_templates = TemplateCache()
@@ -0,0 +1,50 @@
+# tenants.py
+# -*- coding: utf-8 -*-
+"""Stav jednoho hostovaného bota (tenantu) při běhu více botů v jednom procesu.
+
+Každý token z BOT_CONFIGS dostane vlastní Application a vlastní Tenant:
+admini, klíč deep-linků, rozpracované nákupy, deduplikaci updatů a flood
+guard. Sdílené zůstává vše, co patří procesu - DB (s rozlišením sloupcem
+`tenant`), pool vláken, cache šablon a limiter odchozích zpráv.
+
+Handlery se ke svému tenantu dostanou přes `tenant_of(context)`.
+"""
+from config import (
+    DEEPLINK_SECRET, SESSION_TTL_SECONDS, SESSION_MAX, UPDATE_DEDUP_WINDOW,
+    FLOOD_RATE_PER_SECOND, FLOOD_BURST, CALLBACK_DEDUP_SECONDS
+)
+from database import DEFAULT_TENANT
+from deeplinks import tenant_key
+from flood_guard import FloodGuard
+from sessions import SessionStore
+from update_tracking import UpdateTracker
+
+TENANT_KEY = "tenant"  # Klíč v application.bot_data
+
+
+class Tenant:
+    """Jeden bot: token, admini a stav, který se mezi boty nesdílí."""
+
+    __slots__ = ("name", "token", "admin_ids", "primary", "deeplink_key", "sessions", "update_tracker", "flood_guard")
+
+    def __init__(self, name: str | None, token: str, admin_ids=(), primary: bool = True):
+        self.name = name or DEFAULT_TENANT
+        self.token = token
+        self.admin_ids = set(admin_ids)
+        self.primary = primary  # Jen primární bot spouští procesní úlohy (zálohy)
+        self.deeplink_key = tenant_key(token, DEEPLINK_SECRET, None if self.name == DEFAULT_TENANT else self.name)
+        self.sessions = SessionStore(ttl_seconds=SESSION_TTL_SECONDS, max_sessions=SESSION_MAX)
+        self.update_tracker = UpdateTracker(window=UPDATE_DEDUP_WINDOW, tenant=self.name)
+        self.flood_guard = FloodGuard(rate_per_second=FLOOD_RATE_PER_SECOND, burst=FLOOD_BURST,
+                                      dedup_seconds=CALLBACK_DEDUP_SECONDS, exempt_ids=self.admin_ids)
+
+    def is_admin(self, user_id: int) -> bool:
+        return user_id in self.admin_ids
+
+    def __repr__(self) -> str:
+        return f"Tenant({self.name!r})"
+
+
+def tenant_of(context_or_application) -> Tenant:
+    """Tenant z CallbackContextu nebo Application (uložený v bot_data)."""
+    return context_or_application.bot_data[TENANT_KEY]
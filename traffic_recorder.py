@@ -0,0 +1,123 @@
+# traffic_recorder.py
+# -*- coding: utf-8 -*-
+"""Anonymizovaný záznam příchozího provozu pro replay (viz replay.py).
+
+Každý update se připíše jako jeden řádek JSON s krátkými klíči:
+
+    {"t": 1760000000.123, "u": 4821937650, "k": "m", "x": "/vyzvy"}
+
+- t: čas přijetí (epoch s, na ms)
+- u: pseudonym uživatele (HMAC user_id se solí, stejný v rámci záznamu)
+- k: druh - "m" zpráva, "c" callback tlačítka, "o" jiný update
+- x: text zprávy / callback_data (anonymizované, viz scrub_text)
+- a: 1, pokud je odesílatel admin (replay ho pak jako admina nastaví)
+
+Jména, username ani ID chatu se neukládají. Volný text běžných uživatelů
+se anonymizuje se zachováním tvaru (písmena -> x, každá číslice -> 1),
+aby validace v process_data_input při replayi dopadla stejně. Příkazy,
+callback_data, texty tlačítek bota a vstupy adminů se ukládají beze změny.
+Soubor se jen připisuje (append-only), každý start bota zapíše hlavičku.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import time
+
+from telegram import Update
+from telegram.ext import ContextTypes, TypeHandler
+
+import bot_logic
+
+logger = logging.getLogger(__name__)
+
+RECORD_GROUP = -3  # Před flood guardem (-2), aby se zachytil i provoz, který guard zahodí
+RECORDING_VERSION = 1
+
+# Texty tlačítek bota - musí zůstat beze změny, jinak se při replayi nenasměrují
+KEEP_TEXTS = frozenset({
+    bot_logic.CONSENT_YES, bot_logic.CONSENT_NO,
+    bot_logic.CONFIRM_SAVE_CALL, bot_logic.CONFIRM_DISCARD_CALL,
+})
+_DIGITS_RE = re.compile(r"\d")
+
+
+def scrub_text(text: str) -> str:
+    """Anonymizuje volný text se zachováním tvaru (pro stejný výsledek validace)."""
+    if text in KEEP_TEXTS:
+        return text
+    if text.startswith("/"):
+        return text  # Příkaz a jeho argumenty (ID, podepsaný payload) nejsou osobní údaje
+    text = _DIGITS_RE.sub("1", text)  # I krátké skupiny: telefon "+420 777 123 456", PSČ, číslo popisné
+    return "".join(("X" if ch.isupper() else "x") if ch.isalpha() else ch for ch in text)
+
+
+class TrafficRecorder:
+    """TypeHandler, který připisuje anonymizované updaty do souboru."""
+
+    def __init__(self, path: str, admin_ids=(), salt: str | None = None):
+        self.path = path
+        self.admin_ids = admin_ids
+        self._salt = (salt or os.urandom(16).hex()).encode("utf-8")
+        self._file = None
+        self.recorded = 0
+
+    def pseudonym(self, user_id: int) -> int:
+        digest = hmac.new(self._salt, str(user_id).encode("ascii"), hashlib.sha256).digest()
+        return 1_000_000_000 + int.from_bytes(digest[:5], "big") % 8_000_000_000
+
+    def to_record(self, update: Update, now: float | None = None) -> dict | None:
+        user = update.effective_user
+        if user is None:
+            return None
+        record = {"t": round(time.time() if now is None else now, 3), "u": self.pseudonym(user.id)}
+        is_admin = user.id in self.admin_ids
+        if update.callback_query:
+            record.update(k="c", x=update.callback_query.data or "")
+        elif update.message and update.message.text is not None:
+            text = update.message.text
+            record.update(k="m", x=text if is_admin else scrub_text(text))
+        else:
+            record["k"] = "o"
+        if is_admin:
+            record["a"] = 1
+        return record
+
+    def _write(self, record: dict) -> None:
+        if self._file is None:
+            # Řádkové bufferování: každý záznam je po zápisu v souboru i při pádu procesu
+            self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+            self._file.write(json.dumps({"v": RECORDING_VERSION, "started": round(time.time(), 3)}) + "\n")
+        self._file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    async def record(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        record = self.to_record(update)
+        if record is None:
+            return
+        try:
+            self._write(record)
+            self.recorded += 1
+        except OSError as e:
+            logger.error(f"TrafficRecorder: zápis do {self.path} selhal: {e}")
+
+    def register(self, application) -> None:
+        application.add_handler(TypeHandler(Update, self.record), group=RECORD_GROUP)
+        logger.info(f"TrafficRecorder: zaznamenávám provoz do {self.path}")
+
+
+def load_recording(path: str) -> list[dict]:
+    """Načte záznamy (bez hlaviček) seřazené podle času."""
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if "v" in record:
+                continue  # Hlavička jednoho běhu bota
+            records.append(record)
+    records.sort(key=lambda record: record["t"])
+    return records
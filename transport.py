@@ -0,0 +1,84 @@
+# transport.py
+# -*- coding: utf-8 -*-
+"""HTTP spojení s Bot API: oddělené pooly pro odesílání a polling.
+
+Bez nastavení používá Application.builder() HTTPXRequest s timeouty 5 s
+a čekáním na volné spojení jen 1 s - při nárazové rozesílce pak požadavky
+padají na "Pool timeout" místo toho, aby chvíli počkaly. Tady se oba pooly
+(odesílání i getUpdates) sestaví podle HTTP_* v config.py, včetně počtu
+keep-alive spojení a volitelného HTTP/2. Všechny pooly sdílí jeden SSL kontext
+(načtení certifikátů stojí desítky ms na každého klienta - zdržovalo start).
+
+Srovnání nastavení proti FakeBotApi: python bench_transport.py
+"""
+import importlib.util
+import logging
+import ssl
+
+import httpx
+from telegram.request import HTTPXRequest
+
+from config import (
+    HTTP_SEND_POOL_SIZE, HTTP_SEND_KEEPALIVE, HTTP_POLL_POOL_SIZE, HTTP_KEEPALIVE_EXPIRY,
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_WRITE_TIMEOUT, HTTP_POOL_TIMEOUT, HTTP_VERSION
+)
+
+logger = logging.getLogger(__name__)
+
+_ssl_context: ssl.SSLContext | None = None
+
+
+def shared_ssl_context() -> ssl.SSLContext:
+    """SSL kontext s certifikáty certifi, vytvořený jednou pro celý proces."""
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = httpx.create_ssl_context()
+    return _ssl_context
+
+
+def resolve_http_version(requested: str) -> str:
+    """"2" jen pokud je k dispozici balíček h2, jinak HTTP/1.1."""
+    if requested in ("2", "2.0"):
+        if importlib.util.find_spec("h2") is None:
+            logger.warning("HTTP_VERSION=2, ale chybí balíček h2 (python-telegram-bot[http2]) - používám HTTP/1.1.")
+            return "1.1"
+        return "2"
+    if requested != "1.1":
+        logger.warning(f"Neplatná HTTP_VERSION '{requested}', používám HTTP/1.1.")
+    return "1.1"
+
+
+def build_request(pool_size: int, keepalive: int | None = None, keepalive_expiry: float = HTTP_KEEPALIVE_EXPIRY,
+                  http_version: str = HTTP_VERSION, connect_timeout: float = HTTP_CONNECT_TIMEOUT,
+                  read_timeout: float = HTTP_READ_TIMEOUT, write_timeout: float = HTTP_WRITE_TIMEOUT,
+                  pool_timeout: float = HTTP_POOL_TIMEOUT) -> HTTPXRequest:
+    """HTTPXRequest s daným poolem; `keepalive` = kolik nečinných spojení nechat otevřených (výchozí celý pool)."""
+    keepalive = pool_size if keepalive is None else min(keepalive, pool_size)
+    limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=keepalive, keepalive_expiry=keepalive_expiry)
+    return HTTPXRequest(
+        connection_pool_size=pool_size,
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        write_timeout=write_timeout,
+        pool_timeout=pool_timeout,
+        http_version=resolve_http_version(http_version),
+        # Přepíše limity, které HTTPXRequest odvodí jen z velikosti poolu
+        httpx_kwargs={"limits": limits, "verify": shared_ssl_context()},
+    )
+
+
+def send_request(**overrides) -> HTTPXRequest:
+    """Pool pro odesílání podle konfigurace; `overrides` mění jednotlivé parametry (benchmark)."""
+    options = {"pool_size": HTTP_SEND_POOL_SIZE, "keepalive": HTTP_SEND_KEEPALIVE}
+    options.update(overrides)
+    return build_request(**options)
+
+
+def poll_request() -> HTTPXRequest:
+    """Pool pro getUpdates (read timeout si Bot.get_updates prodlužuje o timeout long pollingu sám)."""
+    return build_request(HTTP_POLL_POOL_SIZE)
+
+
+def configure(builder):
+    """Nastaví ApplicationBuilderu oba pooly."""
+    return builder.request(send_request()).get_updates_request(poll_request())
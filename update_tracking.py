@@ -0,0 +1,155 @@
+# update_tracking.py
+# -*- coding: utf-8 -*-
+"""Trvalé sledování zpracovaných updatů a jejich deduplikace.
+
+Telegram drží updaty, dokud je další getUpdates s vyšším offsetem nepotvrdí.
+Po pádu nebo restartu tak může přijít znovu update, který už handler
+zpracoval (a např. poslal zprávu). Tracker proto:
+
+- před handlery (skupina -1) zahodí update, jehož update_id už v okně je,
+- po handlerech (skupina 100) zapíše update_id do DB spolu s uloženým offsetem,
+- po startu potvrdí Telegramu vše do uloženého offsetu, aby nedošlo k záplavě opakování.
+
+Neblokující handler (block=False) běží jako úloha a skupina 100 na něj nečeká;
+callback obalený `finishes_update` proto update zapíše až po svém doběhnutí.
+Uložený offset není nejvyšší zpracované update_id, ale souvislá hranice: vše
+do něj včetně je dokončené, rozpracované updaty nad ní se po pádu doručí znovu.
+"""
+import asyncio
+import functools
+import logging
+from collections import deque
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes, TypeHandler
+
+from database import DEFAULT_TENANT, get_bot_state, get_recent_update_ids, mark_update_processed
+
+logger = logging.getLogger(__name__)
+
+GUARD_GROUP = -1
+COMMIT_GROUP = 100
+TRACKER_KEY = "update_tracker"  # Klíč trackeru v application.bot_data (pro finishes_update)
+
+
+class UpdateTracker:
+    """Okno posledních zpracovaných update_id v paměti, zrcadlené do DB (pro jednoho bota)."""
+
+    def __init__(self, window: int = 1000, prune_every: int = 100, tenant: str = DEFAULT_TENANT):
+        self.window = window
+        self.tenant = tenant
+        self.prune_every = prune_every
+        self._order: deque[int] = deque(maxlen=window)
+        self._seen: set[int] = set()
+        self._since_prune = 0
+        self._in_flight: set[int] = set()  # Updaty, které prošly guardem a ještě nedoběhly
+        self._deferred: set[int] = set()  # Z nich ty, které dokončí neblokující callback
+        self._waiters: dict[int, asyncio.Future] = {}
+        self._highest = 0  # Nejvyšší dokončené update_id
+        self.save_offset = True  # Ve workeru offset vede supervisor (updaty ostatních shardů nevidí)
+        self.duplicates = 0
+
+    def load(self) -> None:
+        """Načte okno z DB (volá se při startu)."""
+        for update_id in get_recent_update_ids(self.window, tenant=self.tenant):
+            self._remember(update_id)
+        logger.info(f"UpdateTracker[{self.tenant}]: načteno {len(self._seen)} zpracovaných updatů.")
+
+    @property
+    def last_update_id(self) -> int:
+        value = get_bot_state('last_update_id', tenant=self.tenant)
+        return int(value) if value else 0
+
+    def _remember(self, update_id: int) -> None:
+        if len(self._order) == self._order.maxlen:
+            self._seen.discard(self._order[0])
+        self._order.append(update_id)
+        self._seen.add(update_id)
+
+    def is_duplicate(self, update_id: int) -> bool:
+        return update_id in self._seen
+
+    @property
+    def watermark(self) -> int:
+        """Nejvyšší update_id, pod kterým (včetně) už nic nedobíhá."""
+        return min(self._in_flight) - 1 if self._in_flight else self._highest
+
+    async def mark_processed(self, update_id: int) -> None:
+        """Zapíše update jako zpracovaný; zápis do DB běží ve vlákně (ve workeru je to navíc IPC)."""
+        self._in_flight.discard(update_id)
+        self._deferred.discard(update_id)
+        self._highest = max(self._highest, update_id)
+        self._remember(update_id)
+        self._since_prune += 1
+        prune = self._since_prune >= self.prune_every
+        if prune:
+            self._since_prune = 0
+        await asyncio.to_thread(mark_update_processed, update_id, self.window, prune=prune, tenant=self.tenant,
+                                offset=self.watermark if self.save_offset else None)
+        waiter = self._waiters.pop(update_id, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def in_flight(self, update_id: int) -> bool:
+        return update_id in self._in_flight
+
+    def defer(self, update_id: int) -> None:
+        """Update dokončí neblokující callback (volá finishes_update), ne skupina 100."""
+        if update_id in self._in_flight:
+            self._deferred.add(update_id)
+
+    def when_finished(self, update_id: int) -> asyncio.Future:
+        """Future splněná po dokončení updatu; hotová hned, pokud nedobíhá (zahozený, duplicitní)."""
+        future = asyncio.get_running_loop().create_future()
+        if update_id in self._in_flight:
+            self._waiters[update_id] = future
+        else:
+            future.set_result(None)
+        return future
+
+    # --- Handlery pro Application ---
+    async def guard(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Zastaví zpracování updatu, který už byl jednou zpracován."""
+        if self.is_duplicate(update.update_id):
+            self.duplicates += 1
+            logger.info(f"UpdateTracker: update {update.update_id} už byl zpracován, přeskakuji.")
+            raise ApplicationHandlerStop
+        self._in_flight.add(update.update_id)
+
+    async def commit(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Po doběhnutí blokujících handlerů zapíše update jako zpracovaný."""
+        # Úloha neblokujícího handleru je naplánovaná dřív než pokračování commit; po jednom
+        # kroku smyčky už se přihlásila přes defer() (obalený callback to udělá hned na začátku)
+        await asyncio.sleep(0)
+        if update.update_id in self._in_flight and update.update_id not in self._deferred:
+            await self.mark_processed(update.update_id)
+
+    def register(self, application) -> None:
+        application.bot_data[TRACKER_KEY] = self
+        application.add_handler(TypeHandler(Update, self.guard), group=GUARD_GROUP)
+        application.add_handler(TypeHandler(Update, self.commit), group=COMMIT_GROUP)
+
+    async def acknowledge_processed(self, bot) -> None:
+        """Potvrdí Telegramu všechny updaty do uloženého offsetu (volá se v post_init)."""
+        last_update_id = self.last_update_id
+        if not last_update_id:
+            return
+        # getUpdates s offsetem označí všechny nižší updaty za doručené
+        await bot.get_updates(offset=last_update_id + 1, timeout=0, limit=1)
+        logger.info(f"UpdateTracker: potvrzeny updaty do {last_update_id}.")
+
+
+def finishes_update(callback):
+    """Obalí neblokující callback: update se zapíše jako zpracovaný až po jeho doběhnutí (i chybou)."""
+    @functools.wraps(callback)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        tracker = context.bot_data.get(TRACKER_KEY)
+        update_id = getattr(update, "update_id", None)
+        if tracker is None or not tracker.in_flight(update_id):
+            return await callback(update, context)
+        tracker.defer(update_id)
+        try:
+            return await callback(update, context)
+        finally:
+            await tracker.mark_processed(update_id)
+    return wrapper
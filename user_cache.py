@@ -0,0 +1,134 @@
+# user_cache.py
+# -*- coding: utf-8 -*-
+"""Write-through cache stavu uživatelů: profil, souhlas a aktivní účasti.
+
+Opakované příkazy stejného uživatele (/start, /moje_ucasti, /zrusit_ucast)
+tak nemusí do DB: profil se zapíše jen při změně (porovná se otisk jména
+a username), souhlas se čte z paměti a zapíše jen při změně, aktivní účasti
+se načtou jednou a drží do další změny účasti (bot.save_participation) nebo
+hromadné akce admina (potvrzení, archivace).
+
+Cache je omezená (LRU) a sdílená vlákny db_poolu, proto zámek. V režimu
+více procesů má každý worker vlastní - uživatel je vždy ve stejném workeru,
+hromadné invalidace rozesílá supervisor (viz workers.py).
+"""
+import threading
+from collections import OrderedDict
+
+from config import USER_CACHE_MAX
+
+_UNKNOWN = object()
+
+
+class UserState:
+    """Známý stav jednoho uživatele (_UNKNOWN = ještě nenačteno)."""
+
+    __slots__ = ("profile_hash", "consent", "participations")
+
+    def __init__(self):
+        self.profile_hash = None
+        self.consent = _UNKNOWN
+        self.participations: dict[str, list] = {}  # tenant -> aktivní účasti (řádky z DB)
+
+
+class UserStateCache:
+    """LRU cache UserState podle user_id."""
+
+    def __init__(self, max_users: int = 10000):
+        self.max_users = max_users
+        self._users: OrderedDict[int, UserState] = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0  # Roste s každou invalidací účastí (ochrana před zápisem zastaralého čtení)
+        self.stats = {"hits": 0, "misses": 0, "skipped_writes": 0}
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def _state(self, user_id: int) -> UserState:
+        # Volá se pod zámkem
+        state = self._users.get(user_id)
+        if state is None:
+            state = self._users[user_id] = UserState()
+            if len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return state
+
+    def _count(self, hit: bool) -> None:
+        self.stats["hits" if hit else "misses"] += 1
+
+    # --- Profil ---
+    @staticmethod
+    def profile_hash(first_name, last_name, username) -> int:
+        return hash((first_name or "", last_name or "", username or ""))
+
+    def profile_unchanged(self, user_id: int, first_name, last_name, username) -> bool:
+        """True, pokud je uložený profil stejný - zápis lze přeskočit."""
+        with self._lock:
+            unchanged = self._state(user_id).profile_hash == self.profile_hash(first_name, last_name, username)
+            if unchanged:
+                self.stats["skipped_writes"] += 1
+            return unchanged
+
+    def set_profile(self, user_id: int, first_name, last_name, username) -> None:
+        with self._lock:
+            self._state(user_id).profile_hash = self.profile_hash(first_name, last_name, username)
+
+    # --- Souhlas ---
+    def get_consent(self, user_id: int):
+        """Souhlas z cache, nebo _UNKNOWN (viz is_known)."""
+        with self._lock:
+            consent = self._state(user_id).consent
+            self._count(consent is not _UNKNOWN)
+            return consent
+
+    def consent_unchanged(self, user_id: int, consent_status: str) -> bool:
+        with self._lock:
+            unchanged = self._state(user_id).consent == consent_status
+            if unchanged:
+                self.stats["skipped_writes"] += 1
+            return unchanged
+
+    def set_consent(self, user_id: int, consent_status: str | None) -> None:
+        with self._lock:
+            self._state(user_id).consent = consent_status
+
+    # --- Aktivní účasti ---
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get_participations(self, user_id: int, tenant: str):
+        with self._lock:
+            participations = self._state(user_id).participations.get(tenant, _UNKNOWN)
+            self._count(participations is not _UNKNOWN)
+            return participations
+
+    def set_participations(self, user_id: int, tenant: str, participations: list, generation: int) -> None:
+        """Uloží účasti načtené z DB; `generation` z doby před čtením - mezitím invalidované se neuloží."""
+        with self._lock:
+            if generation == self._generation:
+                self._state(user_id).participations[tenant] = participations
+
+    def invalidate_participations(self, user_id: int | None = None) -> None:
+        """Zahodí účasti uživatele, nebo (bez user_id) všech uživatelů."""
+        with self._lock:
+            self._generation += 1
+            if user_id is None:
+                for state in self._users.values():
+                    state.participations.clear()
+            elif user_id in self._users:
+                self._users[user_id].participations.clear()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._users.clear()
+
+
+def is_known(value) -> bool:
+    return value is not _UNKNOWN
+
+
+# Sdílená cache pro celý proces (všichni boti)
+user_states = UserStateCache(max_users=USER_CACHE_MAX)
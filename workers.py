@@ -0,0 +1,455 @@
+# workers.py
+# -*- coding: utf-8 -*-
+"""Režim více procesů: supervisor a N workerů s rozdělením updatů podle user_id.
+
+Jeden proces zvládne jen jedno jádro (PTB dispatch, JSON collected_data,
+vykreslování zpráv). V tomto režimu:
+
+- supervisor stahuje updaty (getUpdates) bez jejich parsování a každý pošle
+  workeru `user_id % N` - updaty jednoho uživatele tak jdou vždy do stejného
+  procesu a ve stejném pořadí, takže sessions, konverzace a flood guard
+  zůstávají lokální,
+- worker je běžná Application (bot.build_application) bez polling updateru,
+- zápisy do DB (funkce označené @database.writes) workery posílají
+  supervisoru, který je provádí postupně v jednom vlákně - SQLite tak nemá
+  souběžné zapisovatele; čtení jde z workerů přímo (DB je ve WAL režimu),
+- po uzavření nebo archivaci výzev supervisor rozešle všem workerům
+  invalidaci cache šablon,
+- provoz (úlohy na pozadí, převzaté nákupy) workery převezmou až na pokyn
+  supervisoru, který nejdřív získá lease na polling (viz lifecycle.py);
+  při ukončení workery dozpracují frontu a uloží rozpracované nákupy,
+- workery hlásí dokončené updaty a supervisor z nich drží souvislou hranici
+  (UpdateWatermark): getUpdates potvrzuje Telegramu i offset v DB ukládá jen
+  do ní, takže updaty rozpracované v kterémkoli shardu se po pádu doručí znovu.
+
+Spuštění: WORKER_PROCESSES=4 python bot.py. Zátěžové měření: replay.py --workers N.
+"""
+import asyncio
+import contextlib
+import functools
+import logging
+import multiprocessing
+import signal
+import threading
+import warnings
+from collections import deque
+from concurrent.futures import Future
+from itertools import count
+
+import database
+
+logger = logging.getLogger(__name__)
+
+POLL_TIMEOUT = 30  # Long polling getUpdates (s)
+STOP_TIMEOUT = 30  # Jak dlouho čekat na doběhnutí workerů při ukončení
+
+
+def update_user_id(data: dict) -> int | None:
+    """user_id odesílatele z JSON updatu (supervisor updaty neparsuje přes de_json)."""
+    for key, value in data.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        user = value.get("from") or value.get("user")
+        if user:
+            return user["id"]
+        chat = value.get("chat")  # Např. channel_post bez odesílatele
+        if chat:
+            return chat["id"]
+    return None
+
+
+def shard_for(user_id: int | None, workers: int) -> int:
+    """Index workeru pro uživatele; updaty bez uživatele jdou na worker 0."""
+    return user_id % workers if user_id is not None else 0
+
+
+class UpdateWatermark:
+    """Souvislá hranice dokončených updatů jednoho bota napříč shardy (strana supervisoru).
+
+    `value` je nejvyšší update_id, pod kterým (včetně) už workery vše dokončily;
+    updaty nad ní se po pádu musí doručit znovu (duplicity zahodí UpdateTracker).
+    """
+
+    def __init__(self, value: int | None, tenant: str):
+        self.value = value
+        self.tenant = tenant
+        self.highest_routed = value
+        self.advanced = asyncio.Event()
+        self._routed: deque[int] = deque()  # Rozdělené a nedokončené, vzestupně
+        self._done: set[int] = set()  # Dokončené mimo pořadí (nad nejnižším nedokončeným)
+
+    @property
+    def offset(self) -> int | None:
+        """Offset pro getUpdates: potvrdí Telegramu jen dokončené updaty."""
+        return self.value + 1 if self.value is not None else None
+
+    @property
+    def pending(self) -> int:
+        return len(self._routed)
+
+    def is_new(self, update_id: int) -> bool:
+        """Update ještě nebyl rozdělen (getUpdates od hranice vrací i rozpracované)."""
+        return self.highest_routed is None or update_id > self.highest_routed
+
+    def route(self, update_id: int) -> None:
+        self._routed.append(update_id)
+        self.highest_routed = update_id
+
+    def done(self, update_id: int) -> None:
+        self._done.add(update_id)
+        if not self._routed or self._routed[0] not in self._done:
+            return
+        while self._routed and self._routed[0] in self._done:
+            self._done.discard(self._routed.popleft())
+        self.value = self._routed[0] - 1 if self._routed else self.highest_routed
+        self.advanced.set()
+
+
+class WriterClient:
+    """Proxy zápisů ve workeru: pošle volání supervisoru a počká na výsledek (volá se z vláken)."""
+
+    def __init__(self, worker_id: int, requests, responses):
+        self.worker_id = worker_id
+        self._requests = requests
+        self._responses = responses
+        self._ids = count()
+        self._waiting: dict[int, Future] = {}
+        self._lock = threading.Lock()
+        threading.Thread(target=self._receive, name="writer-responses", daemon=True).start()
+
+    def call(self, name: str, args: tuple, kwargs: dict):
+        request_id = next(self._ids)
+        future = Future()
+        with self._lock:
+            self._waiting[request_id] = future
+        self._requests.put((self.worker_id, request_id, name, args, kwargs))
+        return future.result()
+
+    def _receive(self) -> None:
+        while True:
+            request_id, ok, value = self._responses.get()
+            with self._lock:
+                future = self._waiting.pop(request_id)
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(RuntimeError(f"Zápis v supervisoru selhal: {value}"))
+
+
+class DatabaseWriter(threading.Thread):
+    """Jediný zapisovatel: provádí zápisové funkce z database.py postupně, jak přicházejí."""
+
+    def __init__(self, requests, responses: list, on_write=None):
+        super().__init__(name="db-writer", daemon=True)
+        self.requests = requests
+        self.responses = responses
+        self.on_write = on_write  # on_write(name, args, kwargs, result) po úspěšném zápisu
+        self.stats = {"writes": 0, "failed": 0}
+
+    def run(self) -> None:
+        while True:
+            item = self.requests.get()
+            if item is None:
+                break
+            worker_id, request_id, name, args, kwargs = item
+            try:
+                result = database.WRITE_FUNCTIONS[name](*args, **kwargs)
+                response = (request_id, True, result)
+                self.stats["writes"] += 1
+                if self.on_write is not None:
+                    self.on_write(name, args, kwargs, result)
+            except Exception as e:
+                logger.error(f"DatabaseWriter: {name} od workeru {worker_id} selhal: {e}")
+                response = (request_id, False, repr(e))
+                self.stats["failed"] += 1
+            self.responses[worker_id].put(response)
+
+
+class ShardRouter:
+    """Strana supervisoru: procesy workerů, jejich fronty a jediný zapisovatel.
+
+    Zprávy do workeru: ("update", index_bota, data), ("invalidate", call_id | None),
+    ("invalidate_participations",), ("invalidate_audience",), ("activate", počet_workerů), None = konec (drain).
+    Události z workerů (`events`): ("ready", worker_id) a s `report_done` i ("done", worker_id, index_bota, update_id)
+    - až po doběhnutí všech handlerů updatu, i neblokujících.
+    """
+
+    def __init__(self, workers: int, bot_configs: list[dict], base_url: str | None = None,
+                 report_done: bool = False, options: dict | None = None):
+        context = multiprocessing.get_context("spawn")  # Čistý proces bez zděděného event loopu a vláken
+        self.inboxes = [context.Queue() for _ in range(workers)]
+        self.events = context.Queue()
+        requests = context.Queue()
+        responses = [context.Queue() for _ in range(workers)]
+        self.writer = DatabaseWriter(requests, responses, on_write=self._after_write)
+        db_files = (database.DATABASE_FILE, database.ARCHIVE_DATABASE_FILE)
+        self.processes = [
+            context.Process(target=worker_main, name=f"dealup-worker-{worker_id}",
+                            args=(worker_id, bot_configs, self.inboxes[worker_id], requests, responses[worker_id],
+                                  self.events, db_files, base_url, report_done, options or {}))
+            for worker_id in range(workers)
+        ]
+        self.routed = [0] * workers
+
+    def start(self) -> None:
+        """Spustí zapisovatele a workery a počká, až budou všechny připravené (blokující)."""
+        self.writer.start()
+        for process in self.processes:
+            process.start()
+        for _ in self.processes:
+            kind, worker_id = self.events.get()
+            logger.info(f"Worker {worker_id} připraven.")
+
+    def activate(self) -> None:
+        """Workery převezmou provoz: nákupy předané předchozí instancí a úlohy na pozadí."""
+        self.broadcast(("activate", len(self.inboxes)))
+
+    def route(self, bot_index: int, data: dict) -> int:
+        worker_id = shard_for(update_user_id(data), len(self.inboxes))
+        self.inboxes[worker_id].put(("update", bot_index, data))
+        self.routed[worker_id] += 1
+        return worker_id
+
+    def broadcast(self, message) -> None:
+        for inbox in self.inboxes:
+            inbox.put(message)
+
+    def _after_write(self, name: str, args: tuple, kwargs: dict, result) -> None:
+        # Každý worker má vlastní cache šablon i stavu uživatelů - změněné výzvy a hromadně
+        # změněné účasti je třeba zahodit všude
+        if name == "close_call" and result:
+            self.broadcast(("invalidate", kwargs.get("call_id", args[0] if args else None)))
+        elif name == "add_new_call" and result:
+            self.broadcast(("invalidate", result))  # Nová výzva mění katalogy aktivních výzev
+        elif name == "archive_closed_calls":
+            self.broadcast(("invalidate", None))
+            self.broadcast(("invalidate_participations",))
+            self.broadcast(("invalidate_audience",))  # Archivace účasti maže, přírůstková obnova to nepozná
+        elif name == "confirm_call_participations":
+            self.broadcast(("invalidate_participations",))
+
+    def stop(self, timeout: float = STOP_TIMEOUT) -> None:
+        """Nechá workery dozpracovat frontu, ukončí je a nakonec i zapisovatele (blokující)."""
+        self.broadcast(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning(f"{process.name} neskončil včas, ukončuji ho.")
+                process.terminate()
+                process.join()
+        self.writer.requests.put(None)
+        self.writer.join()
+
+
+# --- Worker ---
+def worker_main(worker_id: int, bot_configs: list[dict], inbox, requests, responses, events,
+                db_files: tuple[str, str], base_url: str | None, report_done: bool, options: dict) -> None:
+    """Vstupní bod procesu workeru."""
+    # Ukončení řídí supervisor (None ve frontě), Ctrl+C skupiny procesů worker ignoruje
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    database.DATABASE_FILE, database.ARCHIVE_DATABASE_FILE = db_files
+    database.set_writer(WriterClient(worker_id, requests, responses))
+    asyncio.run(_run_worker(worker_id, bot_configs, inbox, events, base_url, report_done, options))
+
+
+async def _run_worker(worker_id: int, bot_configs: list[dict], inbox, events, base_url, report_done: bool, options: dict) -> None:
+    from telegram import Update
+    import bot  # Až po nastavení DB a zapisovatele
+    from tenants import Tenant
+
+    applications = []
+    trackers = []
+    for index, config in enumerate(bot_configs):
+        tenant = Tenant(config["tenant"], config["token"], config["admin_ids"], primary=worker_id == 0 and index == 0)
+        tenant.flood_guard.exempt_ids.update(options.get("flood_exempt_ids", ()))
+        tenant.update_tracker.save_offset = False  # Offset vede supervisor, worker vidí jen svůj shard
+        trackers.append(tenant.update_tracker)
+        application = bot.build_application(tenant, base_url=base_url)
+        if options.get("blocking"):
+            from replay import force_blocking
+            force_blocking(application)
+        await application.initialize()
+        await bot.prewarm(application)
+        applications.append(application)
+
+    # Fronta z jiného procesu se čte blokujícím get() ve vlákně a předává do event loopu
+    loop = asyncio.get_running_loop()
+    messages: asyncio.Queue = asyncio.Queue()
+
+    def pump() -> None:
+        while True:
+            message = inbox.get()
+            loop.call_soon_threadsafe(messages.put_nowait, message)
+            if message is None:
+                break
+
+    threading.Thread(target=pump, name="worker-inbox", daemon=True).start()
+    events.put(("ready", worker_id))
+
+    processed = 0
+    while True:
+        message = await messages.get()
+        if message is None:
+            break
+        if message[0] == "invalidate":
+            if message[1] is None:
+                bot.call_templates.clear()
+            else:
+                bot.call_templates.invalidate(message[1])
+            continue
+        if message[0] == "invalidate_participations":
+            bot.user_states.invalidate_participations()
+            continue
+        if message[0] == "invalidate_audience":
+            bot.audience_index.invalidate()
+            continue
+        if message[0] == "activate":
+            for application in applications:
+                # Přerušenou rozesílku dokončí jen worker 0, jinak by ji poslalo více procesů najednou
+                await bot.activate(application, deliver_pending=worker_id == 0, shard=worker_id, shards=message[1])
+                # Až po úlohách na pozadí - ty nekonečné pak stop() při ukončení nečeká (jako v run_fleet)
+                await application.start()
+            continue
+        _, bot_index, data = message
+        application = applications[bot_index]
+        done = functools.partial(events.put, ("done", worker_id, bot_index, data["update_id"]))
+        try:
+            await application.process_update(Update.de_json(data, application.bot))
+            finished = trackers[bot_index].when_finished(data["update_id"])  # Neblokující handler může ještě běžet
+        except Exception as e:
+            logger.error(f"Worker {worker_id}: update {data.get('update_id')} skončil chybou: {e}")
+            finished = None
+        processed += 1
+        if report_done:
+            if finished is None:
+                done()
+            else:
+                finished.add_done_callback(lambda _, done=done: done())
+
+    logger.info(f"Worker {worker_id}: zpracováno {processed} updatů, končím.")
+    await bot.drain(applications)
+    for application in applications:
+        await application.shutdown()
+
+
+# --- Supervisor ---
+def enable_wal() -> None:
+    """WAL: čtení z workerů neblokuje zápisy zapisovatele (nastavení je trvalé v souboru DB)."""
+    conn = database.get_db_connection()
+    mode = conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+    conn.close()
+    logger.info(f"Journal mode DB: {mode}")
+
+
+async def save_offset(watermark: UpdateWatermark) -> None:
+    if watermark.value is not None:
+        await asyncio.to_thread(database.save_update_offset, watermark.value, watermark.tenant)
+
+
+async def poll_updates(bot, bot_index: int, router: ShardRouter, watermark: UpdateWatermark) -> None:
+    """Long polling jednoho bota; updaty se neparsují, jen rozdělí workerům.
+
+    Offset je hranice dokončených updatů, ne poslední stažený: Telegram tak nepovažuje
+    za doručené nic, co workery ještě zpracovávají, a vrací to znovu - takové updaty
+    se přeskočí. Víc než ~100 rozpracovaných zároveň tak polling přirozeně přibrzdí.
+    """
+    from telegram import Update
+    from telegram.error import TelegramError
+
+    saved = watermark.value
+    while True:
+        if watermark.value != saved:
+            saved = watermark.value
+            await save_offset(watermark)
+        watermark.advanced.clear()
+        try:
+            updates = await bot.do_api_request(
+                "getUpdates",
+                api_kwargs={"offset": watermark.offset, "timeout": POLL_TIMEOUT, "allowed_updates": Update.ALL_TYPES},
+                read_timeout=POLL_TIMEOUT + 10,
+            )
+        except TelegramError as e:
+            logger.warning(f"Supervisor: getUpdates bota {bot_index} selhal: {e}")
+            await asyncio.sleep(1)
+            continue
+        fresh = [data for data in updates if watermark.is_new(data["update_id"])]
+        for data in fresh:
+            router.route(bot_index, data)
+            watermark.route(data["update_id"])
+        if updates and not fresh:
+            # Vrátily se jen rozpracované updaty - počkáme, až workery nějaký dokončí
+            with contextlib.suppress(TimeoutError):
+                await asyncio.wait_for(watermark.advanced.wait(), 1)
+
+
+async def run_supervisor(bot_configs: list[dict], workers: int, base_url: str | None = None) -> None:
+    """Spustí workery, po získání lease stahuje updaty všech botů a čeká na SIGINT/SIGTERM."""
+    from telegram import Bot
+    import transport
+    from config import HANDOFF_LEASE_SECONDS
+    from lifecycle import Handoff, StopRequested
+
+    # getUpdates voláme záměrně bez parsování (do_api_request), varování PTB k tomu je zbytečné
+    warnings.filterwarnings("ignore", message="Please use 'Bot.getUpdates'")
+    enable_wal()
+    handoff = Handoff(HANDOFF_LEASE_SECONDS)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, handoff.request_stop)
+    router = ShardRouter(workers, bot_configs, base_url=base_url, report_done=True)
+    await asyncio.to_thread(router.start)
+    watermarks: dict[int, UpdateWatermark] = {}
+
+    def read_events() -> None:
+        # Hlášení dokončených updatů z workerů (blokující get ve vlákně), None = konec
+        while (event := router.events.get()) is not None:
+            if event[0] == "done" and event[2] in watermarks:
+                loop.call_soon_threadsafe(watermarks[event[2]].done, event[3])
+
+    events_thread = threading.Thread(target=read_events, name="worker-events", daemon=True)
+    events_thread.start()
+
+    bots = [Bot(config["token"], request=transport.send_request(), get_updates_request=transport.poll_request(),
+                **({"base_url": base_url} if base_url else {})) for config in bot_configs]
+    for bot in bots:
+        await bot.initialize()
+    try:
+        await handoff.acquire()  # Záloha tu čeká s připravenými workery
+    except StopRequested:
+        logger.info("Supervisor: ukončeno dřív, než instance převzala provoz.")
+        for bot in bots:
+            await bot.shutdown()
+        await asyncio.to_thread(router.stop)
+        router.events.put(None)
+        return
+    for index, config in enumerate(bot_configs):
+        # Pokračujeme za hranicí dokončených updatů (ukládá ji supervisor, i předchozí instance)
+        tenant = config["tenant"] or database.DEFAULT_TENANT
+        last_update_id = database.get_bot_state("last_update_id", tenant=tenant)
+        watermarks[index] = UpdateWatermark(int(last_update_id) if last_update_id else None, tenant)
+    router.activate()
+
+    pollers = [asyncio.create_task(poll_updates(bot, index, router, watermarks[index])) for index, bot in enumerate(bots)]
+    logger.info(f"Supervisor: {len(bots)} bot(ů), {workers} workerů, polling běží.")
+    await handoff.stop_requested.wait()
+
+    logger.info("Supervisor: zastavuji polling a čekám na workery...")
+    for poller in pollers:
+        poller.cancel()
+    await asyncio.gather(*pollers, return_exceptions=True)
+    await asyncio.to_thread(router.stop)  # Workery dozpracují frontu a uloží rozpracované nákupy
+    router.events.put(None)
+    await asyncio.to_thread(events_thread.join)
+    await asyncio.sleep(0)  # Poslední hlášení předaná přes call_soon_threadsafe
+    for index, bot in enumerate(bots):
+        watermark = watermarks[index]
+        if watermark.pending:
+            logger.warning(f"Supervisor: bot {index} má {watermark.pending} nedokončených updatů, doručí se znovu.")
+        if watermark.offset is not None:
+            # Potvrdí Telegramu jen dokončené updaty
+            await bot.do_api_request("getUpdates", api_kwargs={"offset": watermark.offset, "timeout": 0, "limit": 1})
+            await save_offset(watermark)
+        await bot.shutdown()
+    await handoff.release()
+    logger.info(f"Supervisor: rozděleno updatů {router.routed}, zápisů {router.writer.stats}.")